@@ -0,0 +1,246 @@
+# aio_runtime.py
+"""
+Runtime asyncio per il bot live (RUNTIME=async).
+- Un solo event loop serve tutti i simboli di SYMBOLS (una tab Trade per simbolo, vedi bot_oro.trade_tab_for;
+  con SHEET_SHARDS le tab stanno su più file, vedi sheet_shards.py)
+- Prezzi di tutti i simboli con UNA richiesta Binance (ticker/price?symbols=[...])
+- Le chiamate bloccanti (gspread, python-binance, requests) girano in thread via adattatori async
+  con timeout; il simbolo corrente viaggia nel contextvar di bot_oro, copiato nel thread
+- Per ogni simbolo, in sequenza (condividono l'indice righe della tab): riconciliazione, archiviazione,
+  aggiornamento righe, aperture; i simboli girano in parallelo tra loro
+- Su timeout il thread non si può fermare: il simbolo resta occupato (lock rilasciato dal thread quando la
+  chiamata torna davvero) e i suoi giri si saltano fino ad allora, così due passi non si sovrappongono
+- Notifiche via notification_bus (publish non bloccante, invio nel thread del bus): non rallentano le scritture
+- SIGTERM/SIGINT: stop del loop, svuotamento del bus notifiche
+Variabili opzionali:
+  AIO_CALL_TIMEOUT   (default 30)  timeout per chiamata Sheets
+  AIO_PRICE_TIMEOUT  (default 10)  timeout lettura prezzi
+  AIO_NOTIFY_TIMEOUT (default 15)  attesa massima per le notifiche in coda all'arresto
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+import threading
+from typing import Optional
+
+import bot_oro
+import metrics
+from notification_bus import get_bus
+from bot_oro import fmt_dec
+
+AIO_CALL_TIMEOUT   = float(os.getenv("AIO_CALL_TIMEOUT", "30"))
+AIO_PRICE_TIMEOUT  = float(os.getenv("AIO_PRICE_TIMEOUT", "10"))
+AIO_NOTIFY_TIMEOUT = float(os.getenv("AIO_NOTIFY_TIMEOUT", "15"))
+
+
+async def call(fn, *args, timeout: float = AIO_CALL_TIMEOUT, guard: Optional[threading.Lock] = None, **kwargs):
+    """
+    Adattatore async per una funzione bloccante: thread + timeout (su timeout il risultato viene abbandonato).
+    guard: lock preso qui e rilasciato dal thread alla fine di fn, anche se nel frattempo è scaduto il timeout.
+    """
+    if guard is None:
+        return await asyncio.wait_for(asyncio.to_thread(fn, *args, **kwargs), timeout)
+    if not guard.acquire(blocking=False):
+        raise RuntimeError(f"{fn.__name__}: chiamata precedente ancora in corso")
+
+    def run():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            guard.release()
+    return await asyncio.wait_for(asyncio.to_thread(run), timeout)
+
+
+class SymbolState:
+    def __init__(self, symbol: str, ws_trade):
+        self.symbol = symbol
+        self.ws_trade = ws_trade
+        self.H = None
+        self.col_ping = None
+        self.last_reconcile = 0.0
+        self.last_archive = 0.0
+        self.busy = threading.Lock()   # preso da una chiamata del simbolo fino al ritorno del suo thread
+
+
+class AsyncRuntime:
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.states = {}
+        self.ws_log_base = None
+        self.client = None
+        self.last_prices = {}
+        self.stop = None
+
+    @property
+    def ws_log(self):
+        return bot_oro.rotate_log_ws(self.ws_log_base)
+
+    # --- prezzi ---
+    def fetch_prices_blocking(self) -> dict:
+        now_ts = bot_oro._now()
+        metrics.inc("bot_binance_requests_total", help_text="Letture prezzo verso Binance")
+        try:
+            if len(self.symbols) == 1:
+                data = [self.client.get_symbol_ticker(symbol=self.symbols[0])]
+            else:
+                data = self.client.get_symbol_ticker(symbols=json.dumps(self.symbols, separators=(",", ":")))
+            out = {}
+            for row in data:
+                sym = row["symbol"]
+                out[sym] = bot_oro.record_tick(now_ts, bot_oro.d(row["price"]), "live", sym)
+            self.last_prices.update({k: v for k, v in out.items() if v != 0})
+            if self.last_prices.get(bot_oro.SYMBOL):
+                bot_oro._PRICE_CACHE = self.last_prices[bot_oro.SYMBOL]
+                bot_oro._PRICE_CACHE_TS = now_ts
+            return out
+        except Exception as e:
+            bot_oro.note_binance_ban(str(e), now_ts)
+            metrics.inc("bot_binance_errors_total", help_text="Errori API Binance")
+            print(f"[BINANCE] {e}")
+            return dict(self.last_prices)
+
+    async def fetch_prices(self) -> dict:
+        try:
+            return await call(self.fetch_prices_blocking, timeout=AIO_PRICE_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("[BINANCE] timeout lettura prezzi")
+            return dict(self.last_prices)
+
+    # --- avvio ---
+    async def start_symbol(self, st: SymbolState, lastp):
+        bot_oro._SYMBOL_CTX.set(st.symbol)
+        ws_log = self.ws_log
+        # una sola lettura della tab: header, colonna ping, riconciliazione e chiusure manuali
+        rows = await call(st.ws_trade.get_all_values)
+        header = bot_oro.header_from_rows(st.ws_trade, rows)
+        st.H = bot_oro.build_header_map(header)
+        st.col_ping = bot_oro.col_in_header(header, "Ultimo ping", st.ws_trade.title)
+        await call(bot_oro.sheet_changed, st.ws_trade, st.H)   # checksum di riferimento
+        await call(bot_oro.reconcile_pass, st.ws_trade, ws_log, st.H, st.symbol, rows=rows)
+        st.last_reconcile = bot_oro._now()
+        if bot_oro.AUTO_OPEN_ON_START and lastp:
+            try:
+                await call(bot_oro.open_new_trade, st.ws_trade, ws_log,
+                           trade_id=bot_oro.trade_ids().next(st.symbol, "A"),
+                           side="LONG", H=st.H, col_ping=st.col_ping, entry_price=lastp)
+            except Exception as e:
+                await call(bot_oro.log, ws_log, "ERROR", f"Apertura automatica fallita ({st.symbol}): {e}")
+
+    async def start(self):
+        ws_trade, self.ws_log_base = await call(bot_oro.open_sheets)
+        self.client = await call(bot_oro.binance_client)
+        tabs = await call(bot_oro.open_trade_tabs, self.symbols, ws_trade)   # anche su più shard
+        await call(bot_oro.spool_attach, *tabs, self.ws_log_base)   # journal di un processo precedente
+        for sym, ws in zip(self.symbols, tabs):
+            self.states[sym] = SymbolState(sym, ws)
+
+        await call(bot_oro.log, self.ws_log, "INFO",
+                   f"{bot_oro.BOT_VERSION} - RUNTIME=async - SYMBOLS={','.join(self.symbols)} - "
+                   f"TABS=({','.join(st.ws_trade.title for st in self.states.values())}) - "
+                   f"POLL={bot_oro.POLL_SECONDS}s")
+        prices = await self.fetch_prices()
+        await asyncio.gather(*(self.start_symbol(st, prices.get(sym)) for sym, st in self.states.items()))
+
+    # --- giro ---
+    async def symbol_cycle(self, st: SymbolState, lastp):
+        bot_oro._SYMBOL_CTX.set(st.symbol)
+        ws_log = self.ws_log
+        if not lastp:
+            await call(bot_oro.log, ws_log, "WARN", f"Prezzo 0 da Binance ({st.symbol})")
+            return
+
+        now = bot_oro._now()
+        steps = []
+        if now - st.last_reconcile >= bot_oro.RECONCILE_MIN_SECONDS:
+            steps.append((bot_oro.reconcile_if_changed, (st.ws_trade, ws_log, st.H, st.symbol), {}))
+            st.last_reconcile = now
+        if bot_oro.ARCHIVE_MIN_AGE_DAYS > 0 and now - st.last_archive >= bot_oro.ARCHIVE_EVERY_SECONDS:
+            steps.append((bot_oro.archive_closed_trades, (st.ws_trade, ws_log, st.H), {}))
+            st.last_archive = now
+        steps.append((bot_oro.update_open_rows_light, (st.ws_trade, ws_log, None, st.H, st.col_ping),
+                      {"lastp": lastp}))
+        steps.append((bot_oro.ensure_min_open_trades, (st.ws_trade, ws_log, None),
+                      dict(H=st.H, col_ping=st.col_ping, min_trades=bot_oro.MIN_OPEN_TRADES,
+                           side=bot_oro.AUTO_TRADE_SIDE.upper(), qty=bot_oro.DEFAULT_QTY, last_price=lastp)))
+
+        for fn, args, kwargs in steps:
+            if st.busy.locked():
+                # thread di una chiamata scaduta ancora al lavoro sulla tab: niente passi sovrapposti
+                print(f"[ASYNC] {st.symbol}: chiamata precedente ancora in corso, giro saltato")
+                metrics.inc("bot_symbol_cycles_skipped_total", labels={"symbol": st.symbol},
+                            help_text="Giri di un simbolo saltati perché una chiamata scaduta è ancora in corso")
+                break
+            try:
+                await call(fn, *args, guard=st.busy, **kwargs)
+            except Exception as e:
+                await call(bot_oro.log, ws_log, "ERROR", f"[{st.symbol}] {fn.__name__}: {type(e).__name__}: {e}")
+
+    async def cycle(self):
+        t0 = time.perf_counter()
+        if bot_oro._now() < bot_oro._BINANCE_BANNED_UNTIL:
+            ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bot_oro._BINANCE_BANNED_UNTIL))
+            await call(bot_oro.log, self.ws_log, "WARN",
+                       f"Binance bannato fino a {ts}. Sleep {bot_oro.BANNED_FALLBACK_SLEEP}s")
+            return bot_oro.BANNED_FALLBACK_SLEEP
+
+        prices = await self.fetch_prices()
+        results = await asyncio.gather(*(self.symbol_cycle(st, prices.get(sym)) for sym, st in self.states.items()),
+                                       return_exceptions=True)
+        for sym, res in zip(self.states, results):
+            if isinstance(res, BaseException):   # un simbolo fallito non ferma gli altri, ma si conta
+                metrics.inc("bot_cycle_errors_total", help_text="Eccezioni nel giro principale")
+                print(f"[ASYNC] {sym}: {type(res).__name__}: {res}")
+        if bot_oro._FIRST_EVAL_SECONDS is None:
+            await call(bot_oro.note_first_evaluation, self.ws_log)
+
+        lastp = prices.get(bot_oro.SYMBOL) or next(iter(prices.values()), 0)
+        if lastp and bot_oro.should_log_heartbeat(lastp):
+            # un campione per simbolo nel buffer (blocco nella tab di stato, scritto col prossimo batch)
+            for sym, p in prices.items():
+                if p:
+                    bot_oro.heartbeats().add(sym, p, time.perf_counter() - t0)
+            if bot_oro.HEARTBEAT_TO_LOG:
+                await call(bot_oro.log, self.ws_log, "INFO",
+                           "Heartbeat OK - " + " ".join(f"{k}={fmt_dec(v)}" for k, v in prices.items() if v))
+        return bot_oro.POLL_SECONDS
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(sig, self.stop.set)
+            except NotImplementedError:
+                pass
+        try:
+            await self.start()
+            while not self.stop.is_set():
+                t0 = time.perf_counter()
+                try:
+                    wait = await self.cycle()
+                except Exception as e:
+                    metrics.inc("bot_cycle_errors_total", help_text="Eccezioni nel giro principale")
+                    print(f"[ASYNC] {e}")
+                    wait = bot_oro.POLL_SECONDS
+                metrics.set_gauge("bot_cycle_seconds", time.perf_counter() - t0, help_text="Durata dell'ultimo giro")
+                metrics.inc("bot_cycles_total", help_text="Giri del loop principale")
+                try:
+                    await asyncio.wait_for(self.stop.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await asyncio.to_thread(get_bus().close, AIO_NOTIFY_TIMEOUT)
+
+
+def run_async():
+    if bot_oro.EXECUTION_MODE == "oco":
+        raise RuntimeError("EXECUTION_MODE=oco è supportata solo dal runtime seriale (RUNTIME=serial)")
+    if metrics.start_server():
+        bot_oro.register_metrics()
+    asyncio.run(AsyncRuntime(bot_oro.SYMBOLS).run())
+
+
+if __name__ == "__main__":
+    run_async()
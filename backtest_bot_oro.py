@@ -1,11 +1,16 @@
 """
 BACKTEST BOT ORO (paper trading)
 - Strumento: PAXGUSDT (cambia in XAUTUSDT se disponibile su Binance)
-- Regole: SL -0.5%, TP1 +1% (chiude 50%), TP2 +2% (chiude il resto)
+- Regole (EXIT_RULES): SL -0.5%, TP1 +1%, TP2 +2%. "ladder" (default) come il bot live: chiusura
+  totale al primo livello toccato; "partial": TP1 chiude il 50%, TP2 o SL il resto
 - Max posizioni contemporanee: 5
-- Capitale per ingresso: 1 USDT (auto-adeguamento a minNotional simulato)
+- Capitale per ingresso: 1 USDT (auto-adeguamento al minNotional reale del simbolo)
+- Filtri exchange (LOT_SIZE / MIN_NOTIONAL) dal registro condiviso exchange_filters
 - Fee: 0.10% taker per lato (configurabile)
-- Dati: candele storiche Binance (pubbliche), timeframe 5m per default
+- Dati: candele storiche Binance (pubbliche), timeframe 5m per default, lette e simulate a blocchi
+  (BacktestRun): la memoria resta costante anche su storici di anni
+- KPI di rischio (drawdown MTM, Sharpe/Sortino, esposizione, durate) calcolati in numpy a valle
+  della simulazione dalla curva equity per barra (backtest_metrics)
 - Output: KPI in console + (opzionale) scrittura su Google Sheet (sheet "Report" + "Trade")
   Variabili d’ambiente per Google Sheet:
     - GOOGLE_CREDENTIALS  (JSON intero della service account)
@@ -15,21 +20,29 @@ BACKTEST BOT ORO (paper trading)
     - SYMBOL              (default "PAXGUSDT")
     - TIMEFRAME           (default "5m")  es. "1m","5m","15m"
     - BASE_NOTIONAL_USDT  (default 1.0)
+    - KLINE_CACHE         (default 1)  0 = scarica ogni timeframe da Binance senza archivio locale
+    - EXIT_RULES          (default "ladder")  stesse uscite del bot live (strategy_core); "partial" = TP1 parziale
+    - MC_SIMS, MC_CANDLE_SIMS, ... (analisi di robustezza, vedi backtest_robustness.py)
 """
 
 import os
-import math
 import json
 from dataclasses import dataclass
 from typing import List, Optional, Dict, Any
 
+from decimal import Decimal
+
 import numpy as np
-from binance.client import Client
+
+from exchange_filters import SymbolFilters, get_filters
+from backtest_metrics import EquityCurve, bars_per_year, events_from_log, trade_kpis
+from strategy_core import HIT_NAMES, ladder, partial_exits, round_step, targets
 
 # --- Parametri bot (puoi anche metterli via env) ---
 SYMBOL = os.getenv("SYMBOL", "PAXGUSDT")
 TIMEFRAME = os.getenv("TIMEFRAME", "5m")
 BACKTEST_DAYS = int(os.getenv("BACKTEST_DAYS", "30"))
+KLINE_CACHE = os.getenv("KLINE_CACHE", "1") == "1"   # archivio locale 1m + ricampionamento (kline_store)
 
 BASE_NOTIONAL_USDT = float(os.getenv("BASE_NOTIONAL_USDT", "1.0"))
 MAX_OPEN_POS = 5
@@ -39,10 +52,14 @@ TP1_PCT = 0.010   # 1.0%
 TP2_PCT = 0.020   # 2.0%
 TP1_PARTIAL = 0.50
 TAKER_FEE = 0.001  # 0.10% per lato
+# Regole di uscita (strategy_core): ladder  = come il bot live: TP2, TP1, SL, chiusura totale al livello
+#                                   partial = TP1 parziale, poi SL/TP2 sul restante (regola storica del backtest)
+EXIT_RULES = os.getenv("EXIT_RULES", "ladder").lower()
 
-# Simuliamo un minNotional realistico di Binance sul simbolo (se 1 USDT < minNotional, alziamo)
-# Nota: per semplicità lo stimiamo a 10 USDT; se vuoi leggere il vero filtro: client.get_symbol_info
-SIM_MIN_NOTIONAL = 10.0
+# Filtri reali del simbolo dal registro exchange_filters (se 1 USDT < minNotional, alziamo).
+# Solo se il registro non è disponibile (offline, nessuna copia su disco) si usano questi valori stimati.
+FALLBACK_FILTERS = SymbolFilters(step=Decimal("0.00001"), min_qty=Decimal("0"),
+                                 tick=Decimal("0.01"), min_notional=Decimal("10"))
 
 # --- Google Sheet (opzionale) ---
 USE_SHEETS = False
@@ -89,21 +106,21 @@ class SheetWriter:
         ws.update("A1", data, value_input_option="USER_ENTERED")
 
 # ------------------ Dati storici ------------------
+def iter_klines(symbol: str, interval: str, days: int):
+    """
+    Candele degli ultimi `days` giorni a blocchi di array (kline_store), per BacktestRun.feed.
+    Con KLINE_CACHE=1 (default) passano dall'archivio locale 1m, un mese alla volta, con download
+    ripreso da dove si era fermato; con KLINE_CACHE=0 vengono da Binance a pagine, senza archivio.
+    """
+    from kline_store import days_start, iter_days, iter_remote
+    if KLINE_CACHE:
+        return iter_days(symbol, interval, days)
+    return iter_remote(symbol, interval, days_start(days))
+
 def load_klines(symbol: str, interval: str, days: int):
-    client = Client(api_key="", api_secret="")  # public endpoints
-    kl = client.get_historical_klines(symbol, interval, f"{days} day ago UTC")
-    # Binance ritorna: [open_time, open, high, low, close, volume, close_time, ...]
-    arr = []
-    for r in kl:
-        arr.append({
-            "ts": int(r[0]),
-            "open": float(r[1]),
-            "high": float(r[2]),
-            "low": float(r[3]),
-            "close": float(r[4]),
-            "volume": float(r[5]),
-        })
-    return arr
+    """Candele degli ultimi `days` giorni come lista di dict (tutta la serie in memoria)."""
+    from kline_store import to_dicts
+    return [c for chunk in iter_klines(symbol, interval, days) for c in to_dicts(chunk)]
 
 # ------------------ Strategia d’ingresso ------------------
 def ma_cross_signal(closes: np.ndarray, fast: int = 20, slow: int = 50) -> Optional[str]:
@@ -133,8 +150,261 @@ class Position:
     pnl_usdt: float = 0.0
     took_tp1: bool = False
 
-def round_step(value: float, step: float) -> float:
-    return math.floor(value / step) * step
+class PositionBook:
+    """Posizioni del backtest in array paralleli (valutate a lotti da strategy_core); Position solo a fine run."""
+
+    def __init__(self, capacity: int = 64):
+        self.n = 0
+        self._open: List[int] = []   # indici aperti, in ordine di apertura
+        self._open_arr = None
+        self._alloc(capacity)
+
+    @property
+    def n_open(self) -> int:
+        return len(self._open)
+
+    def _alloc(self, cap: int):
+        old = self.__dict__.copy()
+        for name in ("entry", "qty", "remaining", "tp1", "tp2", "sl", "pnl_usdt", "open_time", "close_time"):
+            arr = np.zeros(cap)
+            if name in old:
+                arr[:self.n] = old[name][:self.n]
+            setattr(self, name, arr)
+        for name in ("took_tp1", "closed"):
+            arr = np.zeros(cap, dtype=bool)
+            if name in old:
+                arr[:self.n] = old[name][:self.n]
+            setattr(self, name, arr)
+
+    def add(self, ts, entry, qty, tp1, tp2, sl) -> int:
+        if self.n == len(self.entry):
+            self._alloc(2 * len(self.entry))
+        k = self.n
+        self.entry[k], self.qty[k], self.remaining[k] = entry, qty, qty
+        self.tp1[k], self.tp2[k], self.sl[k] = tp1, tp2, sl
+        self.open_time[k] = ts
+        self.n += 1
+        self._open.append(k)
+        self._open_arr = None
+        return k
+
+    def open_idx(self) -> np.ndarray:
+        if self._open_arr is None:
+            self._open_arr = np.array(self._open, dtype=np.int64)
+        return self._open_arr
+
+    def close(self, k, ts, pnl):
+        self.closed[k] = True
+        self.remaining[k] = 0.0
+        self.close_time[k] = ts
+        self.pnl_usdt[k] += pnl
+        self._open.remove(k)
+        self._open_arr = None
+
+    def positions(self) -> List[Position]:
+        return [Position(open_time=int(self.open_time[k]), entry=float(self.entry[k]), qty=float(self.qty[k]),
+                         remaining_qty=float(self.remaining[k]), tp1=float(self.tp1[k]), tp2=float(self.tp2[k]),
+                         sl=float(self.sl[k]), closed=bool(self.closed[k]),
+                         close_time=int(self.close_time[k]) if self.closed[k] else None,
+                         pnl_usdt=float(self.pnl_usdt[k]), took_tp1=bool(self.took_tp1[k]))
+                for k in range(self.n)]
+
+def symbol_filters(symbol: str) -> SymbolFilters:
+    try:
+        f = get_filters(symbol)
+    except Exception as e:
+        print(f"[WARN] Filtri exchange non disponibili ({e})")
+        f = None
+    if f is None:
+        print(f"[WARN] Filtri di {symbol} non trovati: uso i valori stimati {FALLBACK_FILTERS}")
+        return FALLBACK_FILTERS
+    return f
+
+_MA_TAIL = 52   # close da portare tra un blocco e l'altro: ma_cross_signal guarda le ultime slow+2
+
+class BacktestRun:
+    """
+    Simulazione a blocchi di candele: feed() per ogni blocco (lista di dict o array kline_store),
+    finish() a fine storico. Tra un blocco e l'altro restano solo posizioni (PositionBook), stato
+    della curva equity (EquityCurve), coda dei close per le medie e PnL realizzato: la memoria non
+    cresce con la lunghezza dello storico (solo con il numero di trade).
+    """
+
+    def __init__(self, base_notional: float, max_open: int, sl_pct: float, tp1_pct: float, tp2_pct: float,
+                 tp1_partial: float, taker_fee: float, filters: Optional[SymbolFilters] = None,
+                 keep_curve: bool = True):
+        self.base_notional, self.max_open = base_notional, max_open
+        self.sl_pct, self.tp1_pct, self.tp2_pct = sl_pct, tp1_pct, tp2_pct
+        self.tp1_partial, self.taker_fee = tp1_partial, taker_fee
+        # Filtri exchange del simbolo (passo qty, minimi)
+        filters = filters or FALLBACK_FILTERS
+        self.qty_step = float(filters.step)
+        self.min_qty = float(filters.min_qty)
+        self.min_notional = float(filters.min_notional)
+
+        self.trade_log: List[Dict[str, Any]] = []
+        self.book = PositionBook()
+        # KPI trackers (drawdown & co. a valle, sulla curva per barra)
+        self.realized_pnl = 0.0
+        self.curve = EquityCurve(bars_per_year(TIMEFRAME), keep_curve=keep_curve)
+        self.bars = 0                       # barre già processate (indice globale "i")
+        self.tail = np.empty(0)             # ultimi close del blocco precedente
+        self.last_px = None
+        self.last_ts = None
+        self._pend_close = None             # close dell'ultima barra, non ancora nella curva
+        self._curve_log = 0                 # primo evento del trade_log non ancora nella curva
+        self._exits: Dict[int, list] = {}   # regola ladder: barra globale -> uscite già trovate sul percorso
+
+    def _log(self, i, ts, action, k, px, qty, pnl):
+        self.trade_log.append({"ts": ts, "i": i, "action": action, "price": px, "qty": float(qty),
+                               "pnl": float(pnl), "entry": float(self.book.entry[k]), "pos": int(k)})
+
+    def _close_qty(self, k, px, qty):
+        e = self.book.entry[k]
+        return qty * (px - e) - (e + px) * qty * self.taker_fee
+
+    def _schedule_exits(self, ks: np.ndarray, path: np.ndarray, first_i: int):
+        """
+        Regola ladder: l'uscita dipende solo dal prezzo, quindi una sola chiamata strategy_core sul
+        percorso del blocco trova per ogni posizione la prima barra con un trigger (e il P&L al livello).
+        Le posizioni senza trigger nel blocco si rivalutano sul blocco successivo.
+        """
+        if not len(ks) or not len(path):
+            return
+        book = self.book
+        qty = round_step(book.remaining[ks], self.qty_step)
+        r = ladder(book.entry[ks], np.ones(len(ks), dtype=bool), path,
+                   self.tp1_pct, self.tp2_pct, self.sl_pct, qty=qty)
+        for jj in np.flatnonzero(r["bar"] >= 0):
+            self._exits.setdefault(first_i + int(r["bar"][jj]), []).append(
+                (int(ks[jj]), int(r["hit"][jj]), float(r["close"][jj]), float(qty[jj]), float(r["pnl_val"][jj])))
+
+    def feed(self, candles):
+        if isinstance(candles, dict):
+            ts_arr, closes = candles["ts"], np.asarray(candles["close"], dtype=float)
+        else:
+            ts_arr = [c["ts"] for c in candles]
+            closes = np.array([c["close"] for c in candles], dtype=float)
+        n = len(closes)
+        if n == 0:
+            return
+        book, fee, step = self.book, self.taker_fee, self.qty_step
+        buf = np.concatenate((self.tail, closes))
+        off = len(self.tail)
+        ladder_rule = EXIT_RULES == "ladder"
+        if ladder_rule:
+            self._schedule_exits(book.open_idx(), closes, self.bars)
+
+        for j in range(n):
+            i = self.bars + j
+            px = float(closes[j])
+            ts = int(ts_arr[j])
+
+            # 1) Gestione posizioni aperte (SL/TP)
+            if ladder_rule:
+                # uscite già trovate sul percorso (_schedule_exits), P&L lordo da strategy_core
+                for k, hit, close_px, qty_close, gross in self._exits.pop(i, ()):
+                    pnl = gross - (book.entry[k] + close_px) * qty_close * fee
+                    self.realized_pnl += pnl
+                    book.close(k, ts, pnl)
+                    self._log(i, ts, f"{HIT_NAMES[hit]} close", k, close_px, qty_close, pnl)
+            else:
+                # una chiamata strategy_core per tutte le aperte, al prezzo della barra
+                idx = book.open_idx()
+                if len(idx):
+                    r = partial_exits(book.entry[idx], book.tp1[idx], book.tp2[idx], book.sl[idx],
+                                      book.took_tp1[idx], book.remaining[idx], px, self.tp1_partial, step, fee)
+                    for jj in np.flatnonzero(r["tp1_hit"] | r["sl_hit"] | r["tp2_hit"]):
+                        k = idx[jj]
+                        if r["tp1_hit"][jj]:
+                            self.realized_pnl += r["tp1_pnl"][jj]
+                            self._log(i, ts, "TP1 partial", k, px, r["tp1_qty"][jj], r["tp1_pnl"][jj])
+                        if r["sl_hit"][jj] or r["tp2_hit"][jj]:
+                            self.realized_pnl += r["final_pnl"][jj]
+                            book.close(k, ts, r["final_pnl"][jj])
+                            self._log(i, ts, "SL close" if r["sl_hit"][jj] else "TP2 close", k, px,
+                                      r["final_qty"][jj], r["final_pnl"][jj])
+                    book.remaining[idx] = r["remaining"]
+                    book.took_tp1[idx] = r["took_tp1"]
+
+            # 2) Segnale ingresso (una nuova posizione per barra se segnale e cap non superato)
+            signal = ma_cross_signal(buf[:off + j + 1])
+            if signal == "BUY" and book.n_open < self.max_open:
+                # adegua al minNotional del simbolo
+                notional = max(self.base_notional, self.min_notional)
+                qty = notional / px
+                # arrotondando per difetto si scenderebbe sotto il minimo: un passo in più
+                qty = float(round_step(qty, step))
+                if step > 0 and qty * px < self.min_notional:
+                    qty += step
+                if qty > 0 and qty >= self.min_qty:
+                    tp1, tp2, sl = targets(px, self.tp1_pct, self.tp2_pct, self.sl_pct)
+                    # fee ingresso (solo per calcolo PnL cumulato)
+                    entry_fee = px * qty * fee
+                    self.realized_pnl -= entry_fee  # contabilizzo costo d’ingresso
+                    k = book.add(ts, px, qty, tp1, tp2, sl)
+                    self._log(i, ts, "OPEN", k, px, qty, -entry_fee)
+                    if ladder_rule:
+                        self._schedule_exits(np.array([k]), closes[j + 1:], i + 1)
+
+        self.last_px, self.last_ts = float(closes[-1]), int(ts_arr[-1])
+        self.tail = buf[-_MA_TAIL:].copy()
+        # curva equity: l'ultima barra resta in sospeso (a fine storico riceve le FORCE CLOSE)
+        pend = [] if self._pend_close is None else [self._pend_close]
+        self._update_curve(np.concatenate((pend, closes[:-1])), self.bars - len(pend))
+        self._pend_close = float(closes[-1])
+        self.bars += n
+
+    def _update_curve(self, closes, start):
+        """Barre [start, start+len(closes)) nella curva, con i soli eventi non ancora contati."""
+        end = start + len(closes)
+        self.curve.update(closes, *events_from_log(self.trade_log[self._curve_log:], start=start, end=end))
+        k = len(self.trade_log)
+        while k > self._curve_log and self.trade_log[k - 1]["i"] >= end:
+            k -= 1
+        self._curve_log = k
+
+    def finish(self) -> Dict[str, Any]:
+        book = self.book
+        # Chiudi eventuali posizioni rimaste alla fine al prezzo dell’ultima barra (mark-to-market)
+        if not self.bars:
+            raise RuntimeError("Nessuna candela da simulare.")
+        last_i, last_px, last_ts = self.bars - 1, self.last_px, self.last_ts
+        for k in book.open_idx():
+            if book.remaining[k] > 0:
+                qty_close = round_step(book.remaining[k], self.qty_step)
+                pnl = self._close_qty(k, last_px, qty_close)
+                self.realized_pnl += pnl
+                book.close(k, last_ts, pnl)
+                self._log(last_i, last_ts, "FORCE CLOSE", k, last_px, qty_close, pnl)
+        self._update_curve(np.array([self._pend_close]), last_i)
+
+        positions = book.positions()
+
+        # KPI finali: array per posizione chiusa + curva equity per barra
+        closed = [p for p in positions if p.closed]
+        pnl = np.fromiter((p.pnl_usdt for p in closed), dtype=float, count=len(closed))
+        open_ts = np.fromiter((p.open_time for p in closed), dtype=float, count=len(closed))
+        close_ts = np.fromiter((p.close_time for p in closed), dtype=float, count=len(closed))
+
+        tp1_share = f" ({int(TP1_PARTIAL*100)}%)" if EXIT_RULES == "partial" else ""   # ladder: chiude tutto
+        kpis = {
+            "Symbol": SYMBOL,
+            "Timeframe": TIMEFRAME,
+            "Giorni": BACKTEST_DAYS,
+            "Trade aperti": len(positions),
+            **trade_kpis(pnl, open_ts, close_ts),
+            "PNL totale (USDT)": round(self.realized_pnl, 2),
+            **self.curve.kpis(),
+            "Regole": f"{EXIT_RULES}: SL {SL_PCT*100:.1f}%, TP1 {TP1_PCT*100:.1f}%{tp1_share}, TP2 {TP2_PCT*100:.1f}%, MaxPos {MAX_OPEN_POS}, Fee {TAKER_FEE*100:.2f}%",
+        }
+
+        return {
+            "kpis": kpis,
+            "positions": positions,
+            "trade_log": self.trade_log,
+            "equity_curve": self.curve.curve(),
+        }
 
 def simulate_backtest(candles: List[Dict[str, float]],
                       base_notional: float,
@@ -143,189 +413,50 @@ def simulate_backtest(candles: List[Dict[str, float]],
                       tp1_pct: float,
                       tp2_pct: float,
                       tp1_partial: float,
-                      taker_fee: float) -> Dict[str, Any]:
-
-    closes = np.array([c["close"] for c in candles], dtype=float)
-    positions: List[Position] = []
-    trade_log: List[Dict[str, Any]] = []
-
-    # Stima step size/precisione (semplificata): 1e-5 di qty
-    QTY_STEP = 1e-5
-
-    # KPI trackers
-    realized_pnl = 0.0
-    equity = 0.0
-    peak_equity = 0.0
-    max_drawdown = 0.0
-    wins = 0
-    losses = 0
-
-    for i, c in enumerate(candles):
-        px = c["close"]
-
-        # 1) Gestione posizioni aperte (SL/TP)
-        for p in positions:
-            if p.closed:
-                continue
-            # TP1
-            if not p.took_tp1 and px >= p.tp1:
-                qty_close = p.remaining_qty * tp1_partial
-                qty_close = round_step(qty_close, QTY_STEP)
-                if qty_close > 0:
-                    gross = qty_close * (px - p.entry)
-                    fees = (p.entry + px) * qty_close * taker_fee
-                    pnl = gross - fees
-                    realized_pnl += pnl
-                    p.remaining_qty -= qty_close
-                    p.took_tp1 = True
-                    trade_log.append({
-                        "ts": c["ts"], "action": "TP1 partial",
-                        "price": px, "qty": qty_close, "pnl": pnl
-                    })
-            # SL (sul restante)
-            if not p.closed and px <= p.sl:
-                qty_close = p.remaining_qty
-                qty_close = round_step(qty_close, QTY_STEP)
-                if qty_close > 0:
-                    gross = qty_close * (px - p.entry)
-                    fees = (p.entry + px) * qty_close * taker_fee
-                    pnl = gross - fees
-                    realized_pnl += pnl
-                    p.remaining_qty = 0.0
-                    p.closed = True
-                    p.close_time = c["ts"]
-                    p.pnl_usdt += pnl
-                    trade_log.append({
-                        "ts": c["ts"], "action": "SL close",
-                        "price": px, "qty": qty_close, "pnl": pnl
-                    })
-            # TP2 (sul restante)
-            if not p.closed and px >= p.tp2:
-                qty_close = p.remaining_qty
-                qty_close = round_step(qty_close, QTY_STEP)
-                if qty_close > 0:
-                    gross = qty_close * (px - p.entry)
-                    fees = (p.entry + px) * qty_close * taker_fee
-                    pnl = gross - fees
-                    realized_pnl += pnl
-                    p.remaining_qty = 0.0
-                    p.closed = True
-                    p.close_time = c["ts"]
-                    p.pnl_usdt += pnl
-                    trade_log.append({
-                        "ts": c["ts"], "action": "TP2 close",
-                        "price": px, "qty": qty_close, "pnl": pnl
-                    })
-
-        # 2) Segnale ingresso (una nuova posizione per barra se segnale e cap non superato)
-        open_count = sum(0 if p.closed else 1 for p in positions)
-        signal = ma_cross_signal(closes[:i+1])
-        if signal == "BUY" and open_count < max_open:
-            notional = base_notional
-            # adegua al minNotional simulato
-            if notional < SIM_MIN_NOTIONAL:
-                notional = SIM_MIN_NOTIONAL
-            qty = notional / px
-            qty = round_step(qty, QTY_STEP)
-            if qty > 0:
-                tp1 = px * (1 + tp1_pct)
-                tp2 = px * (1 + tp2_pct)
-                sl  = px * (1 - sl_pct)
-                # fee ingresso (solo per calcolo PnL cumulato)
-                entry_fee = px * qty * taker_fee
-                realized_pnl -= entry_fee  # contabilizzo costo d’ingresso
-                new_pos = Position(
-                    open_time=c["ts"], entry=px, qty=qty, remaining_qty=qty,
-                    tp1=tp1, tp2=tp2, sl=sl
-                )
-                positions.append(new_pos)
-                trade_log.append({
-                    "ts": c["ts"], "action": "OPEN", "price": px, "qty": qty, "pnl": -entry_fee
-                })
-
-        # 3) Equity / drawdown su base PnL realizzato
-        equity = realized_pnl
-        peak_equity = max(peak_equity, equity)
-        dd = (peak_equity - equity)
-        max_drawdown = max(max_drawdown, dd)
-
-    # Chiudi eventuali posizioni rimaste alla fine al prezzo dell’ultima barra (mark-to-market)
-    last_px = candles[-1]["close"]
-    for p in positions:
-        if not p.closed and p.remaining_qty > 0:
-            qty_close = round_step(p.remaining_qty, QTY_STEP)
-            gross = qty_close * (last_px - p.entry)
-            fees = (p.entry + last_px) * qty_close * taker_fee
-            pnl = gross - fees
-            realized_pnl += pnl
-            p.closed = True
-            p.remaining_qty = 0.0
-            p.close_time = candles[-1]["ts"]
-            p.pnl_usdt += pnl
-            trade_log.append({
-                "ts": candles[-1]["ts"], "action": "FORCE CLOSE",
-                "price": last_px, "qty": qty_close, "pnl": pnl
-            })
-
-    # KPI finali
-    closed = [p for p in positions if p.closed]
-    for p in closed:
-        if p.pnl_usdt >= 0:
-            wins += 1
-        else:
-            losses += 1
-
-    total_trades = len([t for t in trade_log if t["action"] == "OPEN"])
-    win_rate = (wins / max(1, len(closed))) * 100.0
-    avg_win = np.mean([p.pnl_usdt for p in closed if p.pnl_usdt > 0]) if wins else 0.0
-    avg_loss = np.mean([p.pnl_usdt for p in closed if p.pnl_usdt < 0]) if losses else 0.0
-    expectancy = (win_rate/100.0) * avg_win + (1 - win_rate/100.0) * avg_loss
-
-    kpis = {
-        "Symbol": SYMBOL,
-        "Timeframe": TIMEFRAME,
-        "Giorni": BACKTEST_DAYS,
-        "Trade aperti": total_trades,
-        "Posizioni chiuse": len(closed),
-        "Win rate %": round(win_rate, 2),
-        "PNL totale (USDT)": round(realized_pnl, 2),
-        "Avg win (USDT)": round(avg_win, 3),
-        "Avg loss (USDT)": round(avg_loss, 3),
-        "Expectancy per trade (USDT)": round(expectancy, 3),
-        "Max drawdown (USDT)": round(max_drawdown, 2),
-        "Regole": f"SL {SL_PCT*100:.1f}%, TP1 {TP1_PCT*100:.1f}% ({int(TP1_PARTIAL*100)}%), TP2 {TP2_PCT*100:.1f}%, MaxPos {MAX_OPEN_POS}, Fee {TAKER_FEE*100:.2f}%",
-    }
-
-    return {
-        "kpis": kpis,
-        "positions": positions,
-        "trade_log": trade_log,
-    }
+                      taker_fee: float,
+                      filters: Optional[SymbolFilters] = None) -> Dict[str, Any]:
+    """Tutta la serie in un blocco (candele in memoria); per storici lunghi usare BacktestRun a blocchi."""
+    run = BacktestRun(base_notional, max_open, sl_pct, tp1_pct, tp2_pct, tp1_partial, taker_fee, filters)
+    run.feed(candles)
+    return run.finish()
 
 # ------------------ Main ------------------
 def main():
-    print(f"[INFO] Scarico candele {SYMBOL} {TIMEFRAME} ultimi {BACKTEST_DAYS} giorni…")
-    candles = load_klines(SYMBOL, TIMEFRAME, BACKTEST_DAYS)
-    if len(candles) < 100:
+    from backtest_robustness import MC_CANDLE_SIMS, MC_SIMS, robustness_report, print_report, trade_pnl
+    from kline_store import concat
+
+    filters = symbol_filters(SYMBOL)
+    print(f"[INFO] Filtri {SYMBOL}: {filters}")
+
+    print(f"[INFO] Scarico candele {SYMBOL} {TIMEFRAME} ultimi {BACKTEST_DAYS} giorni e simulo a blocchi…")
+    run = BacktestRun(base_notional=BASE_NOTIONAL_USDT, max_open=MAX_OPEN_POS, sl_pct=SL_PCT,
+                      tp1_pct=TP1_PCT, tp2_pct=TP2_PCT, tp1_partial=TP1_PARTIAL, taker_fee=TAKER_FEE,
+                      filters=filters)
+    # il block bootstrap delle candele ricampiona tutta la serie: solo in quel caso la teniamo in memoria,
+    # come colonne numpy (48 byte a barra), non come lista di dict
+    parts = [] if MC_SIMS > 0 and MC_CANDLE_SIMS > 0 else None
+    for chunk in iter_klines(SYMBOL, TIMEFRAME, BACKTEST_DAYS):
+        run.feed(chunk)
+        if parts is not None:
+            parts.append(chunk)
+    candles = concat(*parts) if parts else None
+    if run.bars < 100:
         raise RuntimeError("Pochi dati storici recuperati.")
-
-    print("[INFO] Avvio simulazione…")
-    result = simulate_backtest(
-        candles=candles,
-        base_notional=BASE_NOTIONAL_USDT,
-        max_open=MAX_OPEN_POS,
-        sl_pct=SL_PCT,
-        tp1_pct=TP1_PCT,
-        tp2_pct=TP2_PCT,
-        tp1_partial=TP1_PARTIAL,
-        taker_fee=TAKER_FEE,
-    )
+    result = run.finish()
 
     kpis = result["kpis"]
     print("\n=== KPI Backtest ===")
     for k, v in kpis.items():
         print(f"- {k}: {v}")
 
+    # Robustezza: bootstrap/shuffle dei trade + block bootstrap delle candele (MC_SIMS=0 per saltare)
+    if MC_SIMS > 0:
+        print_report(robustness_report(
+            trade_pnl(result["trade_log"]), candles=candles,
+            sim_params=dict(base_notional=BASE_NOTIONAL_USDT, max_open=MAX_OPEN_POS, sl_pct=SL_PCT,
+                            tp1_pct=TP1_PCT, tp2_pct=TP2_PCT, tp1_partial=TP1_PARTIAL,
+                            taker_fee=TAKER_FEE, filters=filters)))
+
     # Output su Google Sheet (opzionale)
     if USE_SHEETS:
         try:
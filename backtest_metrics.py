@@ -0,0 +1,156 @@
+# backtest_metrics.py
+"""
+Metriche dei backtest calcolate in numpy a valle della simulazione (niente max() per barra nel loop)
+- Curva equity mark-to-market per barra: PnL realizzato cumulato + posizione aperta valutata al close
+  (qty aperta e costo d'ingresso cumulati dagli eventi del trade_log, per indice di barra "i")
+- Drawdown (MTM e solo realizzato) con durata in barre, Sharpe/Sortino annualizzati sugli incrementi
+  per barra dell'equity (in USDT: il backtest non ha un capitale di partenza), esposizione e tempo
+  a mercato, distribuzione delle durate dei trade
+- EquityCurve porta lo stato tra un blocco di barre e il successivo: stesso risultato su tutta la
+  serie o a pezzi (backtest su storici che non stanno in memoria)
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_EPS_QTY = 1e-12   # residui float dopo chiusure parziali
+
+
+def bars_per_year(timeframe: str) -> float:
+    unit = {"m": 60, "h": 3600, "d": 86400, "w": 604800}[timeframe[-1]]
+    return 365 * 86400 / (int(timeframe[:-1]) * unit)
+
+
+def events_from_log(trade_log: List[Dict], start: int = 0, end: Optional[int] = None):
+    """
+    trade_log -> array per evento (barra relativa a start, Δqty, Δcosto, pnl).
+    OPEN aggiunge qty e costo (qty*entry), ogni chiusura li toglie; pnl è quello registrato (fee incluse).
+    """
+    ev = [t for t in trade_log if t["i"] >= start and (end is None or t["i"] < end)]
+    i = np.fromiter((t["i"] - start for t in ev), dtype=np.int64, count=len(ev))
+    sign = np.fromiter((1.0 if t["action"] == "OPEN" else -1.0 for t in ev), dtype=float, count=len(ev))
+    qty = np.fromiter((t["qty"] for t in ev), dtype=float, count=len(ev))
+    entry = np.fromiter((t["entry"] for t in ev), dtype=float, count=len(ev))
+    pnl = np.fromiter((t["pnl"] for t in ev), dtype=float, count=len(ev))
+    return i, sign * qty, sign * qty * entry, pnl
+
+
+class EquityCurve:
+    """Stato delle metriche per barra, aggiornabile a blocchi con update()."""
+
+    def __init__(self, bars_year: float, keep_curve: bool = True):
+        self.bars_year = bars_year
+        self.keep_curve = keep_curve
+        self.curves: List[np.ndarray] = []
+        self.bars = 0
+        # posizione / PnL a fine blocco precedente
+        self.qty = 0.0
+        self.cost = 0.0
+        self.realized = 0.0
+        self.last_eq = 0.0
+        # drawdown
+        self.peak = 0.0
+        self.peak_bar = -1
+        self.max_dd = 0.0
+        self.max_dd_bars = 0
+        self.realized_peak = 0.0
+        self.max_dd_realized = 0.0
+        # incrementi per barra (Sharpe/Sortino)
+        self.sum_r = 0.0
+        self.sumsq_r = 0.0
+        self.down_sumsq = 0.0
+        # esposizione
+        self.exposed_bars = 0
+        self.notional_sum = 0.0
+
+    def update(self, closes: np.ndarray, ev_i, ev_dqty, ev_dcost, ev_pnl) -> np.ndarray:
+        """Aggiunge un blocco di barre (close) con i suoi eventi (indici relativi al blocco)."""
+        n = len(closes)
+        if n == 0:
+            return np.empty(0)
+        dq = np.zeros(n); dc = np.zeros(n); dp = np.zeros(n)
+        np.add.at(dq, ev_i, ev_dqty)
+        np.add.at(dc, ev_i, ev_dcost)
+        np.add.at(dp, ev_i, ev_pnl)
+        qty = self.qty + np.cumsum(dq)
+        qty[np.abs(qty) < _EPS_QTY] = 0.0
+        cost = self.cost + np.cumsum(dc)
+        realized = self.realized + np.cumsum(dp)
+        eq = realized + qty * closes - cost
+        eq[qty == 0] = realized[qty == 0]   # a posizione chiusa l'equity è solo il realizzato
+
+        # drawdown MTM + durata (barre dall'ultimo massimo)
+        peak = np.maximum.accumulate(np.concatenate(([self.peak], eq)))[1:]
+        self.max_dd = max(self.max_dd, float((peak - eq).max()))
+        bars = np.arange(self.bars, self.bars + n)
+        last_peak = np.maximum.accumulate(np.where(eq >= peak, bars, self.peak_bar))
+        self.max_dd_bars = max(self.max_dd_bars, int((bars - last_peak).max()))
+        self.peak, self.peak_bar = float(peak[-1]), int(last_peak[-1])
+
+        # drawdown del solo realizzato
+        rpeak = np.maximum.accumulate(np.concatenate(([self.realized_peak], realized)))[1:]
+        self.max_dd_realized = max(self.max_dd_realized, float((rpeak - realized).max()))
+        self.realized_peak = float(rpeak[-1])
+
+        r = np.diff(eq, prepend=self.last_eq)
+        self.sum_r += float(r.sum())
+        self.sumsq_r += float(r @ r)
+        neg = np.minimum(r, 0.0)
+        self.down_sumsq += float(neg @ neg)
+
+        open_mask = qty > 0
+        self.exposed_bars += int(open_mask.sum())
+        self.notional_sum += float((qty * closes).sum())
+
+        self.qty, self.cost, self.realized = float(qty[-1]), float(cost[-1]), float(realized[-1])
+        self.last_eq = float(eq[-1])
+        self.bars += n
+        if self.keep_curve:
+            self.curves.append(eq)
+        return eq
+
+    def curve(self) -> np.ndarray:
+        return np.concatenate(self.curves) if self.curves else np.empty(0)
+
+    def kpis(self) -> Dict[str, float]:
+        n = max(1, self.bars)
+        mean = self.sum_r / n
+        std = np.sqrt(max(0.0, self.sumsq_r / n - mean * mean))
+        down = np.sqrt(self.down_sumsq / n)
+        ann = np.sqrt(self.bars_year)
+        return {
+            "Max drawdown (USDT)": round(self.max_dd_realized, 2),
+            "Max drawdown MTM (USDT)": round(self.max_dd, 2),
+            "Durata max drawdown (barre)": self.max_dd_bars,
+            "Sharpe (annualizzato)": round(float(mean / std * ann), 3) if std > 0 else 0.0,
+            "Sortino (annualizzato)": round(float(mean / down * ann), 3) if down > 0 else 0.0,
+            "Tempo a mercato %": round(self.exposed_bars / n * 100.0, 2),
+            "Esposizione media (USDT)": round(self.notional_sum / n, 2),
+        }
+
+
+def trade_kpis(pnl: np.ndarray, open_ts: np.ndarray, close_ts: np.ndarray) -> Dict[str, float]:
+    """KPI per posizione chiusa (pnl, timestamp ms di apertura/chiusura) senza liste intermedie."""
+    n = len(pnl)
+    wins = pnl >= 0
+    n_win = int(wins.sum())
+    win_rate = n_win / max(1, n) * 100.0
+    avg_win = float(pnl[pnl > 0].mean()) if n_win and (pnl > 0).any() else 0.0
+    avg_loss = float(pnl[pnl < 0].mean()) if (pnl < 0).any() else 0.0
+    expectancy = (win_rate / 100.0) * avg_win + (1 - win_rate / 100.0) * avg_loss
+    out = {
+        "Posizioni chiuse": n,
+        "Win rate %": round(win_rate, 2),
+        "Avg win (USDT)": round(avg_win, 3),
+        "Avg loss (USDT)": round(avg_loss, 3),
+        "Expectancy per trade (USDT)": round(expectancy, 3),
+    }
+    if n:
+        minutes = (close_ts - open_ts) / 60000.0
+        p50, p90 = np.percentile(minutes, [50, 90])
+        out.update({
+            "Durata trade p50 (min)": round(float(p50), 1),
+            "Durata trade p90 (min)": round(float(p90), 1),
+            "Durata trade max (min)": round(float(minutes.max()), 1),
+        })
+    return out
@@ -0,0 +1,177 @@
+# backtest_robustness.py
+"""
+Robustezza dei backtest: quanto del risultato è bordo e quanto fortuna del singolo percorso.
+- Bootstrap dei trade: n trade estratti con reinserimento dai PnL netti delle posizioni chiuse
+  -> intervalli di confidenza di PnL totale, max drawdown e win rate
+- Shuffle dei trade: stessi trade in ordine casuale (PnL invariato) -> distribuzione del drawdown
+- Block bootstrap delle candele: serie sintetiche a blocchi di rendimenti (conserva la volatilità a
+  grappoli), ogni serie ripassa per simulate_backtest -> stessi intervalli su mercati "alternativi"
+- Simulazioni vettoriali in numpy a lotti (matrice simulazioni x trade), divise tra processi con
+  ProcessPoolExecutor; ogni lotto ha un seme figlio di SeedSequence: risultati riproducibili e
+  indipendenti dal numero di processi
+Variabili opzionali:
+  MC_SIMS          (default 10000)  simulazioni bootstrap/shuffle dei trade (0 = analisi spenta)
+  MC_CANDLE_SIMS   (default 200)    serie sintetiche per il block bootstrap delle candele (0 = spento)
+  MC_BLOCK_BARS    (default 288)    lunghezza blocco in barre (288 = un giorno a 5m)
+  MC_WORKERS       (default n. CPU) processi
+  MC_CI            (default 95)     livello degli intervalli di confidenza, in %
+  MC_SEED          (default casuale)
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MC_SIMS        = int(os.getenv("MC_SIMS", "10000"))
+MC_CANDLE_SIMS = int(os.getenv("MC_CANDLE_SIMS", "200"))
+MC_BLOCK_BARS  = int(os.getenv("MC_BLOCK_BARS", "288"))
+MC_WORKERS     = int(os.getenv("MC_WORKERS", str(os.cpu_count() or 1)))
+MC_CI          = float(os.getenv("MC_CI", "95"))
+MC_SEED        = int(os.getenv("MC_SEED")) if os.getenv("MC_SEED") else None
+
+_BATCH = 2000   # simulazioni per matrice: 2000 x n_trade float64 resta sotto le decine di MB
+# simulazioni per lotto (un seme ciascuno): fissi, così il risultato non dipende da MC_WORKERS
+_LOT_TRADES = 1000
+_LOT_CANDLES = 5
+
+
+def trade_pnl(trade_log) -> np.ndarray:
+    """
+    PnL netto per posizione (fee d'ingresso, TP1 parziale e chiusura), nell'ordine di apertura,
+    sommando gli eventi del trade_log per "pos". A fine backtest ogni posizione è chiusa.
+    """
+    pos = np.fromiter((t["pos"] for t in trade_log), dtype=np.int64, count=len(trade_log))
+    pnl = np.fromiter((t["pnl"] for t in trade_log), dtype=float, count=len(trade_log))
+    return np.bincount(pos, weights=pnl) if len(pos) else np.empty(0)
+
+
+def _path_stats(paths: np.ndarray) -> Dict[str, np.ndarray]:
+    """paths: simulazioni x trade (PnL per trade) -> PnL totale, max drawdown, win rate per riga."""
+    cum = np.cumsum(paths, axis=1)
+    peak = np.maximum.accumulate(np.maximum(cum, 0.0), axis=1)   # si parte da equity 0
+    return {
+        "pnl": cum[:, -1],
+        "max_dd": (peak - cum).max(axis=1),
+        "win_rate": (paths >= 0).mean(axis=1) * 100.0,
+    }
+
+
+def _trades_worker(pnl: np.ndarray, n_sims: int, seed, shuffle: bool) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    out: Dict[str, List[np.ndarray]] = {}
+    for start in range(0, n_sims, _BATCH):
+        m = min(_BATCH, n_sims - start)
+        if shuffle:
+            idx = np.argsort(rng.random((m, len(pnl))), axis=1)
+        else:
+            idx = rng.integers(0, len(pnl), size=(m, len(pnl)))
+        for k, v in _path_stats(pnl[idx]).items():
+            out.setdefault(k, []).append(v)
+    return {k: np.concatenate(v) for k, v in out.items()}
+
+
+def _columns(candles) -> Dict[str, np.ndarray]:
+    """Candele come colonne numpy (Klines di kline_store); accetta anche la vecchia lista di dict."""
+    if isinstance(candles, dict):
+        return candles
+    return {k: np.array([c[k] for c in candles], dtype=np.int64 if k == "ts" else float)
+            for k in ("ts", "open", "high", "low", "close", "volume")}
+
+
+def block_bootstrap_candles(candles, block: int, rng) -> Dict[str, np.ndarray]:
+    """
+    Serie sintetica della stessa lunghezza: blocchi di barre consecutive presi a caso (con
+    reinserimento) e ricuciti sui rapporti open/high/low/close rispetto al close precedente.
+    Lavora sugli indici delle colonne: nessuna lista di dict, la serie resta un Klines.
+    """
+    k = _columns(candles)
+    close = np.asarray(k["close"], dtype=float)
+    n = len(close)
+    first_open = float(k["open"][0])
+    prev = np.concatenate(([first_open], close[:-1]))
+    rel = np.stack([np.asarray(k[f], dtype=float) / prev for f in ("open", "high", "low", "close")], axis=1)
+    block = max(1, min(block, n))
+    starts = rng.integers(0, n - block + 1, size=-(-n // block))
+    idx = (starts[:, None] + np.arange(block)[None, :]).ravel()[:n]
+    rel = rel[idx]
+    new_close = first_open * np.cumprod(rel[:, 3])
+    new_prev = np.concatenate(([first_open], new_close[:-1]))
+    ohlc = rel * new_prev[:, None]
+    return {"ts": k["ts"], "open": ohlc[:, 0], "high": ohlc[:, 1], "low": ohlc[:, 2], "close": ohlc[:, 3],
+            "volume": np.asarray(k["volume"], dtype=float)[idx]}
+
+
+def _candles_worker(candles, params: dict, block: int, n_sims: int, seed) -> Dict[str, np.ndarray]:
+    from backtest_bot_oro import simulate_backtest
+    rng = np.random.default_rng(seed)
+    out = {"pnl": [], "max_dd": [], "win_rate": []}
+    for _ in range(n_sims):
+        res = simulate_backtest(block_bootstrap_candles(candles, block, rng), **params)
+        pnl = trade_pnl(res["trade_log"])
+        out["pnl"].append(float(pnl.sum()))
+        out["max_dd"].append(res["kpis"]["Max drawdown (USDT)"])
+        out["win_rate"].append(float((pnl >= 0).mean() * 100.0) if len(pnl) else 0.0)
+    return {k: np.array(v) for k, v in out.items()}
+
+
+def _split(n_sims: int, lot: int) -> List[int]:
+    return [min(lot, n_sims - i) for i in range(0, n_sims, lot)]
+
+
+def _run_parallel(fn, args_before: tuple, n_sims: int, lot: int, seed_seq: np.random.SeedSequence,
+                  workers: int, extra: tuple = ()) -> Dict[str, np.ndarray]:
+    sizes = _split(n_sims, lot)
+    seeds = seed_seq.spawn(len(sizes))
+    if workers <= 1:
+        parts = [fn(*args_before, n, s, *extra) for n, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(fn, *zip(*[(*args_before, n, s, *extra) for n, s in zip(sizes, seeds)])))
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def confidence(values: Dict[str, np.ndarray], ci: float = MC_CI) -> Dict[str, Dict[str, float]]:
+    lo, hi = (100 - ci) / 2, 100 - (100 - ci) / 2
+    out = {}
+    for k, v in values.items():
+        q = np.percentile(v, [lo, 50, hi])
+        out[k] = {"lo": round(float(q[0]), 4), "mediana": round(float(q[1]), 4), "hi": round(float(q[2]), 4)}
+    return out
+
+
+def robustness_report(pnl: np.ndarray, candles=None,
+                      sim_params: Optional[dict] = None, n_sims: int = MC_SIMS,
+                      n_candle_sims: int = MC_CANDLE_SIMS, block: int = MC_BLOCK_BARS,
+                      workers: int = MC_WORKERS, ci: float = MC_CI, seed: Optional[int] = MC_SEED) -> dict:
+    """
+    pnl: PnL netti dei trade chiusi (trade_pnl). candles (Klines a colonne, o lista di dict) + sim_params
+    (argomenti di simulate_backtest oltre alle candele) abilitano il block bootstrap delle candele.
+    """
+    root = np.random.SeedSequence(seed)
+    s_boot, s_shuffle, s_candles = root.spawn(3)
+    report = {"ci": ci, "trade": len(pnl), "seed": root.entropy}
+    if n_sims > 0 and len(pnl) > 0:
+        boot = _run_parallel(_trades_worker, (pnl,), n_sims, _LOT_TRADES, s_boot, workers, (False,))
+        report["bootstrap"] = confidence(boot, ci)
+        shuffled = _run_parallel(_trades_worker, (pnl,), n_sims, _LOT_TRADES, s_shuffle, workers, (True,))
+        report["shuffle"] = confidence({"max_dd": shuffled["max_dd"]}, ci)
+    if n_candle_sims > 0 and candles is not None and sim_params is not None:
+        # colonne numpy: ai processi si passano pochi array contigui, non una lista di dict per barra
+        candles = _columns(candles)
+    if n_candle_sims > 0 and candles is not None and sim_params is not None and len(candles["ts"]):
+        report["candele"] = confidence(
+            _run_parallel(_candles_worker, (candles, sim_params, block), n_candle_sims, _LOT_CANDLES,
+                          s_candles, workers), ci)
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n=== Robustezza (IC {report['ci']:g}%, {report['trade']} trade, seed {report['seed']}) ===")
+    labels = {"bootstrap": "Bootstrap trade", "shuffle": "Shuffle trade", "candele": "Block bootstrap candele"}
+    for key, label in labels.items():
+        if key not in report:
+            continue
+        print(f"- {label}:")
+        for metric, q in report[key].items():
+            print(f"    {metric}: {q['lo']} .. {q['hi']} (mediana {q['mediana']})")
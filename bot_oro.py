@@ -1,12 +1,16 @@
-import os, json, time, unicodedata, requests, re
-from datetime import datetime, timezone
+import time
+_T_PROCESS0 = time.perf_counter()
+import os, json, unicodedata, re, contextvars, threading, bisect, signal
+from collections import deque
+from datetime import datetime, timezone, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from binance.client import Client as BinanceClient
-from binance.exceptions import BinanceAPIException, BinanceRequestException
-from twilio.rest import Client as TwilioClient
+# gspread / oauth2client / binance / twilio si importano al primo uso (avvio più rapido;
+# twilio solo se WhatsApp è configurato)
+import metrics
+from notification_bus import get_bus
+
+_IMPORT_SECONDS = time.perf_counter() - _T_PROCESS0
 
 # ========= COSTANTI =========
 BOT_VERSION = "oro-bot v1.7"
@@ -15,9 +19,15 @@ BOT_VERSION = "oro-bot v1.7"
 BINANCE_API_KEY = os.getenv("BINANCE_API_KEY", "")
 BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET", "")
 SYMBOL = os.getenv("SYMBOL", "PAXGUSDT")
+# Più simboli in un solo processo (solo RUNTIME=async): "PAXGUSDT,XAUTUSDT"
+SYMBOLS = [s_.strip().upper() for s_ in os.getenv("SYMBOLS", SYMBOL).split(",") if s_.strip()]
 
 SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
 GOOGLE_CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS")  # JSON service account
+# Più file/service account (trade per simbolo, log, archivio per mese): vedi sheet_shards.py
+SHEET_SHARDS = os.getenv("SHEET_SHARDS", "")
+# Journal locale delle scritture (chiusure, righe live, Log) rimandate quando Sheets torna: vedi sheet_spool.py
+SPOOL_PATH = os.getenv("SPOOL_PATH", ".sheet_spool.jsonl")   # SPOOL_PATH= (vuoto) = scritture dirette, senza journal
 
 SHEET_TAB_TRADE = os.getenv("SHEET_TAB_TRADE", "Trade")
 SHEET_TAB_LOG   = os.getenv("SHEET_TAB_LOG", "Log")
@@ -27,15 +37,7 @@ TP2_PCT = Decimal(os.getenv("TP2_PCT", "0.0003"))
 SL_PCT  = Decimal(os.getenv("SL_PCT",  "0.0050"))
 BASE_EQUITY = Decimal(os.getenv("BASE_EQUITY", "10000"))
 
-# WhatsApp (opzionale)
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
-TWILIO_AUTH_TOKEN  = os.getenv("TWILIO_AUTH_TOKEN", "")
-TWILIO_FROM = os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886")
-TWILIO_TO   = os.getenv("TWILIO_TO", "")
-
-# Telegram (opzionale)
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
-TELEGRAM_CHAT_ID   = os.getenv("TELEGRAM_CHAT_ID", "")
+# Notifiche (Telegram / WhatsApp Twilio / WhatsApp Meta): configurate in notification_bus.py
 
 POLL_SECONDS = int(os.getenv("POLL_SECONDS", "8"))
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Rome")
@@ -50,9 +52,21 @@ DEFAULT_QTY     = Decimal(os.getenv("DEFAULT_QTY", "1"))
 DEBUG_HEADERS = os.getenv("DEBUG_HEADERS", "0") == "1"
 HEARTBEAT_MIN_SECONDS = int(os.getenv("HEARTBEAT_MIN_SECONDS", "60"))
 HEARTBEAT_PRICE_DELTA_BP = int(os.getenv("HEARTBEAT_PRICE_DELTA_BP", "2"))
+HEARTBEAT_TO_LOG = os.getenv("HEARTBEAT_TO_LOG", "0") == "1"   # 1 = anche una riga Log per heartbeat
+# Ultimi campioni di heartbeat in un blocco fisso della tab di stato (vedi HeartbeatRing)
+HEARTBEAT_RING = int(os.getenv("HEARTBEAT_RING", "30"))
+HEARTBEAT_STATE = os.getenv("HEARTBEAT_STATE", ".heartbeat.json")   # vuoto = solo in memoria
 
 # Riconciliazione meno frequente (per ridurre letture)
 RECONCILE_MIN_SECONDS = int(os.getenv("RECONCILE_MIN_SECONDS", "180"))
+# Rilevamento modifiche manuali: checksum in formula nella tab di stato; senza modifiche la
+# riconciliazione si salta, salvo una passata completa ogni RECONCILE_FORCE_SECONDS
+CHANGE_DETECT = os.getenv("CHANGE_DETECT", "1") == "1"
+RECONCILE_FORCE_SECONDS = int(os.getenv("RECONCILE_FORCE_SECONDS", "3600"))
+SHEET_TAB_STATUS = os.getenv("SHEET_TAB_STATUS", "Stato")
+# Aggregati giorno/settimana/simbolo aggiornati a ogni chiusura (perf_aggregates.py), blocco in SHEET_TAB_SUMMARY
+SHEET_TAB_SUMMARY = os.getenv("SHEET_TAB_SUMMARY", "Riepilogo")
+PERF_STATE = os.getenv("PERF_STATE", ".perf.json")   # vuoto = solo in memoria
 
 # === Anti-clustering ===
 MIN_TRADE_GAP_SECONDS = int(os.getenv("MIN_TRADE_GAP_SECONDS", "180"))
@@ -63,14 +77,39 @@ GRID_STEP_BP          = int(os.getenv("GRID_STEP_BP", "15"))
 PRICE_MIN_INTERVAL = int(os.getenv("PRICE_MIN_INTERVAL", "3"))
 BANNED_FALLBACK_SLEEP = int(os.getenv("BANNED_FALLBACK_SLEEP", "30"))
 
+# === ID trade: ultimo progressivo per simbolo (vuoto = solo in memoria, seed dal foglio) ===
+TRADE_ID_STATE = os.getenv("TRADE_ID_STATE", ".trade_ids.json")
+
+# === Registrazione tick (vuoto = disattivata) ===
+TICK_RECORD_DIR = os.getenv("TICK_RECORD_DIR", "")
+
 # === Tolleranza trigger (nuovo) ===
 HIT_TOL_BP = int(os.getenv("HIT_TOL_BP", "0"))
 
+# === Esecuzione: virtual (TP/SL controllati dal bot a ogni giro) | oco (ordini reali, vedi oco_execution.py) ===
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "virtual").lower()
+
+# === Archiviazione trade chiusi (tab "calda" leggera) ===
+ARCHIVE_MIN_AGE_DAYS   = int(os.getenv("ARCHIVE_MIN_AGE_DAYS", "0"))   # 0 = disattivata
+ARCHIVE_BATCH_ROWS     = int(os.getenv("ARCHIVE_BATCH_ROWS", "200"))
+ARCHIVE_EVERY_SECONDS  = int(os.getenv("ARCHIVE_EVERY_SECONDS", "3600"))
+SHEET_TAB_ARCHIVE      = os.getenv("SHEET_TAB_ARCHIVE", "Archivio")
+ARCHIVE_SPREADSHEET_ID = os.getenv("ARCHIVE_SPREADSHEET_ID", "")        # vuoto = stesso file
+
+# === Rotazione tab Log ===
+LOG_ROTATION  = os.getenv("LOG_ROTATION", "none").lower()   # none | daily | weekly | size
+LOG_RETENTION = int(os.getenv("LOG_RETENTION", "14"))       # tab ruotate da conservare
+LOG_MAX_ROWS  = int(os.getenv("LOG_MAX_ROWS", "20000"))     # soglia per LOG_ROTATION=size
+
 # Stato interno
+_SHARDS = None     # sheet_shards.ShardPool (solo con SHEET_SHARDS)
+_HOME_WS = None    # tab Trade del simbolo principale: stato, heartbeat e riepilogo stanno nel suo file
+_SPOOL = None      # sheet_spool.SheetSpool (solo con SPOOL_PATH)
 _LAST_HEADER_SIG = None
 _LAST_HEARTBEAT_TS = 0
 _LAST_HEARTBEAT_PRICE = None
 _LAST_RECONCILE_TS = 0
+_LAST_ARCHIVE_TS = 0
 
 # Throttle per log "nessuna chiusura"
 _LAST_MISS_LOG_TS = 0
@@ -80,14 +119,56 @@ MISS_LOG_EVERY = 30  # secondi
 _H_CACHE = None
 _COL_PING_CACHE = None
 
-# Stato per anti-clustering
-_LAST_TRADE_TS = 0
-_LAST_ENTRY_PRICE = None
+# Stato per anti-clustering (per simbolo)
+_LAST_TRADE_TS = {}
+_LAST_ENTRY_PRICE = {}
+
+# Simbolo del contesto corrente (il runtime async imposta un simbolo per task)
+_SYMBOL_CTX = contextvars.ContextVar("symbol", default=SYMBOL)
+
+# Tempo dall'avvio del processo alla prima valutazione del prezzo (None = non ancora)
+_FIRST_EVAL_SECONDS = None
+
+# Indice righe dei trade aperti, per tab Trade (chiave tab_key, vedi TradeIndex)
+_TRADE_INDEX = {}
+
+# Rilevamento modifiche: riga checksum per tab Trade, checksum di riferimento (ultimo controllo o scrittura del bot);
+# chiave tab_key, come _TRADE_INDEX
+_STATUS_WS = {}    # file -> tab di stato (con gli shard ogni file ha la sua, per il checksum)
+_STATUS_LOCK = threading.Lock()
+_CHECKSUM_ROW = {}
+_CHECKSUM_SEEN = {}
+_CHECKSUM_PENDING = set()   # tab con una modifica manuale vista subito prima di una scrittura del bot
+_LAST_FULL_RECONCILE = {}
+
+# Heartbeat recenti (vedi HeartbeatRing)
+_HEARTBEAT = None
+
+# Aggregati di performance e tab di riepilogo (vedi perf_aggregates.PerfAggregates)
+_PERF = None
+_SUMMARY_WS = None
+
+# Allocatore ID trade (vedi TradeIdAllocator)
+_TRADE_IDS = None
+
+# Esecutore OCO (solo EXECUTION_MODE=oco, runtime seriale)
+_OCO = None
+
+# Client gspread (serve per aprire eventuali file esterni, es. archivio)
+_GC = None
+_ARCHIVE_WS = {}   # (file, titolo) -> tab archivio
+
+# Stato Log: ultima riga scritta per tab (dalle risposte append) + tab ruotata attiva/precedente
+_LOG_LAST_ROW = {}
+_LOG_ACTIVE = None
+_LOG_ACTIVE_KEY = None
+_LOG_PREV = None
 
 # ====== Guard & cache Binance ======
 _PRICE_CACHE = None
 _PRICE_CACHE_TS = 0.0
 _BINANCE_BANNED_UNTIL = 0.0   # epoch seconds
+_TICK_REC = {}   # simbolo -> TickRecorder
 
 
 # ========= UTILS =========
@@ -121,8 +202,21 @@ def d(x) -> Decimal:
         val = val / Decimal("100")
     return val
 
+def col_letters(col: int) -> str:
+    """11 -> "K"."""
+    letters = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def a1(row: int, col: int) -> str:
+    """(5, 11) -> "K5" (come gspread.utils.rowcol_to_a1)."""
+    return f"{col_letters(col)}{row}"
+
 def fmt_dec(x: Decimal, q="0.00001") -> str:
-    return d(x).quantize(Decimal(q), rounding=ROUND_HALF_UP).normalize().to_eng_string()
+    # notazione fissa: normalize() da solo darebbe "2E+3" per 2000, che d() rileggerebbe come 23
+    return format(d(x).quantize(Decimal(q), rounding=ROUND_HALF_UP).normalize(), "f")
 
 def _zone():
     try:
@@ -131,8 +225,24 @@ def _zone():
     except Exception:
         return timezone.utc
 
+# Orologio: time.time di default; il replay (replay.py) lo sostituisce con un orologio virtuale
+_CLOCK = time.time
+
+def _now() -> float:
+    return _CLOCK()
+
+def now_local() -> datetime:
+    return datetime.fromtimestamp(_now(), _zone())
+
 def now_local_str() -> str:
-    return datetime.now(_zone()).strftime("%Y-%m-%d %H:%M:%S")
+    return now_local().strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_local_ts(s: str):
+    """Inverso di now_local_str; None se la cella non è una data del bot."""
+    try:
+        return datetime.strptime((s or "").strip(), "%Y-%m-%d %H:%M:%S").replace(tzinfo=_zone())
+    except ValueError:
+        return None
 
 def norm(s: str) -> str:
     s = (s or "")
@@ -141,46 +251,181 @@ def norm(s: str) -> str:
     for ch in " -_/.:;|%": s = s.replace(ch, " ")
     return " ".join(s.strip().lower().split())
 
-def send_whatsapp(msg: str):
-    if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_TO): return
-    try:
-        TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN).messages.create(
-            from_=TWILIO_FROM, to=TWILIO_TO, body=msg
-        )
-    except Exception as e:
-        print(f"[TWILIO] {e}")
+# Se impostato (replay) riceve i messaggi al posto del bus notifiche
+_NOTIFY_SINK = None
 
-def send_telegram(msg: str):
-    if not (TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID): return
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        requests.post(url, data={"chat_id": TELEGRAM_CHAT_ID, "text": msg})
-    except Exception as e:
-        print(f"[TELEGRAM] {e}")
-
-def notify(msg: str):
-    send_telegram(msg)
-    send_whatsapp(msg)
+def notify(msg: str, priority: bool = False):
+    """Messaggio verso Telegram/WhatsApp via notification_bus (coalescenza a finestra, priority = subito)."""
+    if _NOTIFY_SINK is not None:
+        _NOTIFY_SINK(msg)
+        return
+    get_bus().publish(msg, priority=priority)
 
 
 # ========= SHEETS =========
+def is_ws_not_found(e: Exception) -> bool:
+    from gspread.exceptions import WorksheetNotFound
+    return isinstance(e, WorksheetNotFound)
+
 def open_ws_by_title(sh, title: str):
     try:
         return sh.worksheet(title)
-    except gspread.WorksheetNotFound:
+    except Exception as e:
+        if not is_ws_not_found(e):
+            raise
         raise RuntimeError(f"Tab '{title}' non trovata. Imposta SHEET_TAB_* correttamente.")
 
-def open_sheets():
-    if not GOOGLE_CREDENTIALS:
-        raise RuntimeError("GOOGLE_CREDENTIALS mancante.")
+def open_tabs(sh, titles):
+    """Più tab con una sola lettura dei metadati del file (sh.worksheet() ne fa una per tab)."""
+    by_title = {w.title: w for w in sh.worksheets()}
+    missing = [t for t in titles if t not in by_title]
+    if missing:
+        raise RuntimeError(f"Tab {missing} non trovate. Imposta SHEET_TAB_* correttamente.")
+    return [by_title[t] for t in titles]
+
+def _qualify(ws, updates):
+    return [u if "!" in u["range"] else {**u, "range": f"'{ws.title}'!{u['range']}"} for u in updates]
+
+def batch_update_ws(ws, updates):
+    """values_batch_update sulla tab ws: i range senza nome tab andrebbero sul PRIMO foglio del file."""
+    return ws.spreadsheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": _qualify(ws, updates)})
+
+def sheet_key(sh):
+    return getattr(sh, "id", None) or id(sh)
+
+def tab_key(ws):
+    """Chiave di una tab: con gli shard lo stesso titolo (es. "Trade") esiste in più file."""
+    return sheet_key(ws.spreadsheet), ws.title
+
+def spool():
+    """Journal delle scritture (None con SPOOL_PATH vuoto)."""
+    global _SPOOL
+    if _SPOOL is None and SPOOL_PATH:
+        with _STATUS_LOCK:
+            if _SPOOL is None:
+                from sheet_spool import SheetSpool
+                _SPOOL = SheetSpool(SPOOL_PATH)
+    return _SPOOL
+
+def spool_attach(*tabs):
+    """Dopo un riavvio: file delle tab noti al journal e scritture in coda rimandate, prima di rileggere il foglio."""
+    sp = spool()
+    if sp is None:
+        return
+    for ws in tabs:
+        sp.attach(ws.spreadsheet)
+    if not sp.replay():
+        print(f"[SPOOL] {len(sp.pending)} scritture ancora in coda (Sheets non raggiungibile)")
+
+def pending_sheet_writes() -> int:
+    """Mutazioni nel journal non ancora confermate da Sheets (0 senza journal)."""
+    sp = _SPOOL
+    return len(sp.pending) if sp is not None else 0
+
+def sheets_writable() -> bool:
+    """False mentre il circuit breaker del journal è aperto: inutile tentare aperture o altre scritture."""
+    sp = _SPOOL
+    return sp is None or sp.breaker.allow()
+
+def batch_update_many(groups):
+    """
+    [(ws, updates), ...]: un values_batch_update per file (le tab dello stesso file in una sola chiamata),
+    i file diversi (shard) in parallelo. Con il journal (SPOOL_PATH) le scritture passano da lì: se Sheets
+    non risponde restano in coda e partono, in ordine, alla prossima scrittura verso lo stesso file.
+    """
+    by_sheet = {}
+    for ws, updates in groups:
+        if updates:
+            by_sheet.setdefault(sheet_key(ws.spreadsheet), (ws.spreadsheet, []))[1].extend(_qualify(ws, updates))
+    sp = spool()
+    if sp is not None:
+        calls = [lambda sh=sh, data=data: sp.batch_update(sh, data)[1] for sh, data in by_sheet.values()]
+    else:
+        calls = [lambda sh=sh, data=data: sh.values_batch_update({"valueInputOption": "USER_ENTERED", "data": data})
+                 for sh, data in by_sheet.values()]
+    if len(calls) <= 1 or _SHARDS is None:
+        return [c() for c in calls]
+    return _SHARDS.parallel(calls)
+
+def home_ws(ws_trade):
+    """Tab Trade del file "principale" (stato/heartbeat/riepilogo); senza shard è ws_trade stessa."""
+    return _HOME_WS if _HOME_WS is not None else ws_trade
+
+def trade_tab_for(symbol: str) -> str:
+    """Tab Trade del simbolo: SHEET_TAB_TRADE_<SYMBOL> se impostata, altrimenti "Trade" (un simbolo) o "Trade <SYMBOL>"."""
+    explicit = os.getenv(f"SHEET_TAB_TRADE_{symbol}")
+    if explicit:
+        return explicit
+    if len(SYMBOLS) <= 1 or symbol == SYMBOL:
+        return SHEET_TAB_TRADE
+    return f"{SHEET_TAB_TRADE} {symbol}"
+
+def authorize(credentials_json: str):
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
     creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(GOOGLE_CREDENTIALS),
+        json.loads(credentials_json),
         ["https://spreadsheets.google.com/feeds",
          "https://www.googleapis.com/auth/drive"]
     )
     gc = gspread.authorize(creds)
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    return open_ws_by_title(sh, SHEET_TAB_TRADE), open_ws_by_title(sh, SHEET_TAB_LOG)
+    # conteggio chiamate Sheets per /metrics (gspread 5: gc.session, gspread 6: gc.http_client.session)
+    metrics.instrument_requests_session(
+        getattr(getattr(gc, "http_client", gc), "session", None),
+        "bot_sheets_requests_total", "Richieste HTTP verso Google Sheets/Drive")
+    return gc
+
+def shards():
+    """Pool degli shard (None senza SHEET_SHARDS)."""
+    global _SHARDS
+    if _SHARDS is None and SHEET_SHARDS:
+        from sheet_shards import ShardPool, ShardRouter
+        _SHARDS = ShardPool(ShardRouter.from_config(SHEET_SHARDS), authorize)
+    return _SHARDS
+
+def open_sheets():
+    global _GC, _HOME_WS
+    pool = shards()
+    if pool is None:
+        if not GOOGLE_CREDENTIALS:
+            raise RuntimeError("GOOGLE_CREDENTIALS mancante.")
+        _GC = authorize(GOOGLE_CREDENTIALS)
+        sh = _GC.open_by_key(SPREADSHEET_ID)
+        ws_trade, ws_log = open_tabs(sh, [SHEET_TAB_TRADE, SHEET_TAB_LOG])
+        return ws_trade, ws_log
+
+    trade_shard, log_shard = pool.router.trade_shard(SYMBOL), pool.router.log_shard(SYMBOL)
+    _GC = pool.client(trade_shard)
+    if log_shard is trade_shard:
+        ws_trade, ws_log = open_tabs(pool.spreadsheet(trade_shard), [trade_tab_for(SYMBOL), SHEET_TAB_LOG])
+    else:
+        ws_trade, ws_log = pool.parallel([
+            lambda: open_tabs(pool.spreadsheet(trade_shard), [trade_tab_for(SYMBOL)])[0],
+            lambda: open_tabs(pool.spreadsheet(log_shard), [SHEET_TAB_LOG])[0],
+        ])
+    _HOME_WS = ws_trade
+    return ws_trade, ws_log
+
+def open_trade_tabs(symbols, ws_trade):
+    """Tab Trade dei simboli: quelle già aperte riusate, le altre con una lettura metadati per file (in parallelo)."""
+    titles = {sym: trade_tab_for(sym) for sym in symbols}
+    pool = shards()
+    groups = {}
+    for sym in symbols:
+        sh = pool.spreadsheet(pool.router.trade_shard(sym)) if pool is not None else ws_trade.spreadsheet
+        groups.setdefault(sheet_key(sh), (sh, []))[1].append(sym)
+    out = {}
+    pending = []
+    for sh, syms in groups.values():
+        if sheet_key(sh) == sheet_key(ws_trade.spreadsheet) and all(titles[s] == ws_trade.title for s in syms):
+            out.update((s, ws_trade) for s in syms)
+        else:
+            pending.append((sh, syms))
+    calls = [lambda sh=sh, syms=syms: dict(zip(syms, open_tabs(sh, [titles[s] for s in syms])))
+             for sh, syms in pending]
+    for res in (pool.parallel(calls) if pool is not None else [c() for c in calls]):
+        out.update(res)
+    return [out[sym] for sym in symbols]
 
 ALIAS = {
     "data/ora": ["data ora","timestamp","datetime","dataora","data"],
@@ -220,11 +465,12 @@ def get_header(ws):
 def header_signature(header_row):
     return "|".join([h.strip().lower() for h in header_row])
 
-def dump_headers_once(ws_trade, ws_log):
+def dump_headers_once(ws_trade, ws_log, header=None):
     global _LAST_HEADER_SIG
     if not DEBUG_HEADERS:
         return
-    header = ws_trade.row_values(1)
+    if header is None:
+        header = ws_trade.row_values(1)
     sig = header_signature(header)
     if sig != _LAST_HEADER_SIG:
         _LAST_HEADER_SIG = sig
@@ -238,50 +484,106 @@ def dump_headers_once(ws_trade, ws_log):
             print("[DEBUG] dump_headers_once error:", e)
 
 def find_col_by_header(ws, header_name: str) -> int:
-    header = ws.row_values(1)
-    if not header:
-        raise RuntimeError(f"La tab '{ws.title}' non ha intestazioni.")
+    return col_in_header(get_header(ws), header_name, ws.title)
+
+def col_in_header(header, header_name: str, title: str = "") -> int:
+    """Indice (1-based) della colonna con nome esatto (case-insensitive) in una riga header già letta."""
     target = (header_name or "").strip().lower()
     for i, h in enumerate(header, start=1):
         if (h or "").strip().lower() == target:
             return i
-    raise RuntimeError(f"Header '{header_name}' non trovato in '{ws.title}': {header}")
+    raise RuntimeError(f"Header '{header_name}' non trovato in '{title}': {header}")
+
+def header_from_rows(ws, rows):
+    """Header dalla prima riga di uno snapshot get_all_values (stesso errore di get_header)."""
+    if not rows or not rows[0]:
+        raise RuntimeError(f"La tab '{ws.title}' non ha intestazioni.")
+    return rows[0]
+
+def set_row_cell(rows, r: int, c: int, v: str):
+    """Riporta una scrittura nello snapshot condiviso, così le funzioni successive lo vedono aggiornato."""
+    row = rows[r - 1]
+    if len(row) < c:
+        row.extend([""] * (c - len(row)))
+    row[c - 1] = v
 
 
 # ========= BINANCE =========
 def binance_client():
+    from binance.client import Client as BinanceClient
     return BinanceClient(api_key=BINANCE_API_KEY, api_secret=BINANCE_API_SECRET)
 
+def cur_symbol() -> str:
+    return _SYMBOL_CTX.get()
+
+def symbol_filters(client=None):
+    """
+    Filtri exchange del simbolo corrente dal registro condiviso (exchange_filters: copia su disco,
+    refresh a TTL). Se il registro non lo conosce si chiede al client; None se non disponibili.
+    """
+    from exchange_filters import get_filters, SymbolFilters
+    sym = cur_symbol()
+    try:
+        f = get_filters(sym, client)
+        if f is None and client is not None and hasattr(client, "get_symbol_info"):
+            f = SymbolFilters.from_symbol_info(client.get_symbol_info(sym))
+        return f
+    except Exception as e:
+        print(f"[FILTERS] {sym}: {e}")
+        return None
+
+def record_tick(ts: float, price: Decimal, source: str, symbol: str | None = None) -> Decimal:
+    """Accoda il campione al file tick del giorno (se TICK_RECORD_DIR) e ritorna il prezzo."""
+    if TICK_RECORD_DIR and price != 0:
+        try:
+            symbol = symbol or SYMBOL
+            rec = _TICK_REC.get(symbol)
+            if rec is None:
+                from tick_recorder import TickRecorder
+                rec = _TICK_REC[symbol] = TickRecorder(TICK_RECORD_DIR, symbol)
+            from tick_recorder import SOURCES
+            rec.record(ts, float(price), SOURCES[source])
+        except Exception as e:
+            print(f"[TICKS] {e}")
+    return price
+
+def note_binance_ban(msg: str, now_ts: float):
+    """Aggiorna _BINANCE_BANNED_UNTIL dal testo di un errore API (ban IP o -1003 rate limit)."""
+    global _BINANCE_BANNED_UNTIL
+    m = re.search(r"banned until (\d+)", msg)
+    if m:
+        try:
+            ban_ms = int(m.group(1))
+            _BINANCE_BANNED_UNTIL = max(_BINANCE_BANNED_UNTIL, ban_ms / 1000.0)
+        except Exception:
+            _BINANCE_BANNED_UNTIL = now_ts + 300
+    elif "-1003" in msg or "Too much request weight" in msg:
+        _BINANCE_BANNED_UNTIL = now_ts + 60
+
 def get_last_price(client) -> Decimal:
-    global _PRICE_CACHE, _PRICE_CACHE_TS, _BINANCE_BANNED_UNTIL
-    now_ts = time.time()
+    global _PRICE_CACHE, _PRICE_CACHE_TS
+    now_ts = _now()
     if now_ts < _BINANCE_BANNED_UNTIL:
-        return d(_PRICE_CACHE) if _PRICE_CACHE is not None else Decimal("0")
+        return record_tick(now_ts, d(_PRICE_CACHE) if _PRICE_CACHE is not None else Decimal("0"), "banned")
     if _PRICE_CACHE is not None and (now_ts - _PRICE_CACHE_TS) < PRICE_MIN_INTERVAL:
-        return d(_PRICE_CACHE)
+        return record_tick(now_ts, d(_PRICE_CACHE), "cache")
     try:
+        metrics.inc("bot_binance_requests_total", help_text="Letture prezzo verso Binance")
         p = client.get_symbol_ticker(symbol=SYMBOL)
         price = d(p["price"])
         if price != 0:
             _PRICE_CACHE = price
             _PRICE_CACHE_TS = now_ts
-        return price
-    except BinanceAPIException as e:
-        msg = str(e)
-        m = re.search(r"banned until (\d+)", msg)
-        if m:
-            try:
-                ban_ms = int(m.group(1))
-                _BINANCE_BANNED_UNTIL = max(_BINANCE_BANNED_UNTIL, ban_ms / 1000.0)
-            except Exception:
-                _BINANCE_BANNED_UNTIL = now_ts + 300
-        elif "-1003" in msg or "Too much request weight" in msg:
-            _BINANCE_BANNED_UNTIL = now_ts + 60
-        print(f"[BINANCE] {msg}")
-        return d(_PRICE_CACHE) if _PRICE_CACHE is not None else Decimal("0")
-    except (BinanceRequestException, KeyError, TypeError) as e:
+        return record_tick(now_ts, price, "live")
+    except Exception as e:
+        from binance.exceptions import BinanceAPIException, BinanceRequestException
+        if isinstance(e, BinanceAPIException):
+            note_binance_ban(str(e), now_ts)
+        elif not isinstance(e, (BinanceRequestException, KeyError, TypeError)):
+            raise
         print(f"[BINANCE] {e}")
-        return d(_PRICE_CACHE) if _PRICE_CACHE is not None else Decimal("0")
+        metrics.inc("bot_binance_errors_total", help_text="Errori API Binance")
+        return record_tick(now_ts, d(_PRICE_CACHE) if _PRICE_CACHE is not None else Decimal("0"), "error")
 
 
 # ========= LOGICA =========
@@ -297,9 +599,125 @@ def pnl_values(side, entry, close, qty):
         return ((entry/close-1)*100, (entry-close)*qty)
 
 
+def check_hit(side: str, entry: Decimal, lastp: Decimal):
+    """Scala dei trigger live: TP2, poi TP1, poi SL (con tolleranza HIT_TOL_BP). -> (hit, prezzo chiusura)"""
+    tol = (Decimal(HIT_TOL_BP) / Decimal("10000")) if HIT_TOL_BP > 0 else Decimal("0")
+    tp1, tp2, sl = compute_targets(entry)
+    if side == "LONG":
+        if lastp >= (tp2 * (Decimal("1") - tol)): return "TP2", tp2
+        if lastp >= (tp1 * (Decimal("1") - tol)): return "TP1", tp1
+        if lastp <= (sl  * (Decimal("1") + tol)): return "SL",  sl
+    else:
+        if lastp <= (tp2 * (Decimal("1") + tol)): return "TP2", tp2
+        if lastp <= (tp1 * (Decimal("1") + tol)): return "TP1", tp1
+        if lastp >= (sl  * (Decimal("1") - tol)): return "SL",  sl
+    return None, None
+
+def check_hits(trades, lastp: Decimal):
+    """
+    Scala dei trigger su tutti i trade in una chiamata vettoriale (strategy_core.ladder).
+    trades: [(side, entry, qty)] -> [(hit, prezzo chiusura, P&L %, P&L valore)]; senza trigger
+    (None, None, None, None). Il P&L viene da ladder; i casi al filo di una soglia, dove il confronto
+    float potrebbe differire, si ricontrollano con check_hit e pnl_values in Decimal.
+    """
+    if not trades:
+        return []
+    from strategy_core import ladder, HIT_NAMES, HIT_NONE, HIT_TP1, HIT_TP2   # numpy al primo uso
+    r = ladder([float(e) for _, e, _ in trades], [side == "LONG" for side, _, _ in trades], float(lastp),
+               float(TP1_PCT), float(TP2_PCT), float(SL_PCT), HIT_TOL_BP, qty=[float(q) for _, _, q in trades])
+    out = []
+    for (side, entry, qty), code, near, pct, val in zip(trades, r["hit"], r["near"], r["pnl_pct"], r["pnl_val"]):
+        if near:
+            hit, close_price = check_hit(side, entry, lastp)
+            out.append((hit, close_price, *pnl_values(side, entry, close_price, qty)) if hit else (None,) * 4)
+        elif code == HIT_NONE:
+            out.append((None,) * 4)
+        else:
+            tp1, tp2, sl = compute_targets(entry)
+            out.append((HIT_NAMES[code], tp1 if code == HIT_TP1 else tp2 if code == HIT_TP2 else sl,
+                        Decimal(repr(float(pct))), Decimal(repr(float(val)))))
+    return out
+
+def live_row_updates(H, r, side, entry, lastp, qty):
+    """Celle P&L live (e delta) di una riga aperta senza trigger."""
+    pnl_pct, pnl_val = pnl_values(side, entry, lastp, qty)
+    delta_price = (lastp - entry) if side == "LONG" else (entry - lastp)
+    out = [
+        {"range": a1(r, H["p&l %"]), "values": [[fmt_dec(pnl_pct, "0.0001")]]},
+        {"range": a1(r, H["p&l valore"]), "values": [[fmt_dec(pnl_val, "0.01")]]},
+    ]
+    if H.get("delta"):
+        out.append({"range": a1(r, H["delta"]),
+                    "values": [[fmt_dec(delta_price, "0.01")]]})
+    return out
+
+def close_row_updates(H, r, hit, close_price, pnl_pct, pnl_val, eq_new):
+    """Celle da scrivere per chiudere la riga r (TP/SL)."""
+    out = []
+    if H.get("prezzo chiusura"):
+        out.append({"range": a1(r, H["prezzo chiusura"]),
+                    "values": [[fmt_dec(close_price)]]})
+    out.append({"range": a1(r, H["stato"]), "values": [["CHIUSO"]]})
+    if H.get("note"):
+        out.append({"range": a1(r, H["note"]), "values": [[hit]]})
+    out += [
+        {"range": a1(r, H["p&l %"]), "values": [[fmt_dec(pnl_pct, "0.0001")]]},
+        {"range": a1(r, H["p&l valore"]), "values": [[fmt_dec(pnl_val, "0.01")]]},
+        {"range": a1(r, H["equity post-trade"]), "values": [[fmt_dec(eq_new, "0.01")]]},
+    ]
+    return out
+
+def commit_closes(idx, ws_log, closes):
+    """
+    Chiusure TP/SL/OCO dopo che il batch che le scrive è tornato: fuori dall'indice, equity, aggregati,
+    Log e notifiche. Se la scrittura fallisce non si tocca nulla e il giro dopo le ritrova aperte e riprova.
+    closes: [(trade_id, riga, hit, side, entry, close_price, qty, pnl_pct, pnl_val, eq_new)]
+    """
+    for trade_id, r, hit, side, entry, close_price, qty, pnl_pct, pnl_val, eq_new in closes:
+        idx.remove(trade_id)
+        idx.equity = eq_new
+        record_close(entry, close_price, qty, pnl_val)
+        log(ws_log, "INFO", close_log_text(hit, r, trade_id, side, entry, close_price, pnl_pct, pnl_val, eq_new))
+        notify(close_message(hit, trade_id, entry, close_price, pnl_pct, pnl_val, eq_new), priority=(hit == "SL"))
+
+def close_log_text(hit, r, trade_id, side, entry, close_price, pnl_pct, pnl_val, eq_new) -> str:
+    return (f"Close {hit} r{r} id={trade_id} - side={side} entry={fmt_dec(entry)} "
+            f"close={fmt_dec(close_price)} pnl%={fmt_dec(pnl_pct,'0.0001')} "
+            f"pnl=${fmt_dec(pnl_val,'0.01')} eq->{fmt_dec(eq_new,'0.01')}")
+
+def close_message(hit, trade_id, entry, close_price, pnl_pct, pnl_val, eq_new) -> str:
+    return (f"BOT ORO | {cur_symbol()}\n"
+            f"Trade chiuso: {hit}\n"
+            f"ID: {trade_id}\n"
+            f"Entry: {fmt_dec(entry)}  Close: {fmt_dec(close_price)}\n"
+            f"P&L: {fmt_dec(pnl_val,'0.01')} USD  ({fmt_dec(pnl_pct,'0.0001')}%)\n"
+            f"Equity: {fmt_dec(eq_new,'0.01')} - {TIMEZONE}")
+
+
 # ========= SUPPORTO START/REPAIR =========
+def rows_from_updated_range(resp):
+    """Risposta append -> (prima_riga, ultima_riga) da 'updates.updatedRange', None se assente."""
+    try:
+        rng = resp["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    m = re.search(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?$", rng or "")
+    if not m:
+        return None
+    first = int(m.group(1))
+    return first, int(m.group(2) or first)
+
 def log_get_messages(ws_log, max_rows=2000):
+    """
+    Ultimi max_rows messaggi (colonna C). Se conosciamo l'ultima riga scritta leggiamo solo
+    una finestra A1 limitata; altrimenti (es. appena avviati) l'intera colonna.
+    """
     try:
+        last = _LOG_LAST_ROW.get(ws_log.title)
+        if last:
+            start = max(2, last - max_rows + 1)
+            resp = ws_log.spreadsheet.values_get(f"'{ws_log.title}'!C{start}:C{last + 50}")
+            return {row[0] for row in resp.get("values", []) if row}
         msgs = ws_log.col_values(3)
         if len(msgs) <= 1:
             return set()
@@ -307,20 +725,28 @@ def log_get_messages(ws_log, max_rows=2000):
     except Exception:
         return set()
 
-def start_already_notified(log_msgs: set, trade_id: str) -> bool:
-    if not trade_id:
-        return False
-    key = f"Aperto trade {trade_id}"
+_STARTED_RE = re.compile(r"Aperto trade (?:automatico )?(\S+)")
+
+def started_ids(log_msgs: set) -> set:
+    """ID con l'apertura già registrata nel Log ("Aperto trade <id> ...", "Aperto trade automatico <id> ...")."""
+    out = set()
     for m in log_msgs:
-        if trade_id in m and "Aperto trade" in m: return True
-        if key in m: return True
-    return False
+        hit = _STARTED_RE.search(m)
+        if hit:
+            out.add(hit.group(1))
+    return out
+
+def start_already_notified(started: set, trade_id: str) -> bool:
+    return bool(trade_id) and trade_id in started
 
 def gen_trade_id(symbol: str, row_index: int) -> str:
-    return f"{symbol}-{int(time.time())}-R{row_index}"
+    return trade_ids().next(symbol, f"R{row_index}")
 
-def reconcile_and_notify_starts(ws_trade, ws_log, symbol: str):
-    header = get_header(ws_trade)
+def reconcile_and_notify_starts(ws_trade, ws_log, symbol: str, rows=None):
+    """rows: snapshot get_all_values condiviso (aggiornato sul posto con le correzioni scritte)."""
+    if rows is None:
+        rows = ws_trade.get_all_values()
+    header = header_from_rows(ws_trade, rows)
     H = build_header_map(header)
 
     need = ["data/ora", "id trade", "lato", "stato", "prezzo ingresso", "ultimo ping"]
@@ -332,11 +758,18 @@ def reconcile_and_notify_starts(ws_trade, ws_log, symbol: str):
     L_ENTRY = H["prezzo ingresso"]; L_CLOSE = H.get("prezzo chiusura")
     L_TP1 = H.get("tp1 %"); L_TP2 = H.get("tp2 %"); L_SL = H.get("sl %")
 
-    rows = ws_trade.get_all_values()
     if len(rows) <= 1:
         return
 
     log_msgs = log_get_messages(ws_log)
+    if _LOG_PREV is not None:
+        # dopo una rotazione le aperture già notificate stanno nella tab precedente
+        log_msgs |= log_get_messages(_LOG_PREV)
+    started = started_ids(log_msgs)
+    # gli ID nuovi devono superare quelli già presenti (foglio e Log)
+    trade_ids().seed([(row[L_ID - 1] if len(row) >= L_ID else "").strip() for row in rows[1:]])
+    trade_ids().seed(started)
+    seen_open = set()
     updates = []
 
     for r in range(2, len(rows) + 1):
@@ -351,21 +784,29 @@ def reconcile_and_notify_starts(ws_trade, ws_log, symbol: str):
 
         # Stato coerente con eventuale "prezzo chiusura"
         if has_close and stato in ("", "APERTO"):
-            updates.append({"range": gspread.utils.rowcol_to_a1(r, L_STATO), "values": [["CHIUSO"]]})
+            updates.append({"range": a1(r, L_STATO), "values": [["CHIUSO"]]})
+            set_row_cell(rows, r, L_STATO, "CHIUSO")
             stato = "CHIUSO"
 
         # Entry presente ma stato vuoto -> APERTO
         if entry_str and stato == "":
-            updates.append({"range": gspread.utils.rowcol_to_a1(r, L_STATO), "values": [["APERTO"]]})
+            updates.append({"range": a1(r, L_STATO), "values": [["APERTO"]]})
+            set_row_cell(rows, r, L_STATO, "APERTO")
             stato = "APERTO"
 
-        # Genera ID se manca
-        if stato == "APERTO" and not trade_id:
+        # Genera ID se manca (o se un altro trade aperto ha già lo stesso ID: l'indice è per ID)
+        if stato == "APERTO" and (not trade_id or trade_id in seen_open):
+            old_id = trade_id
             trade_id = gen_trade_id(symbol, r)
-            updates.append({"range": gspread.utils.rowcol_to_a1(r, L_ID), "values": [[trade_id]]})
+            updates.append({"range": a1(r, L_ID), "values": [[trade_id]]})
+            set_row_cell(rows, r, L_ID, trade_id)
+            if old_id:
+                log(ws_log, "WARN", f"ID duplicato {old_id} in r{r}: riassegnato {trade_id}")
+        if stato == "APERTO":
+            seen_open.add(trade_id)
 
         # Notifica una sola volta l'apertura riconosciuta
-        if stato == "APERTO" and entry > 0 and not start_already_notified(log_msgs, trade_id):
+        if stato == "APERTO" and entry > 0 and not start_already_notified(started, trade_id):
             TP1 = d(row[L_TP1 - 1]) if L_TP1 and len(row) >= L_TP1 and (row[L_TP1 - 1] or "").strip() else TP1_PCT
             TP2 = d(row[L_TP2 - 1]) if L_TP2 and len(row) >= L_TP2 and (row[L_TP2 - 1] or "").strip() else TP2_PCT
             SL  = d(row[L_SL  - 1]) if L_SL  and len(row) >= L_SL  and (row[L_SL  - 1]  or "").strip() else SL_PCT
@@ -381,15 +822,18 @@ def reconcile_and_notify_starts(ws_trade, ws_log, symbol: str):
             log(ws_log, "INFO", f"Aperto trade {trade_id} @ {fmt_dec(entry)} (riconosciuto)")
 
     if updates:
-        ws_trade.spreadsheet.values_batch_update({
-            "valueInputOption": "USER_ENTERED",
-            "data": updates
-        })
+        checksum_before_write(ws_trade)
+        batch_update_ws(ws_trade, updates)
+        mark_sheet_written(ws_trade)
 
 # ========== NUOVO: gestione chiusure manuali ==========
-def process_manual_closes(ws_trade, ws_log, H):
+def process_manual_closes(ws_trade, ws_log, H, rows=None, equity: Decimal | None = None):
+    """
+    Completa P&L/equity delle righe chiuse a mano. equity: equity corrente (indice righe); se None
+    si parte dall'ultima equity dello snapshot. Ritorna l'equity dopo le chiusure (None se nessuna).
+    """
     if "prezzo chiusura" not in H:
-        return
+        return None
 
     stato_col_idx  = H["stato"]
     lato_idx       = H["lato"] if "lato" in H else None
@@ -401,11 +845,14 @@ def process_manual_closes(ws_trade, ws_log, H):
     equity_idx     = H["equity post-trade"]
     note_idx       = H.get("note")
 
-    rows = ws_trade.get_all_values()
+    if rows is None:
+        rows = ws_trade.get_all_values()
     if len(rows) <= 1:
-        return
+        return None
+    eq_prev = equity
+    eq_new = None
 
-    updates = []
+    updates, done = [], []
     for r in range(2, len(rows)+1):
         row = rows[r-1]
         trade_id = (row[H["id trade"]-1] if "id trade" in H and len(row) >= H["id trade"] else "").strip()
@@ -432,42 +879,199 @@ def process_manual_closes(ws_trade, ws_log, H):
             continue
 
         pnl_pct, pnl_val = pnl_values(side, entry, close, qty)
-        eq_prev = last_equity(ws_trade, equity_idx)
+        if eq_prev is None:
+            eq_prev = last_equity_from_rows(rows, equity_idx)
         eq_new  = eq_prev + pnl_val
+        eq_prev = eq_new
 
         if stato != "CHIUSO":
-            updates.append({"range": gspread.utils.rowcol_to_a1(r, stato_col_idx), "values": [["CHIUSO"]]})
+            updates.append({"range": a1(r, stato_col_idx), "values": [["CHIUSO"]]})
         updates += [
-            {"range": gspread.utils.rowcol_to_a1(r, plpct_idx),  "values": [[fmt_dec(pnl_pct, "0.0001")]]},
-            {"range": gspread.utils.rowcol_to_a1(r, plval_idx),  "values": [[fmt_dec(pnl_val, "0.01")]]},
-            {"range": gspread.utils.rowcol_to_a1(r, equity_idx), "values": [[fmt_dec(eq_new, "0.01")]]},
+            {"range": a1(r, plpct_idx),  "values": [[fmt_dec(pnl_pct, "0.0001")]]},
+            {"range": a1(r, plval_idx),  "values": [[fmt_dec(pnl_val, "0.01")]]},
+            {"range": a1(r, equity_idx), "values": [[fmt_dec(eq_new, "0.01")]]},
         ]
         if note_idx:
             cur_note = (row[note_idx-1] if len(row) >= note_idx else "").strip()
             if not cur_note:
-                updates.append({"range": gspread.utils.rowcol_to_a1(r, note_idx), "values": [["MANUAL"]]})
+                updates.append({"range": a1(r, note_idx), "values": [["MANUAL"]]})
+                set_row_cell(rows, r, note_idx, "MANUAL")
+        set_row_cell(rows, r, stato_col_idx, "CHIUSO")
+        set_row_cell(rows, r, plpct_idx, fmt_dec(pnl_pct, "0.0001"))
+        set_row_cell(rows, r, plval_idx, fmt_dec(pnl_val, "0.01"))
+        set_row_cell(rows, r, equity_idx, fmt_dec(eq_new, "0.01"))
+        # aggregati, Log e notifica dopo la scrittura: se fallisce, il giro dopo ritrova la riga da calcolare
+        done.append((entry, close, qty, pnl_val,
+                     f"Chiusura MANUAL r{r} id={trade_id} - side={side} entry={fmt_dec(entry)} close={fmt_dec(close)} "
+                     f"pnl%={fmt_dec(pnl_pct,'0.0001')} pnl=${fmt_dec(pnl_val,'0.01')} "
+                     f"equity->{fmt_dec(eq_new,'0.01')}",
+                     f"BOT ORO | {cur_symbol()}\n"
+                     f"Chiusura manuale\n"
+                     f"ID: {trade_id}\n"
+                     f"Entry: {fmt_dec(entry)}  Close: {fmt_dec(close)}\n"
+                     f"P&L: {fmt_dec(pnl_val,'0.01')} USD  ({fmt_dec(pnl_pct,'0.0001')}%)\n"
+                     f"Equity: {fmt_dec(eq_new,'0.01')} - {TIMEZONE}"))
 
-        log(ws_log, "INFO",
-            f"Chiusura MANUAL r{r} id={trade_id} - side={side} entry={fmt_dec(entry)} close={fmt_dec(close)} "
-            f"pnl%={fmt_dec(pnl_pct,'0.0001')} pnl=${fmt_dec(pnl_val,'0.01')} "
-            f"equity->{fmt_dec(eq_new,'0.01')}")
+    if updates:
+        checksum_before_write(ws_trade, H)
+        try:
+            batch_update_many([(ws_trade, updates), (home_ws(ws_trade), perf_updates(ws_trade))])
+        except Exception:
+            status_blocks_failed()
+            raise
+        mark_sheet_written(ws_trade, H)
+    for entry, close, qty, pnl_val, log_text, message in done:
+        record_close(entry, close, qty, pnl_val)
+        log(ws_log, "INFO", log_text)
+        notify(message)
+    return eq_new
+
+
+# ========= ARCHIVIAZIONE =========
+def archive_target(ws_trade, month: str | None = None):
+    """
+    (file, titolo) dell'archivio: con shard di archivio (SHEET_SHARDS) un tab per mese nello shard del mese,
+    altrimenti SHEET_TAB_ARCHIVE nello stesso file o in ARCHIVE_SPREADSHEET_ID.
+    """
+    pool = shards()
+    shard = pool.router.archive_shard(month) if pool is not None and month else None
+    if shard is not None:
+        return pool.spreadsheet(shard), f"{SHEET_TAB_ARCHIVE} {month}"
+    if ARCHIVE_SPREADSHEET_ID and _GC is not None:
+        return _GC.open_by_key(ARCHIVE_SPREADSHEET_ID), SHEET_TAB_ARCHIVE
+    return ws_trade.spreadsheet, SHEET_TAB_ARCHIVE
+
+def open_archive_ws(ws_trade, header, month: str | None = None):
+    """Tab archivio (vedi archive_target); creata con l'header Trade se manca."""
+    pool = shards()
+    if pool is None or not pool.router.archive_shard(month or ""):
+        month = None   # un solo archivio: la chiave non dipende dal mese
+    ws = _ARCHIVE_WS.get(month)
+    if ws is not None:
+        return ws
+    sh, title = archive_target(ws_trade, month)
+    try:
+        ws = sh.worksheet(title)
+    except Exception as e:
+        if not is_ws_not_found(e):
+            raise
+        ws = sh.add_worksheet(title=title, rows=1000, cols=max(len(header), 1))
+        ws.update("A1", [header], value_input_option="USER_ENTERED")
+    _ARCHIVE_WS[month] = ws
+    return ws
+
+def _contiguous_blocks(rows_idx):
+    """[2,3,4,7,8] -> [(2,4),(7,8)]"""
+    blocks = []
+    for r in sorted(rows_idx):
+        if blocks and r == blocks[-1][1] + 1:
+            blocks[-1][1] = r
+        else:
+            blocks.append([r, r])
+    return [tuple(b) for b in blocks]
 
-        notify(
-            f"BOT ORO | {SYMBOL}\n"
-            f"Chiusura manuale\n"
-            f"ID: {trade_id}\n"
-            f"Entry: {fmt_dec(entry)}  Close: {fmt_dec(close)}\n"
-            f"P&L: {fmt_dec(pnl_val,'0.01')} USD  ({fmt_dec(pnl_pct,'0.0001')}%)\n"
-            f"Equity: {fmt_dec(eq_new,'0.01')} - {TIMEZONE}"
-        )
+def archive_closed_trades(ws_trade, ws_log, H) -> int:
+    """
+    Sposta nell'archivio le righe CHIUSO più vecchie di ARCHIVE_MIN_AGE_DAYS (max ARCHIVE_BATCH_ROWS
+    per giro). Le righe vengono copiate così come sono (ID ed equity intatti) e poi cancellate dalla
+    tab Trade. La riga con l'ultima equity resta sempre nella tab viva: last_equity() e TradeIndex ci si appoggiano.
+    """
+    if ARCHIVE_MIN_AGE_DAYS <= 0:
+        return 0
+    sp = _SPOOL
+    if sp is not None and (sp.has_pending(ws_trade.spreadsheet) or not sp.breaker.allow()):
+        # i batch in coda scrivono righe assolute: cancellarne adesso le farebbe finire sulle righe sbagliate
+        print(f"[SPOOL] archiviazione '{ws_trade.title}' rimandata: scritture in coda")
+        return 0
+    L_STATO = H["stato"]; L_DATA = H["data/ora"]; L_ID = H.get("id trade")
+    L_EQ = H.get("equity post-trade")
 
-    if updates:
-        ws_trade.spreadsheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": updates})
+    rows = ws_trade.get_all_values()
+    if len(rows) <= 2:
+        return 0
+
+    keep_row = None
+    if L_EQ:
+        for r in range(len(rows), 1, -1):
+            row = rows[r - 1]
+            if len(row) >= L_EQ and (row[L_EQ - 1] or "").strip():
+                keep_row = r
+                break
+
+    cutoff = now_local() - timedelta(days=ARCHIVE_MIN_AGE_DAYS)
+    picked = []
+    by_month = {}
+    for r in range(2, len(rows) + 1):
+        if len(picked) >= ARCHIVE_BATCH_ROWS:
+            break
+        if r == keep_row:
+            continue
+        row = rows[r - 1]
+        stato = (row[L_STATO - 1] if len(row) >= L_STATO else "").strip().upper()
+        if stato != "CHIUSO":
+            continue
+        ts = parse_local_ts(row[L_DATA - 1] if len(row) >= L_DATA else "")
+        if ts is None or ts > cutoff:
+            continue
+        picked.append(r)
+        by_month.setdefault(ts.strftime("%Y-%m"), []).append(r)
+
+    if not picked:
+        return 0
+
+    # 1) copia nell'archivio (prima di cancellare: in caso di errore meglio un duplicato che una perdita);
+    #    con gli shard di archivio un append per mese, in parallelo
+    targets = {}
+    for month, rs in by_month.items():
+        ws_arch = open_archive_ws(ws_trade, rows[0], month)
+        targets.setdefault(id(ws_arch), (ws_arch, []))[1].extend(rs)
+    calls = [lambda ws_arch=ws_arch, rs=rs: ws_arch.spreadsheet.values_append(
+                 f"'{ws_arch.title}'!A1",
+                 params={"valueInputOption": "USER_ENTERED", "insertDataOption": "INSERT_ROWS"},
+                 body={"values": [rows[r - 1] for r in sorted(rs)]})
+             for ws_arch, rs in targets.values()]
+    if _SHARDS is not None:
+        _SHARDS.parallel(calls)
+    else:
+        for c in calls:
+            c()
+
+    # 2) verifica che nessuno abbia spostato righe nel frattempo (controllo sugli ID)
+    if L_ID:
+        ids_now = ws_trade.col_values(L_ID)
+        for r in picked:
+            before = (rows[r - 1][L_ID - 1] if len(rows[r - 1]) >= L_ID else "").strip()
+            after = (ids_now[r - 1] if r - 1 < len(ids_now) else "").strip()
+            if before != after:
+                log(ws_log, "WARN", f"Archivio: righe spostate durante l'archiviazione (r{r}), cancellazione annullata")
+                return 0
+
+    # 3) cancella dal basso verso l'alto per blocchi contigui
+    requests_del = []
+    for start, end in reversed(_contiguous_blocks(picked)):
+        requests_del.append({"deleteDimension": {"range": {
+            "sheetId": ws_trade.id, "dimension": "ROWS",
+            "startIndex": start - 1, "endIndex": end,
+        }}})
+    checksum_before_write(ws_trade, H)
+    ws_trade.spreadsheet.batch_update({"requests": requests_del})
+    trade_index(ws_trade).shift_after_delete(picked)
+    mark_sheet_written(ws_trade, H)
+
+    log(ws_log, "INFO",
+        f"Archiviati {len(picked)} trade chiusi (> {ARCHIVE_MIN_AGE_DAYS}g) in "
+        + ", ".join(f"'{ws.title}'" for ws, _ in targets.values()))
+    return len(picked)
 
 
 # ========= OPERATIVA PRINCIPALE =========
 def last_equity(ws, idx_equity) -> Decimal:
-    col = ws.col_values(idx_equity)
+    return last_equity_in_col(ws.col_values(idx_equity))
+
+def last_equity_from_rows(rows, idx_equity) -> Decimal:
+    return last_equity_in_col([(row[idx_equity - 1] if len(row) >= idx_equity else "") for row in rows])
+
+def last_equity_in_col(col) -> Decimal:
     for v in reversed(col[1:]):
         v = (v or "").strip()
         if v:
@@ -477,15 +1081,396 @@ def last_equity(ws, idx_equity) -> Decimal:
                 continue
     return BASE_EQUITY
 
+def trade_rows_snapshot(ws_trade, H, rows=None):
+    """
+    Tab Trade in una sola lettura:
+    -> ({trade_id: {"row", "side", "entry", "qty"}} dei trade APERTO,
+        {trade_id: riga} di tutti i trade con ID, equity corrente)
+    """
+    if rows is None:
+        rows = ws_trade.get_all_values()
+
+    def cell(row, key, default=""):
+        i = H.get(key)
+        return (row[i - 1] if i and len(row) >= i else default).strip()
+
+    out = {}
+    ids = {}
+    equity = None
+    for r in range(2, len(rows) + 1):
+        row = rows[r - 1]
+        eq = cell(row, "equity post-trade")
+        if eq:
+            equity = d(eq)
+        trade_id = cell(row, "id trade")
+        if trade_id:
+            ids.setdefault(trade_id, r)
+        if cell(row, "stato").upper() != "APERTO":
+            continue
+        entry = d(cell(row, "prezzo ingresso") or "0")
+        if not trade_id or entry == 0:
+            continue
+        qty_str = cell(row, "qty")
+        out[trade_id] = {
+            "row": r,
+            "side": cell(row, "lato", "LONG").upper() or "LONG",
+            "entry": entry,
+            "qty": d(qty_str) if qty_str else Decimal("1"),
+        }
+    return out, ids, (equity if equity is not None else BASE_EQUITY)
+
+class TradeIndex:
+    """
+    Trade di una tab Trade per ID: open = trade APERTO -> {"row", "side", "entry", "qty"},
+    rows = ogni ID sulla tab (aperti e chiusi) -> riga; più l'equity corrente.
+    Costruito con una lettura completa, poi mantenuto dalle scritture del bot (riga dalla risposta
+    append, rimozione alla chiusura, spostamento dopo l'archiviazione). La riconciliazione lo
+    riallinea allo snapshot che ha già letto (sync), senza letture aggiuntive. Ogni ricostruzione
+    allinea anche l'allocatore degli ID (trade_ids) agli ID presenti.
+    """
+
+    def __init__(self):
+        self.open = {}
+        self.rows = {}
+        self.equity = BASE_EQUITY
+        self.valid = False
+
+    def rebuild(self, ws_trade, H, rows=None):
+        self.open, self.rows, self.equity = trade_rows_snapshot(ws_trade, H, rows)
+        trade_ids().seed(self.rows)
+        self.valid = True
+
+    def ensure(self, ws_trade, H):
+        if not self.valid:
+            self.rebuild(ws_trade, H)
+        return self
+
+    def sync(self, ws_trade, H, rows) -> bool:
+        """
+        Riallinea i trade aperti allo snapshot della riconciliazione. True se le righe non coincidevano
+        (modifiche esterne). L'equity resta quella progressiva del bot: dal foglio solo alla prima costruzione.
+        """
+        fresh, ids, equity = trade_rows_snapshot(ws_trade, H, rows)
+        trade_ids().seed(ids)
+        if not self.valid:
+            self.equity = equity
+        moved = self.valid and ({k: v["row"] for k, v in fresh.items()} !=
+                                {k: v["row"] for k, v in self.open.items()})
+        self.open, self.rows, self.valid = fresh, ids, True
+        return moved
+
+    def row_of(self, trade_id):
+        t = self.open.get(trade_id)
+        return t["row"] if t else None
+
+    def record(self, trade_id):
+        """Trade per ID senza letture: dati completi se aperto, solo {"row"} se chiuso, None se assente."""
+        t = self.open.get(trade_id)
+        if t is not None:
+            return t
+        r = self.rows.get(trade_id)
+        return {"row": r} if r is not None else None
+
+    def add(self, trade_id, row, side, entry, qty):
+        self.open[trade_id] = {"row": row, "side": side, "entry": entry, "qty": qty}
+        self.rows[trade_id] = row
+
+    def remove(self, trade_id):
+        """Trade chiuso: esce dagli aperti, la sua riga resta nell'indice."""
+        return self.open.pop(trade_id, None)
+
+    def shift_after_delete(self, deleted_rows):
+        """Righe cancellate (es. archiviazione): le righe sotto salgono di tante posizioni quante ne sono sparite sopra."""
+        deleted = sorted(deleted_rows)
+        gone = set(deleted)
+        for t in self.open.values():
+            t["row"] -= bisect.bisect_left(deleted, t["row"])
+        self.rows = {tid: r - bisect.bisect_left(deleted, r) for tid, r in self.rows.items() if r not in gone}
+
+def trade_index(ws_trade) -> TradeIndex:
+    key = tab_key(ws_trade)
+    idx = _TRADE_INDEX.get(key)
+    if idx is None:
+        idx = _TRADE_INDEX[key] = TradeIndex()
+    return idx
+
+
+class TradeIdAllocator:
+    """
+    ID trade "<SIMBOLO>-<n>-<tipo>" con n strettamente crescente per simbolo: il secondo corrente,
+    oppure l'ultimo n + 1 se due ID cadono nello stesso secondo (o l'orologio torna indietro).
+    L'ultimo n è salvato su file (TRADE_ID_STATE) e allineato al massimo n degli ID già sul foglio
+    (seed): niente collisioni dopo un riavvio, anche senza il file. Stesso formato degli ID storici
+    ("PAXGUSDT-1712345678-AUTO0"): anche quelli contano per il seed.
+    """
+    _RE = re.compile(r"^([A-Z0-9]+)-(\d+)-")
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.last = {}
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.last = {k: int(v) for k, v in json.load(f).items()}
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[WARN] Stato ID trade illeggibile ({path}): {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.last, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[WARN] Salvataggio stato ID trade fallito: {e}")
+
+    def seed(self, trade_ids):
+        """Allinea l'ultimo n per simbolo agli ID esistenti (foglio, log)."""
+        with self._lock:
+            changed = False
+            for tid in trade_ids:
+                m = self._RE.match(tid or "")
+                if m and int(m.group(2)) > self.last.get(m.group(1), 0):
+                    self.last[m.group(1)] = int(m.group(2))
+                    changed = True
+            if changed:
+                self._save()
+
+    def next(self, symbol: str, kind: str) -> str:
+        with self._lock:
+            n = max(int(_now()), self.last.get(symbol, 0) + 1)
+            self.last[symbol] = n
+            self._save()
+        return f"{symbol}-{n}-{kind}"
+
+def trade_ids() -> TradeIdAllocator:
+    global _TRADE_IDS
+    if _TRADE_IDS is None:
+        with _STATUS_LOCK:
+            if _TRADE_IDS is None:
+                _TRADE_IDS = TradeIdAllocator(TRADE_ID_STATE)
+    return _TRADE_IDS
+
+def reconcile_pass(ws_trade, ws_log, H, symbol: str, rows=None):
+    """Riconciliazione aperture + chiusure manuali + riallineamento indice righe, su una sola lettura."""
+    sp = _SPOOL
+    if sp is not None and sp.has_pending(ws_trade.spreadsheet):
+        # il foglio non ha ancora le chiusure in coda nel journal: rileggerlo riaprirebbe trade già chiusi
+        print(f"[SPOOL] riconciliazione '{ws_trade.title}' rimandata: scritture in coda")
+        return
+    if rows is None:
+        rows = ws_trade.get_all_values()
+    idx = trade_index(ws_trade)
+    reconcile_and_notify_starts(ws_trade, ws_log, symbol, rows=rows)
+    eq = process_manual_closes(ws_trade, ws_log, H, rows=rows, equity=idx.equity if idx.valid else None)
+    if idx.sync(ws_trade, H, rows):
+        log(ws_log, "DEBUG", f"Indice righe '{ws_trade.title}' riallineato (righe modificate fuori dal bot)")
+    if eq is not None:
+        idx.equity = eq
+
+# ========= RILEVAMENTO MODIFICHE =========
+# Colonne che un umano modifica a mano (apertura/chiusura manuale, correzioni). Ping, P&L live ed
+# equity li riscrive il bot a ogni giro: fuori dal checksum, altrimenti cambierebbe sempre.
+CHECKSUM_KEYS = ["id trade", "lato", "stato", "prezzo ingresso", "qty", "sl %", "tp1 %", "tp2 %", "prezzo chiusura"]
+
+def checksum_formula(ws_trade, H) -> str:
+    """
+    Formula (SUMPRODUCT) che riassume le colonne editabili della tab: per cella riga x (lunghezza
+    + primo carattere + valore numerico). Non è un hash crittografico: cambia con qualsiasi modifica
+    realistica (stato, prezzi, righe aggiunte o spostate).
+    """
+    tab = ws_trade.title.replace("'", "''")
+    parts = []
+    for key in CHECKSUM_KEYS:
+        if key in H:
+            c = col_letters(H[key])
+            rng = f"'{tab}'!{c}2:{c}"
+            parts.append(f"SUMPRODUCT(ROW({rng})*(LEN({rng})+IFERROR(CODE({rng}),0)+IFERROR(VALUE({rng}),0)))")
+    return "=" + "+".join(parts) if parts else ""
+
+def status_ws(ws_trade):
+    """Tab di stato (SHEET_TAB_STATUS) nello stesso file, creata se manca."""
+    sh = ws_trade.spreadsheet
+    with _STATUS_LOCK:
+        ws = _STATUS_WS.get(sheet_key(sh))
+        if ws is None:
+            try:
+                ws = sh.worksheet(SHEET_TAB_STATUS)
+            except Exception as e:
+                if not is_ws_not_found(e):
+                    raise
+                ws = sh.add_worksheet(title=SHEET_TAB_STATUS, rows=100, cols=10)
+                ws.update("A1", [["Tab Trade", "Checksum"]], value_input_option="USER_ENTERED")
+            _STATUS_WS[sheet_key(sh)] = ws
+        return ws
+
+def ensure_checksum(ws_trade, H):
+    """Riga della tab nella tab di stato, con la formula riscritta (le colonne possono essersi spostate)."""
+    ws = status_ws(ws_trade)
+    with _STATUS_LOCK:
+        r = _CHECKSUM_ROW.get(tab_key(ws_trade))
+        if r is None:
+            titles = ws.col_values(1)
+            r = titles.index(ws_trade.title) + 1 if ws_trade.title in titles else max(len(titles), 1) + 1
+            batch_update_ws(ws, [{"range": f"A{r}:B{r}", "values": [[ws_trade.title, checksum_formula(ws_trade, H)]]}])
+            _CHECKSUM_ROW[tab_key(ws_trade)] = r
+    return ws, r
+
+def read_checksum(ws_trade, H):
+    """Valore calcolato del checksum (una cella); None se non disponibile."""
+    try:
+        ws, r = ensure_checksum(ws_trade, H)
+        resp = ws.spreadsheet.values_get(f"'{ws.title}'!B{r}", params={"valueRenderOption": "UNFORMATTED_VALUE"})
+        v = (resp.get("values") or [[None]])[0][0]
+    except Exception as e:
+        print("[DEBUG] lettura checksum fallita:", e)
+        return None
+    return v if isinstance(v, (int, float)) else None   # formula non calcolata / errore: nessun checksum
+
+def checksum_before_write(ws_trade, H=None):
+    """
+    Subito prima di una scrittura del bot (seguita da mark_sheet_written): se il checksum si è già mosso dal
+    riferimento qualcuno ha modificato la tab a mano, e dopo la scrittura non si potrebbe più distinguerlo.
+    La tab resta in _CHECKSUM_PENDING e il prossimo sheet_changed chiede la passata.
+    """
+    if not CHANGE_DETECT:
+        return
+    key = tab_key(ws_trade)
+    if key in _CHECKSUM_PENDING or key not in _CHECKSUM_SEEN:
+        return   # passata già dovuta (nessun riferimento: sheet_changed la chiede comunque)
+    cur = read_checksum(ws_trade, H or _H_CACHE)
+    if cur is None or cur != _CHECKSUM_SEEN[key]:
+        _CHECKSUM_PENDING.add(key)
+
+def mark_sheet_written(ws_trade, H=None):
+    """
+    Il bot ha scritto colonne del checksum (aperture, chiusure, correzioni): il checksum riletto dopo la
+    scrittura diventa quello di riferimento, così la prossima passata si salta se nessuno tocca la tab a mano.
+    Una modifica manuale fatta tra l'ultimo controllo e la scrittura del bot la vede checksum_before_write.
+    Checksum non leggibile: passata al prossimo controllo.
+    """
+    if not CHANGE_DETECT:
+        return
+    key = tab_key(ws_trade)
+    H = H or _H_CACHE
+    cur = read_checksum(ws_trade, H) if H is not None or key in _CHECKSUM_ROW else None
+    if cur is None:
+        _CHECKSUM_SEEN.pop(key, None)
+    else:
+        _CHECKSUM_SEEN[key] = cur
+
+def sheet_changed(ws_trade, H) -> bool:
+    """
+    True se la riconciliazione completa serve: checksum cambiato (modifica manuale; le scritture del bot
+    aggiornano il riferimento in mark_sheet_written), modifica vista da checksum_before_write, checksum non
+    leggibile o passata di sicurezza scaduta.
+    Il checksum è letto PRIMA della passata: una modifica fatta durante la passata lo fa
+    cambiare di nuovo e viene ripresa al giro successivo.
+    """
+    key = tab_key(ws_trade)
+    now = _now()
+    if not CHANGE_DETECT:
+        return True
+    cur = read_checksum(ws_trade, H)
+    forced = now - _LAST_FULL_RECONCILE.get(key, 0) >= RECONCILE_FORCE_SECONDS
+    changed = (cur is None or forced or key in _CHECKSUM_PENDING or cur != _CHECKSUM_SEEN.get(key))
+    metrics.inc("bot_reconcile_checks_total", labels={"result": "pass" if changed else "skip"},
+                help_text="Controlli di modifica prima della riconciliazione")
+    if changed:
+        _CHECKSUM_SEEN[key] = cur
+        _LAST_FULL_RECONCILE[key] = now
+        _CHECKSUM_PENDING.discard(key)
+    return changed
+
+def reconcile_if_changed(ws_trade, ws_log, H, symbol: str) -> bool:
+    """Riconciliazione periodica: la lettura completa della tab solo se sheet_changed lo richiede."""
+    if not sheet_changed(ws_trade, H):
+        return False
+    reconcile_pass(ws_trade, ws_log, H, symbol)
+    return True
+
+def append_log_rows(ws_log, rows):
+    """
+    Righe in coda alla tab Log. Con il journal (SPOOL_PATH) passano da lì, con la chiave di idempotenza
+    nella colonna dopo "Origine"; se Sheets non risponde restano in coda (False). Senza journal: eccezione.
+    """
+    sp = spool()
+    if sp is not None:
+        written, resp = sp.append_rows(ws_log.spreadsheet, ws_log.title, rows)
+    else:
+        written, resp = True, ws_log.append_rows(rows, value_input_option="USER_ENTERED")
+    rr = rows_from_updated_range(resp) if resp else None
+    if rr:
+        _LOG_LAST_ROW[ws_log.title] = rr[1]
+    return written
+
 def log(ws_log, level, msg):
     try:
-        ws_log.append_row([now_local_str(), level, msg, "bot"], value_input_option="USER_ENTERED")
+        if not append_log_rows(ws_log, [[now_local_str(), level, msg, "bot"]]):
+            print(f"[LOG] {level}: {msg} (in coda)")
     except Exception as e:
         print(f"[LOG] {level}: {msg} ({e})")
 
+def _log_period_key(ws_base):
+    if LOG_ROTATION == "daily":
+        return now_local().strftime("%Y-%m-%d")
+    if LOG_ROTATION == "weekly":
+        return now_local().strftime("%G-W%V")
+    if LOG_ROTATION == "size":
+        cur = _LOG_ACTIVE if _LOG_ACTIVE is not None else ws_base
+        if _LOG_ACTIVE_KEY is None or _LOG_LAST_ROW.get(cur.title, 0) >= LOG_MAX_ROWS:
+            return now_local().strftime("%Y-%m-%d %H%M%S")
+        return _LOG_ACTIVE_KEY
+    return None
+
+def rotate_log_ws(ws_base):
+    """
+    Ritorna la tab Log su cui scrivere. Con LOG_ROTATION attiva usa una tab per periodo
+    ("Log 2024-05-01", "Log 2024-W18", ...) creata al volo con l'header della tab base,
+    e cancella le più vecchie oltre LOG_RETENTION. Nessuna chiamata API se il periodo non cambia.
+    """
+    global _LOG_ACTIVE, _LOG_ACTIVE_KEY, _LOG_PREV
+    key = _log_period_key(ws_base)
+    if key is None:
+        return ws_base
+    if key == _LOG_ACTIVE_KEY and _LOG_ACTIVE is not None:
+        return _LOG_ACTIVE
+
+    sh = ws_base.spreadsheet
+    title = f"{ws_base.title} {key}"
+    try:
+        ws = sh.worksheet(title)
+    except Exception as e:
+        if not is_ws_not_found(e):
+            raise
+        header = ws_base.row_values(1) or ["Data/Ora", "Livello", "Messaggio", "Origine"]
+        ws = sh.add_worksheet(title=title, rows=1000, cols=max(len(header), 4))
+        ws.update("A1", [header], value_input_option="USER_ENTERED")
+
+    _LOG_PREV = _LOG_ACTIVE
+    _LOG_ACTIVE, _LOG_ACTIVE_KEY = ws, key
+
+    # Retention: i titoli ruotati sono ordinabili lessicograficamente
+    try:
+        rotated = sorted((w for w in sh.worksheets() if w.title.startswith(f"{ws_base.title} ")),
+                         key=lambda w: w.title)
+        for old in rotated[:-LOG_RETENTION] if LOG_RETENTION > 0 else []:
+            if old.title in (ws.title, _LOG_PREV.title if _LOG_PREV is not None else None):
+                continue
+            sh.del_worksheet(old)
+            _LOG_LAST_ROW.pop(old.title, None)
+    except Exception as e:
+        print(f"[LOG] retention fallita: {e}")
+    return ws
+
 def should_log_heartbeat(price: Decimal) -> bool:
     global _LAST_HEARTBEAT_TS, _LAST_HEARTBEAT_PRICE
-    now_ts = time.time()
+    now_ts = _now()
     if _LAST_HEARTBEAT_TS == 0 or _LAST_HEARTBEAT_PRICE is None:
         _LAST_HEARTBEAT_TS = now_ts
         _LAST_HEARTBEAT_PRICE = price
@@ -505,18 +1490,145 @@ def should_log_heartbeat(price: Decimal) -> bool:
         pass
     return False
 
-# --- NUOVO: aggiorna la "foto" globale in K2 (timestamp + prezzo) ---
-def update_global_ping_k2(ws_trade, col_ping: int, price: Decimal):
+class HeartbeatRing:
+    """
+    Ultimi HEARTBEAT_RING heartbeat (ora, simbolo, prezzo, durata giro) in un buffer circolare, salvato
+    su file a ogni campione. Sul foglio è un blocco fisso della tab di stato (colonne D:G, il più
+    recente in alto) riscritto nel batch del giro: nessuna riga nuova, una sola scrittura.
+    """
+    HEADER = ["Heartbeat", "Simbolo", "Prezzo", "Giro (s)"]
+    COL = 4   # D
+
+    def __init__(self, size: int, path: str = ""):
+        self.samples = deque(maxlen=max(1, size))
+        self.path = path
+        self.dirty = False
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.samples.extend(tuple(x) for x in json.load(f))
+                self.dirty = bool(self.samples)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[WARN] Heartbeat su disco illeggibili ({path}): {e}")
+
+    def add(self, symbol: str, price: Decimal, cycle_seconds: float):
+        with self._lock:
+            self.samples.append((now_local_str(), symbol, fmt_dec(price), round(cycle_seconds, 3)))
+            self.dirty = True
+            if self.path:
+                try:
+                    tmp = self.path + ".tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(list(self.samples), f)
+                    os.replace(tmp, self.path)
+                except Exception as e:
+                    print(f"[WARN] Salvataggio heartbeat fallito: {e}")
+
+    def block_update(self, status_title: str):
+        """Range del blocco se ci sono campioni nuovi (poi pulito; block_failed se il batch fallisce), altrimenti None."""
+        with self._lock:
+            if not self.dirty:
+                return None
+            self.dirty = False
+            rows = [list(x) for x in reversed(self.samples)]
+        rows += [[""] * len(self.HEADER)] * (self.samples.maxlen - len(rows))
+        first, last = col_letters(self.COL), col_letters(self.COL + len(self.HEADER) - 1)
+        tab = status_title.replace("'", "''")
+        return {"range": f"'{tab}'!{first}1:{last}{len(rows) + 1}", "values": [self.HEADER] + rows}
+
+    def block_failed(self):
+        """L'ultimo blocco non è arrivato sul foglio: di nuovo da scrivere al prossimo batch."""
+        with self._lock:
+            self.dirty = True
+
+def heartbeats() -> HeartbeatRing:
+    global _HEARTBEAT
+    if _HEARTBEAT is None:
+        with _STATUS_LOCK:
+            if _HEARTBEAT is None:
+                _HEARTBEAT = HeartbeatRing(HEARTBEAT_RING, HEARTBEAT_STATE)
+    return _HEARTBEAT
+
+def record_heartbeat(ws_log, price: Decimal, cycle_seconds: float, symbol: str | None = None) -> bool:
+    """Campione nel buffer (stesso ritmo di prima: should_log_heartbeat); riga Log solo con HEARTBEAT_TO_LOG=1."""
+    if not price or not should_log_heartbeat(price):
+        return False
+    heartbeats().add(symbol or cur_symbol(), price, cycle_seconds)
+    if HEARTBEAT_TO_LOG and ws_log is not None:
+        log(ws_log, "INFO", f"Heartbeat OK - {fmt_dec(price)}")
+    return True
+
+def heartbeat_updates(ws_trade):
+    """
+    Blocco heartbeat per il batch del giro (lista vuota se nulla di nuovo o tab di stato non disponibile).
+    Il range è nella tab di stato del file di home_ws(ws_trade): va scritto con batch_update_many.
+    """
+    try:
+        blk = heartbeats().block_update(status_ws(home_ws(ws_trade)).title)
+    except Exception as e:
+        print("[DEBUG] blocco heartbeat non scritto:", e)
+        return []
+    return [blk] if blk else []
+
+# ========= AGGREGATI DI PERFORMANCE =========
+def perf():
+    global _PERF
+    if _PERF is None:
+        with _STATUS_LOCK:
+            if _PERF is None:
+                from perf_aggregates import PerfAggregates
+                _PERF = PerfAggregates(PERF_STATE)
+    return _PERF
+
+def record_close(entry: Decimal, close_price: Decimal, qty: Decimal, pnl_val: Decimal, symbol: str | None = None):
+    """Chiusura negli aggregati (O(1), nessuna lettura del foglio); il blocco va sul foglio con perf_updates."""
+    try:
+        perf().add(now_local(), symbol or cur_symbol(), float(pnl_val), float((entry + close_price) * qty))
+    except Exception as e:
+        print("[WARN] aggregati non aggiornati:", e)
+
+def summary_ws(ws_trade):
+    """Tab di riepilogo (SHEET_TAB_SUMMARY) nel file di ws_trade (sempre home_ws), creata se manca."""
+    global _SUMMARY_WS
+    with _STATUS_LOCK:
+        if _SUMMARY_WS is None:
+            sh = ws_trade.spreadsheet
+            try:
+                _SUMMARY_WS = sh.worksheet(SHEET_TAB_SUMMARY)
+            except Exception as e:
+                if not is_ws_not_found(e):
+                    raise
+                _SUMMARY_WS = sh.add_worksheet(title=SHEET_TAB_SUMMARY, rows=100, cols=10)
+        return _SUMMARY_WS
+
+def perf_updates(ws_trade):
+    """Blocco aggregati per il batch (lista vuota se nessuna chiusura nuova o tab non disponibile); file di home_ws."""
+    if _PERF is None and not PERF_STATE:
+        return []
     try:
-        ws_trade.update_cell(2, col_ping, f"{now_local_str()} - {fmt_dec(price)}")
+        blk = perf().block_update(summary_ws(home_ws(ws_trade)).title, now_local())
     except Exception as e:
-        print("[DEBUG] update K2 fallito:", e)
+        print("[DEBUG] blocco aggregati non scritto:", e)
+        return []
+    return [blk] if blk else []
+
+def status_blocks_failed():
+    """Batch con i blocchi heartbeat/aggregati non scritto: si riscrivono al batch successivo."""
+    if _HEARTBEAT is not None:
+        _HEARTBEAT.block_failed()
+    if _PERF is not None:
+        _PERF.block_failed()
 
 def update_open_rows_light(ws_trade, ws_log, client, H, col_ping, lastp=None):
     """
     - K2: sempre aggiornato con 'timestamp - prezzo'
     - Righe APERTE: aggiornano K[riga] con 'timestamp - prezzo' + P&L live
     - Righe CHIUSE: NON toccate (ping resta congelato)
+    - Heartbeat recenti nella tab di stato, se ce ne sono di nuovi
+    Tutto in un solo values_batch_update (due in parallelo se heartbeat/riepilogo stanno in un altro shard).
     """
     nowloc = now_local_str()
     if lastp is None:
@@ -525,142 +1637,68 @@ def update_open_rows_light(ws_trade, ws_log, client, H, col_ping, lastp=None):
         log(ws_log, "WARN", "Prezzo 0 da Binance")
         return
 
-    # 1) "Foto" globale in K2
-    update_global_ping_k2(ws_trade, col_ping, lastp)
+    # 1) "Foto" globale in K2 + heartbeat, nello stesso batch delle righe
+    updates = [{"range": a1(2, col_ping), "values": [[f"{nowloc} - {fmt_dec(lastp)}"]]}]
+    blocks = heartbeat_updates(ws_trade)
 
-    # 2) Se non ci sono righe dati, stop qui
-    stato_col = ws_trade.col_values(H["stato"])
-    if len(stato_col) <= 1:
-        return
+    # 2) Trade aperti dall'indice righe (nessuna lettura del foglio a regime)
+    idx = trade_index(ws_trade).ensure(ws_trade, H)
 
-    side_col  = ws_trade.col_values(H["lato"]) if "lato" in H else []
-    entry_col = ws_trade.col_values(H["prezzo ingresso"])
-    qty_col   = ws_trade.col_values(H["qty"])  if "qty" in H  else []
-    close_col = ws_trade.col_values(H["prezzo chiusura"]) if "prezzo chiusura" in H else []
-    id_col    = ws_trade.col_values(H["id trade"]) if "id trade" in H else []
-
-    plpct_col_idx  = H["p&l %"]
-    plval_col_idx  = H["p&l valore"]
-    equity_col_idx = H["equity post-trade"]
-    note_col_idx   = H.get("note")
-    stato_col_idx  = H["stato"]
-    close_col_idx  = H.get("prezzo chiusura")
-    delta_col_idx  = H.get("delta")
-
-    updates = []
-    rows_already_closing = set()
     global _LAST_MISS_LOG_TS
-    tol = (Decimal(HIT_TOL_BP) / Decimal("10000")) if HIT_TOL_BP > 0 else Decimal("0")
-
-    n_rows = len(stato_col) - 1
-    start_row = 2
-    for i in range(n_rows):
-        r = start_row + i
-        if r in rows_already_closing:
-            continue
 
-        stato = (stato_col[i+1] if i+1 < len(stato_col) else "").strip().upper()
-        side  = (side_col[i+1]  if i+1 < len(side_col)  else "LONG").strip().upper()
-        entry_str = (entry_col[i+1] if i+1 < len(entry_col) else "").strip()
-        qty_str   = (qty_col[i+1]   if i+1 < len(qty_col)   else "").strip()
-        close_str = (close_col[i+1] if i+1 < len(close_col) else "").strip()
-        trade_id  = (id_col[i+1] if i+1 < len(id_col) else "").strip()
+    # Trigger TP/SL di tutti gli aperti in un colpo (trade con OCO su Binance: li gestisce l'exchange)
+    ordered = sorted(idx.open.items(), key=lambda kv: kv[1]["row"])
+    virtual = [(tid, t) for tid, t in ordered if _OCO is None or not _OCO.manages(tid)]
+    hits = dict(zip((tid for tid, _ in virtual),
+                    check_hits([(t["side"], t["entry"], t["qty"]) for _, t in virtual], lastp)))
+    closes = []
+    equity = idx.equity
 
-        entry = d(entry_str) if entry_str else Decimal("0")
-        qty   = d(qty_str) if qty_str else Decimal("1")
+    for trade_id, t in ordered:
+        r, side, entry, qty = t["row"], t["side"], t["entry"], t["qty"]
 
         # --- Solo righe APERTE aggiornano il proprio ping ---
-        if stato != "CHIUSO":
-            updates.append({
-                "range": gspread.utils.rowcol_to_a1(r, col_ping),
-                "values": [[f"{nowloc} - {fmt_dec(lastp)}"]],
-            })
-
-        # Se riga CHIUSA o entry mancante, non calcolare P&L live
-        if stato == "CHIUSO" or entry == 0:
-            continue
-
-        # Trigger TP/SL
-        tp1, tp2, sl = compute_targets(entry)
-        hit = None
-        close_price = None
+        updates.append({
+            "range": a1(r, col_ping),
+            "values": [[f"{nowloc} - {fmt_dec(lastp)}"]],
+        })
 
-        if side == "LONG":
-            if lastp >= (tp2 * (Decimal("1") - tol)): hit, close_price = "TP2", tp2
-            elif lastp >= (tp1 * (Decimal("1") - tol)): hit, close_price = "TP1", tp1
-            elif lastp <= (sl  * (Decimal("1") + tol)): hit, close_price = "SL",  sl
-        else:
-            if lastp <= (tp2 * (Decimal("1") + tol)): hit, close_price = "TP2", tp2
-            elif lastp <= (tp1 * (Decimal("1") + tol)): hit, close_price = "TP1", tp1
-            elif lastp >= (sl  * (Decimal("1") - tol)): hit, close_price = "SL",  sl
+        hit, close_price, pnl_pct, pnl_val = hits.get(trade_id, (None,) * 4)
 
         if not hit:
-            pnl_pct, pnl_val = pnl_values(side, entry, lastp, qty)
-            delta_price = (lastp - entry) if side == "LONG" else (entry - lastp)
-
-            row_updates = [
-                {"range": gspread.utils.rowcol_to_a1(r, plpct_col_idx), "values": [[fmt_dec(pnl_pct, "0.0001")]]},
-                {"range": gspread.utils.rowcol_to_a1(r, plval_col_idx), "values": [[fmt_dec(pnl_val, "0.01")]]},
-            ]
-            if delta_col_idx:
-                row_updates.append({
-                    "range": gspread.utils.rowcol_to_a1(r, delta_col_idx),
-                    "values": [[fmt_dec(delta_price, "0.01")]]
-                })
-            updates += row_updates
-
-            now_ts = time.time()
+            updates += live_row_updates(H, r, side, entry, lastp, qty)
+
+            now_ts = _now()
             if now_ts - _LAST_MISS_LOG_TS >= MISS_LOG_EVERY:
                 _LAST_MISS_LOG_TS = now_ts
+                tp1, tp2, sl = compute_targets(entry)
                 log(ws_log, "DEBUG",
                     f"Nessuna chiusura r{r}: side={side} entry={fmt_dec(entry)} last={fmt_dec(lastp)} "
                     f"tp1={fmt_dec(tp1)} tp2={fmt_dec(tp2)} sl={fmt_dec(sl)} qty={fmt_dec(qty,'0.00000001')}")
             continue
 
-        # Debounce: sta chiudendo questa riga
-        rows_already_closing.add(r)
-
-        # Chiusura per TP/SL
-        pnl_pct, pnl_val = pnl_values(side, entry, close_price, qty)
-        eq_prev = last_equity(ws_trade, equity_col_idx)
-        eq_new  = eq_prev + pnl_val
-
-        if close_col_idx:
-            updates.append({"range": gspread.utils.rowcol_to_a1(r, close_col_idx),
-                            "values": [[fmt_dec(close_price)]]})
-        updates.append({"range": gspread.utils.rowcol_to_a1(r, stato_col_idx),
-                        "values": [["CHIUSO"]]})
-        if note_col_idx:
-            updates.append({"range": gspread.utils.rowcol_to_a1(r, note_col_idx),
-                            "values": [[hit]]})
-        updates += [
-            {"range": gspread.utils.rowcol_to_a1(r, plpct_col_idx), "values": [[fmt_dec(pnl_pct, "0.0001")]]},
-            {"range": gspread.utils.rowcol_to_a1(r, plval_col_idx), "values": [[fmt_dec(pnl_val, "0.01")]]},
-            {"range": gspread.utils.rowcol_to_a1(r, equity_col_idx), "values": [[fmt_dec(eq_new, "0.01")]]},
-        ]
-
-        # --- LOG con ID trade ---
-        log(ws_log, "INFO",
-            f"Close {hit} r{r} id={trade_id} - side={side} entry={fmt_dec(entry)} "
-            f"close={fmt_dec(close_price)} pnl%={fmt_dec(pnl_pct,'0.0001')} "
-            f"pnl=${fmt_dec(pnl_val,'0.01')} eq->{fmt_dec(eq_new,'0.01')}")
-
-        # --- NOTIFICA con ID trade ---
-        notify(
-            f"BOT ORO | {SYMBOL}\n"
-            f"Trade chiuso: {hit}\n"
-            f"ID: {trade_id}\n"
-            f"Entry: {fmt_dec(entry)}  Close: {fmt_dec(close_price)}\n"
-            f"P&L: {fmt_dec(pnl_val,'0.01')} USD  ({fmt_dec(pnl_pct,'0.0001')}%)\n"
-            f"Equity: {fmt_dec(eq_new,'0.01')} - {TIMEZONE}"
-        )
+        # Chiusura per TP/SL: indice, equity, aggregati e notifiche solo a scrittura riuscita (commit_closes)
+        equity += pnl_val
+        updates += close_row_updates(H, r, hit, close_price, pnl_pct, pnl_val, equity)
+        closes.append((trade_id, r, hit, side, entry, close_price, qty, pnl_pct, pnl_val, equity))
 
+    blocks += perf_updates(ws_trade)   # le chiusure di questo giro entrano nel blocco del giro dopo
+    metrics.set_gauge("bot_sheet_batch_cells", len(updates) + len(blocks), help_text="Celle nell'ultimo batch di aggiornamento righe")
     if updates:
-        ws_trade.spreadsheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": updates})
+        if closes:
+            checksum_before_write(ws_trade, H)
+        try:
+            batch_update_many([(ws_trade, updates), (home_ws(ws_trade), blocks)])
+        except Exception:
+            status_blocks_failed()
+            raise
+        commit_closes(idx, ws_log, closes)
+        if closes:
+            mark_sheet_written(ws_trade, H)
 
 
 def open_new_trade(ws_trade, ws_log, trade_id: str, side="LONG", qty=Decimal("1"),
-                   H=None, col_ping=None, entry_price: Decimal | None = None) -> Decimal:
+                   H=None, col_ping=None, entry_price: Decimal | None = None, client=None) -> Decimal:
     if H is None:
         header = get_header(ws_trade); H = build_header_map(header)
     need=["data/ora","id trade","lato","stato","prezzo ingresso","qty","sl %","tp1 %","tp2 %","ultimo ping"]
@@ -669,12 +1707,29 @@ def open_new_trade(ws_trade, ws_log, trade_id: str, side="LONG", qty=Decimal("1"
             raise RuntimeError(f"Colonna '{k}' mancante per aprire un trade.")
 
     if entry_price is None:
-        price = get_last_price(binance_client())
+        client = client or binance_client()
+        price = get_last_price(client)
     else:
         price = d(entry_price)
 
     if price == 0:
         raise RuntimeError("Prezzo non disponibile per apertura trade.")
+    if not sheets_writable():
+        raise RuntimeError("Google Sheets non raggiungibile (circuit breaker aperto): apertura rimandata.")
+
+    # Filtri exchange (LOT_SIZE / MIN_NOTIONAL): qty al passo del simbolo, sotto i minimi non si apre
+    filters = symbol_filters(client)
+    if filters is not None:
+        qty = filters.qty(d(qty))
+        filters.check(qty, price)
+
+    # Modalità OCO: ordine a mercato + OCO su Binance prima di scrivere la riga (entry/qty effettivi)
+    oco = None
+    if _OCO is not None:
+        if side.upper() != "LONG":
+            raise RuntimeError("EXECUTION_MODE=oco supporta solo LONG (spot)")
+        oco = _OCO.open_long(trade_id, qty, price)   # arrotonda anche i prezzi al tick
+        price, qty = oco["entry"], oco["qty"]
 
     row=[""]*max(H.values())
     def setv(k,v): row[H[k]-1]=v
@@ -688,67 +1743,140 @@ def open_new_trade(ws_trade, ws_log, trade_id: str, side="LONG", qty=Decimal("1"
     setv("sl %", fmt_dec(SL_PCT,"0.0000001"))
     setv("tp1 %", fmt_dec(TP1_PCT,"0.0000001"))
     setv("tp2 %", fmt_dec(TP2_PCT,"0.0000001"))
+    if oco is not None and H.get("strategia"):
+        setv("strategia", oco["strategy"])   # serve a ritrovare la lista OCO dopo un riavvio
     if col_ping is None:
         col_ping = find_col_by_header(ws_trade, "Ultimo ping")
     row[col_ping-1] = f"{now_local_str()} - {fmt_dec(price)}"
 
-    # --- DEBUG: prima dell'append, dove stiamo scrivendo e quante righe ci sono ---
-    try:
-        rows_before = len(ws_trade.get_all_values())
-        log(ws_log, "DEBUG",
-            f"[OPEN] sheet='{ws_trade.spreadsheet.title}' tab='{ws_trade.title}' rows_before={rows_before}")
-    except Exception as e:
-        log(ws_log, "DEBUG", f"[OPEN] pre-append inspect failed: {e}")
-
-    # --- APPEND robusto via values_append ---
+    # --- APPEND robusto via values_append: la risposta dice in che riga è finito il trade ---
+    checksum_before_write(ws_trade, H)
     try:
         rng = f"'{ws_trade.title}'!A1"
-        ws_trade.spreadsheet.values_append(
+        resp = ws_trade.spreadsheet.values_append(
             rng,
             params={"valueInputOption": "USER_ENTERED", "insertDataOption": "INSERT_ROWS"},
             body={"values": [row]},
         )
-        log(ws_log, "DEBUG", f"[OPEN] values_append OK id={trade_id}")
     except Exception as e:
-        log(ws_log, "ERROR", f"[OPEN] values_append FAILED id={trade_id}: {e}")
+        extra = f" (OCO {oco['list_id']} già piazzato su Binance!)" if oco else ""
+        log(ws_log, "ERROR", f"[OPEN] values_append FAILED id={trade_id}{extra}: {e}")
         raise
-
-    # --- DEBUG: dopo l'append, verifico che sia stata aggiunta una riga ---
-    try:
-        rows_after = len(ws_trade.get_all_values())
-        log(ws_log, "DEBUG",
-            f"[OPEN] id={trade_id} rows_after={rows_after} delta={rows_after - rows_before}")
-    except Exception as e:
-        log(ws_log, "DEBUG", f"[OPEN] post-append inspect failed: {e}")
+    mark_sheet_written(ws_trade, H)
+
+    idx = trade_index(ws_trade)
+    rr = rows_from_updated_range(resp)
+    if rr:
+        # stessi valori che darebbe una rilettura della riga
+        idx.add(trade_id, rr[0], side.upper(), d(fmt_dec(price)), d(fmt_dec(qty, "0.00000001")))
+        log(ws_log, "DEBUG", f"[OPEN] values_append OK id={trade_id} row={rr[0]}")
+    else:
+        idx.valid = False   # riga ignota: alla prossima lettura l'indice si ricostruisce
+        log(ws_log, "DEBUG", f"[OPEN] values_append OK id={trade_id} (riga non indicata nella risposta)")
 
     # Notifica apertura
-    msg = (f"BOT ORO | {SYMBOL}\n"
+    msg = (f"BOT ORO | {cur_symbol()}\n"
            f"Trade APERTO: {trade_id}\n"
            f"Side: {side}  Entry: {fmt_dec(price)}\n"
            f"TP1 {fmt_dec(price*(1+TP1_PCT))} - TP2 {fmt_dec(price*(1+TP2_PCT))} - SL {fmt_dec(price*(1-SL_PCT))}\n"
-           f"{TIMEZONE}")
+           + (f"OCO {oco['list_id']}: TP {fmt_dec(oco['tp'])} / stop {fmt_dec(oco['stop'])}\n" if oco else "")
+           + f"{TIMEZONE}")
     log(ws_log,"INFO",f"Aperto trade {trade_id} @ {fmt_dec(price)}")
     notify(msg)
     return price
 
 
+def apply_exchange_fills(ws_trade, ws_log, H):
+    """Modalità OCO: chiude sul foglio i trade le cui gambe OCO sono state eseguite (fill dallo stream)."""
+    if _OCO is None:
+        return
+    fills = _OCO.drain()
+    if not fills:
+        return
+    idx = trade_index(ws_trade).ensure(ws_trade, H)
+    updates, closes, applied = [], [], []
+    equity = idx.equity
+    for f in fills:
+        trade_id, hit, close_price = f["trade_id"], f["hit"], f["price"]
+        t = idx.open.get(trade_id)
+        if t is None or any(c[0] == trade_id for c in closes):
+            log(ws_log, "WARN", f"Fill OCO {f['list_id']} ({hit}) per {trade_id}: trade non aperto sul foglio")
+            continue
+        r, side, entry = t["row"], t["side"], t["entry"]
+        pnl_pct, pnl_val = pnl_values(side, entry, close_price, f["qty"])
+        equity += pnl_val
+        updates += close_row_updates(H, r, hit, close_price, pnl_pct, pnl_val, equity)
+        closes.append((trade_id, r, hit, side, entry, close_price, f["qty"], pnl_pct, pnl_val, equity))
+        applied.append(f)
+
+    if updates:
+        checksum_before_write(ws_trade, H)
+        try:
+            batch_update_many([(ws_trade, updates), (home_ws(ws_trade), perf_updates(ws_trade))])
+        except Exception:
+            _OCO.requeue(applied)   # i fill eseguiti su Binance non si perdono: si riscrivono al giro dopo
+            status_blocks_failed()
+            raise
+        commit_closes(idx, ws_log, closes)
+        mark_sheet_written(ws_trade, H)
+
+def start_oco_execution(ws_trade, ws_log, client, H, rows):
+    """Filtri simbolo, liste OCO dei trade APERTO (colonna Strategia), stream utente e recupero fill persi."""
+    global _OCO
+    from oco_execution import OcoExecutor
+    _OCO = OcoExecutor(client, cur_symbol(), {"TP1": TP1_PCT, "TP2": TP2_PCT}, SL_PCT,
+                       filters=symbol_filters(client))
+    i_id, i_st, i_strat = H.get("id trade"), H.get("stato"), H.get("strategia")
+    if i_strat:
+        _OCO.load_open({row[i_id - 1].strip(): row[i_strat - 1].strip()
+                        for row in rows[1:]
+                        if len(row) >= max(i_id, i_st, i_strat) and row[i_st - 1].strip().upper() == "APERTO"})
+    else:
+        log(ws_log, "WARN", "EXECUTION_MODE=oco senza colonna Strategia: le liste OCO non sopravvivono a un riavvio")
+    _OCO.start_stream()
+    _OCO.catch_up()
+    log(ws_log, "INFO", f"Esecuzione OCO attiva: {len(_OCO.lists)} liste aperte, filtri step={_OCO.filters.step} "
+                        f"tick={_OCO.filters.tick} minNotional={_OCO.filters.min_notional}")
+
+def cooldown_skip_reason(now_ts: float, last_trade_ts: float):
+    """Anti-clustering temporale: messaggio di skip o None."""
+    if now_ts - last_trade_ts < MIN_TRADE_GAP_SECONDS:
+        return f"Skip open: cooldown attivo {int(now_ts - last_trade_ts)}s < {MIN_TRADE_GAP_SECONDS}s"
+    return None
+
+def entry_skip_reason(lastp: Decimal, open_entries, last_entry_price):
+    """Anti-clustering di prezzo (distanza dagli aperti + grid step): messaggio di skip o None."""
+    # Distanza minima da altri APERTI
+    if MIN_ENTRY_DISTANCE_BP > 0 and open_entries:
+        too_close = any(abs((lastp - e) / e) * 10000 < MIN_ENTRY_DISTANCE_BP for e in open_entries)
+        if too_close:
+            return f"Skip open: distanza < {MIN_ENTRY_DISTANCE_BP}bp da un entry aperto (last={fmt_dec(lastp)})"
+
+    # Grid step rispetto all'ultimo aperto
+    if GRID_STEP_BP > 0 and last_entry_price:
+        move_bp = abs((lastp - last_entry_price) / last_entry_price) * 10000
+        if move_bp < GRID_STEP_BP:
+            return (f"Skip open: grid step {move_bp:.1f}bp < {GRID_STEP_BP}bp "
+                    f"(ultimo={fmt_dec(last_entry_price)} last={fmt_dec(lastp)})")
+    return None
+
 def ensure_min_open_trades(ws_trade, ws_log, client, H, col_ping,
                            min_trades=5, side="LONG", qty=Decimal("1"),
                            last_price: Decimal | None = None):
-    global _LAST_TRADE_TS, _LAST_ENTRY_PRICE
     try:
-        stato_col = ws_trade.col_values(H["stato"])
-        n_open = 0
-        if len(stato_col) > 1:
-            n_open = sum(1 for s in stato_col[1:] if (s or "").strip().upper() == "APERTO")
+        idx = trade_index(ws_trade).ensure(ws_trade, H)
+        n_open = len(idx.open)
+        metrics.set_gauge("bot_open_trades", n_open, help_text="Trade APERTO nella tab Trade")
 
         to_open = max(0, min_trades - n_open)
         if to_open <= 0:
             return
 
-        now_ts = time.time()
-        if now_ts - _LAST_TRADE_TS < MIN_TRADE_GAP_SECONDS:
-            log(ws_log, "DEBUG", f"Skip open: cooldown attivo {int(now_ts - _LAST_TRADE_TS)}s < {MIN_TRADE_GAP_SECONDS}s")
+        now_ts = _now()
+        symbol = cur_symbol()
+        reason = cooldown_skip_reason(now_ts, _LAST_TRADE_TS.get(symbol, 0))
+        if reason:
+            log(ws_log, "DEBUG", reason)
             return
 
         lastp = d(last_price) if last_price else get_last_price(client)
@@ -757,35 +1885,16 @@ def ensure_min_open_trades(ws_trade, ws_log, client, H, col_ping,
             return
 
         # Distanza minima da altri APERTI
-        open_entries = []
-        entry_col = ws_trade.col_values(H["prezzo ingresso"])
-        if len(stato_col) > 1:
-            for i in range(1, len(stato_col)):
-                if (stato_col[i] or "").strip().upper() == "APERTO":
-                    v = (entry_col[i] if i < len(entry_col) else "").strip()
-                    if v:
-                        e = d(v)
-                        if e > 0:
-                            open_entries.append(e)
-
-        if MIN_ENTRY_DISTANCE_BP > 0 and open_entries:
-            too_close = any(abs((lastp - e) / e) * 10000 < MIN_ENTRY_DISTANCE_BP for e in open_entries)
-            if too_close:
-                log(ws_log, "DEBUG",
-                    f"Skip open: distanza < {MIN_ENTRY_DISTANCE_BP}bp da un entry aperto (last={fmt_dec(lastp)})")
-                return
+        open_entries = [t["entry"] for t in idx.open.values()]
 
-        # Grid step rispetto all'ultimo aperto
-        if GRID_STEP_BP > 0 and _LAST_ENTRY_PRICE:
-            move_bp = abs((lastp - _LAST_ENTRY_PRICE) / _LAST_ENTRY_PRICE) * 10000
-            if move_bp < GRID_STEP_BP:
-                log(ws_log, "DEBUG",
-                    f"Skip open: grid step {move_bp:.1f}bp < {GRID_STEP_BP}bp (ultimo={fmt_dec(_LAST_ENTRY_PRICE)} last={fmt_dec(lastp)})")
-                return
+        reason = entry_skip_reason(lastp, open_entries, _LAST_ENTRY_PRICE.get(symbol))
+        if reason:
+            log(ws_log, "DEBUG", reason)
+            return
 
         # Apri i mancanti (al max 1 per giro grazie ai filtri)
         for i in range(to_open):
-            trade_id = f"{SYMBOL}-{int(time.time())}-AUTO{i}"
+            trade_id = trade_ids().next(symbol, "AUTO")
             try:
                 used_price = open_new_trade(ws_trade, ws_log,
                                             trade_id=trade_id,
@@ -793,9 +1902,10 @@ def ensure_min_open_trades(ws_trade, ws_log, client, H, col_ping,
                                             qty=qty,
                                             H=H,
                                             col_ping=col_ping,
-                                            entry_price=lastp)
-                _LAST_TRADE_TS = now_ts
-                _LAST_ENTRY_PRICE = used_price
+                                            entry_price=lastp,
+                                            client=client)
+                _LAST_TRADE_TS[symbol] = now_ts
+                _LAST_ENTRY_PRICE[symbol] = used_price
                 log(ws_log, "INFO",
                     f"Aperto trade automatico {trade_id} (min={min_trades}) - price={fmt_dec(used_price)}")
                 break
@@ -805,77 +1915,164 @@ def ensure_min_open_trades(ws_trade, ws_log, client, H, col_ping,
         log(ws_log, "ERROR", f"ensure_min_open_trades error: {e}")
 
 
-def main_loop():
-    global _H_CACHE, _COL_PING_CACHE, _LAST_RECONCILE_TS, _BINANCE_BANNED_UNTIL
+def bot_startup(ws_trade, ws_log_base, client, lastp: Decimal | None = None):
+    """Log di avvio, header in cache, prima riconciliazione e apertura opzionale."""
+    global _H_CACHE, _COL_PING_CACHE, _LAST_RECONCILE_TS
 
-    ws_trade, ws_log = open_sheets()
-    client = binance_client()
+    spool_attach(ws_trade, ws_log_base)   # scritture rimaste nel journal: prima di rileggere il foglio
+    ws_log = rotate_log_ws(ws_log_base)
 
     # Startup log con versione e parametri principali
     log(ws_log, "INFO",
-        f"{BOT_VERSION} - SYMBOL={SYMBOL} - TZ={TIMEZONE} - "
+        f"{BOT_VERSION} - SYMBOL={cur_symbol()} - TZ={TIMEZONE} - "
         f"TABS=({ws_trade.title},{ws_log.title}) - "
         f"TP1={fmt_dec(TP1_PCT,'0.0000001')} TP2={fmt_dec(TP2_PCT,'0.0000001')} SL={fmt_dec(SL_PCT,'0.0000001')} - "
         f"MIN_OPEN_TRADES={MIN_OPEN_TRADES} POLL={POLL_SECONDS}s - "
         f"COOLDOWN={MIN_TRADE_GAP_SECONDS}s DIST_BP={MIN_ENTRY_DISTANCE_BP} GRID_BP={GRID_STEP_BP} - "
-        f"HIT_TOL_BP={HIT_TOL_BP}")
+        f"HIT_TOL_BP={HIT_TOL_BP} EXEC={EXECUTION_MODE} ARCHIVE_DAYS={ARCHIVE_MIN_AGE_DAYS} LOG_ROTATION={LOG_ROTATION} - "
+        f"IMPORT={_IMPORT_SECONDS:.2f}s")
 
-    header = get_header(ws_trade)
+    # Una sola lettura della tab Trade: header, colonna ping, riconciliazione e chiusure manuali
+    rows = ws_trade.get_all_values()
+    header = header_from_rows(ws_trade, rows)
     _H_CACHE = build_header_map(header)
-    _COL_PING_CACHE = find_col_by_header(ws_trade, "Ultimo ping")
+    _COL_PING_CACHE = col_in_header(header, "Ultimo ping", ws_trade.title)
+
+    dump_headers_once(ws_trade, ws_log, header)
 
-    dump_headers_once(ws_trade, ws_log)
+    if EXECUTION_MODE == "oco":
+        start_oco_execution(ws_trade, ws_log, client, _H_CACHE, rows)
 
-    reconcile_and_notify_starts(ws_trade, ws_log, SYMBOL)
-    process_manual_closes(ws_trade, ws_log, _H_CACHE)
-    _LAST_RECONCILE_TS = time.time()
+    sheet_changed(ws_trade, _H_CACHE)   # checksum di riferimento, letto prima della passata
+    reconcile_pass(ws_trade, ws_log, _H_CACHE, cur_symbol(), rows=rows)
+    _LAST_RECONCILE_TS = _now()
 
     if AUTO_OPEN_ON_START:
         try:
             open_new_trade(ws_trade, ws_log,
-                           trade_id=f"{SYMBOL}-{int(time.time())}-A",
-                           side="LONG", H=_H_CACHE, col_ping=_COL_PING_CACHE)
+                           trade_id=trade_ids().next(cur_symbol(), "A"),
+                           side="LONG", H=_H_CACHE, col_ping=_COL_PING_CACHE, entry_price=lastp, client=client)
         except Exception as e:
             log(ws_log, "ERROR", f"Apertura automatica fallita: {e}")
 
-    while True:
-        try:
-            # Se in ban, pausa gentile e riprova
-            if time.time() < _BINANCE_BANNED_UNTIL:
-                ts = datetime.fromtimestamp(_BINANCE_BANNED_UNTIL).strftime('%Y-%m-%d %H:%M:%S')
-                log(ws_log, "WARN", f"Binance bannato fino a {ts}. Sleep {BANNED_FALLBACK_SLEEP}s")
-                time.sleep(BANNED_FALLBACK_SLEEP)
-                continue
 
-            # Una sola lettura prezzo per ciclo (throttlata e con cache)
-            lastp = get_last_price(client)
-
-            # Riconcilio periodico + chiusure manuali
-            if time.time() - _LAST_RECONCILE_TS >= RECONCILE_MIN_SECONDS:
-                reconcile_and_notify_starts(ws_trade, ws_log, SYMBOL)
-                process_manual_closes(ws_trade, ws_log, _H_CACHE)
-                _LAST_RECONCILE_TS = time.time()
-
-            update_open_rows_light(ws_trade, ws_log, client, _H_CACHE, _COL_PING_CACHE, lastp=lastp)
-
-            ensure_min_open_trades(
-                ws_trade, ws_log, client,
-                H=_H_CACHE,
-                col_ping=_COL_PING_CACHE,
-                min_trades=MIN_OPEN_TRADES,
-                side=AUTO_TRADE_SIDE.upper(),
-                qty=DEFAULT_QTY,
-                last_price=lastp
-            )
+def run_cycle(ws_trade, ws_log_base, client) -> int:
+    """Un giro del loop principale. Ritorna i secondi da attendere prima del giro successivo."""
+    global _LAST_RECONCILE_TS, _LAST_ARCHIVE_TS
 
-            if lastp != 0 and should_log_heartbeat(lastp):
-                log(ws_log, "INFO", f"Heartbeat OK - {fmt_dec(lastp)}")
+    ws_log = ws_log_base
+    t0 = time.perf_counter()
+    try:
+        ws_log = rotate_log_ws(ws_log_base)
 
-        except Exception as e:
-            log(ws_log, "ERROR", str(e))
+        # Se in ban, pausa gentile e riprova
+        if _now() < _BINANCE_BANNED_UNTIL:
+            ts = datetime.fromtimestamp(_BINANCE_BANNED_UNTIL).strftime('%Y-%m-%d %H:%M:%S')
+            log(ws_log, "WARN", f"Binance bannato fino a {ts}. Sleep {BANNED_FALLBACK_SLEEP}s")
+            return BANNED_FALLBACK_SLEEP
+
+        # Una sola lettura prezzo per ciclo (throttlata e con cache)
+        lastp = get_last_price(client)
+
+        # Riconcilio periodico + chiusure manuali (solo se il foglio è cambiato, vedi sheet_changed)
+        if _now() - _LAST_RECONCILE_TS >= RECONCILE_MIN_SECONDS or (_OCO is not None and _OCO.stream_lost):
+            if _OCO is not None:
+                _OCO.catch_up()   # fill persi se lo stream utente è caduto
+            reconcile_if_changed(ws_trade, ws_log, _H_CACHE, cur_symbol())
+            _LAST_RECONCILE_TS = _now()
+
+        # Archiviazione periodica dei chiusi vecchi
+        if ARCHIVE_MIN_AGE_DAYS > 0 and _now() - _LAST_ARCHIVE_TS >= ARCHIVE_EVERY_SECONDS:
+            try:
+                archive_closed_trades(ws_trade, ws_log, _H_CACHE)
+            except Exception as e:
+                log(ws_log, "ERROR", f"Archiviazione fallita: {e}")
+            _LAST_ARCHIVE_TS = _now()
+
+        apply_exchange_fills(ws_trade, ws_log, _H_CACHE)
+        update_open_rows_light(ws_trade, ws_log, client, _H_CACHE, _COL_PING_CACHE, lastp=lastp)
+        note_first_evaluation(ws_log)
+
+        ensure_min_open_trades(
+            ws_trade, ws_log, client,
+            H=_H_CACHE,
+            col_ping=_COL_PING_CACHE,
+            min_trades=MIN_OPEN_TRADES,
+            side=AUTO_TRADE_SIDE.upper(),
+            qty=DEFAULT_QTY,
+            last_price=lastp
+        )
 
-        time.sleep(POLL_SECONDS)
+        record_heartbeat(ws_log, lastp, time.perf_counter() - t0)
+
+    except Exception as e:
+        metrics.inc("bot_cycle_errors_total", help_text="Eccezioni nel giro principale")
+        log(ws_log, "ERROR", str(e))
+
+    metrics.set_gauge("bot_cycle_seconds", time.perf_counter() - t0, help_text="Durata dell'ultimo giro")
+    metrics.inc("bot_cycles_total", help_text="Giri del loop principale")
+    return POLL_SECONDS
+
+
+def note_first_evaluation(ws_log=None):
+    """Una volta per processo: tempo di import e tempo dall'avvio alla prima valutazione del prezzo."""
+    global _FIRST_EVAL_SECONDS
+    if _FIRST_EVAL_SECONDS is not None:
+        return
+    _FIRST_EVAL_SECONDS = time.perf_counter() - _T_PROCESS0
+    metrics.set_gauge("bot_startup_import_seconds", _IMPORT_SECONDS, help_text="Tempo di import del modulo bot_oro")
+    metrics.set_gauge("bot_startup_first_eval_seconds", _FIRST_EVAL_SECONDS,
+                      help_text="Secondi dall'avvio del processo alla prima valutazione del prezzo")
+    msg = f"Avvio: import {_IMPORT_SECONDS:.2f}s, prima valutazione prezzo dopo {_FIRST_EVAL_SECONDS:.2f}s"
+    if ws_log is not None:
+        log(ws_log, "INFO", msg)
+    else:
+        print(f"[STARTUP] {msg}")
+
+
+def register_metrics():
+    """Gauge letti allo scrape dallo stato interno del bot."""
+    metrics.gauge_func("bot_seconds_since_good_price",
+                       lambda: (_now() - _PRICE_CACHE_TS) if _PRICE_CACHE_TS else float("nan"),
+                       "Secondi dall'ultimo prezzo valido letto da Binance")
+    metrics.gauge_func("bot_binance_banned_until", lambda: _BINANCE_BANNED_UNTIL,
+                       "Epoch fino a cui Binance ci ha bannato (0 = mai)")
+    metrics.gauge_func("bot_binance_banned", lambda: 1.0 if _now() < _BINANCE_BANNED_UNTIL else 0.0,
+                       "1 se il ban Binance è attivo")
+    metrics.gauge_func("bot_last_price", lambda: float(_PRICE_CACHE) if _PRICE_CACHE is not None else float("nan"),
+                       "Ultimo prezzo valido")
+    # scritture rimaste nel journal (Sheets non raggiungibile); il runtime pipeline aggiunge la sua coda
+    metrics.gauge_func("bot_pending_sheet_writes", pending_sheet_writes, "Mutazioni foglio in attesa di scrittura")
+    # bot_pending_notifications{queue="bus"}: lo aggiorna NotificationBus a ogni notifica accodata/inviata
 
 
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+def main_loop():
+    if metrics.start_server():
+        register_metrics()
+    ws_trade, ws_log_base = open_sheets()
+    client = binance_client()
+    bot_startup(ws_trade, ws_log_base, client)
+    signal.signal(signal.SIGTERM, _stop)   # come Ctrl-C: si esce dal finally, stream OCO chiuso
+    try:
+        while True:
+            time.sleep(run_cycle(ws_trade, ws_log_base, client))
+    finally:
+        if _OCO is not None:
+            _OCO.stop_stream()
+
+
+# Runtime: serial (default, main_loop) | pipeline (pipeline.py) | async (aio_runtime.py)
+RUNTIME = os.getenv("RUNTIME", "serial").lower()
+
 if __name__ == "__main__":
-    main_loop()
+    if RUNTIME == "pipeline":
+        from pipeline import run_pipeline
+        run_pipeline()
+    elif RUNTIME == "async":
+        from aio_runtime import run_async
+        run_async()
+    else:
+        main_loop()
@@ -6,6 +6,9 @@ from datetime import datetime, timedelta
 from binance.client import Client as BinanceClient
 import json
 import os
+import signal
+
+from scheduler import Scheduler
 
 # === CONFIG da Environment ===
 BINANCE_API_KEY = os.getenv("BINANCE_API_KEY")
@@ -23,6 +26,14 @@ TAKE_PROFIT2 = float(os.getenv("TAKE_PROFIT2", 2))
 DAILY_LOSS_LIMIT = float(os.getenv("DAILY_LOSS_LIMIT", -3))
 TRADE_SIZE = float(os.getenv("TRADE_SIZE", 1))
 
+# Pianificazione (scheduler.py): operazione ogni SIM_TRADE_SECONDS, append a blocchi, riepiloghi a orari fissi
+SIM_TRADE_SECONDS = int(os.getenv("SIM_TRADE_SECONDS", 1800))
+OPS_FLUSH_SECONDS = int(os.getenv("OPS_FLUSH_SECONDS", 3600))
+OPS_FLUSH_ROWS = int(os.getenv("OPS_FLUSH_ROWS", 20))
+SUMMARY_HOURS = [int(h) for h in os.getenv("SUMMARY_HOURS", "8,12,16,20").split(",") if h.strip()]
+# Aggregati dei riepiloghi su disco: dopo un riavvio i report (anche quelli di recupero) hanno ancora i dati
+SIM_STATS_PATH = os.getenv("SIM_STATS_PATH", ".sim_stats.json")   # vuoto = solo in memoria
+
 # === CONNESSIONI ===
 binance_client = BinanceClient(BINANCE_API_KEY, BINANCE_API_SECRET)
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
@@ -60,46 +71,151 @@ def simulate_trade(price_entry):
     pct = TAKE_PROFIT1 if outcome == "WIN" else STOP_LOSS
     return outcome, pct
 
+# === AGGREGATI IN MEMORIA (i report non rileggono i fogli) ===
+class Window:
+    """Operazioni di un periodo (dall'ultimo riepilogo, giorno, settimana), aggiornate a ogni trade."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.wins = 0
+        self.pct = 0.0
+        self.value = 0.0
+
+    def add(self, outcome, pct, value):
+        self.n += 1
+        self.wins += outcome == "WIN"
+        self.pct += pct
+        self.value += value
+
+    def to_dict(self):
+        return {"n": self.n, "wins": self.wins, "pct": self.pct, "value": self.value}
+
+    def load(self, data):
+        self.n = int(data.get("n", 0))
+        self.wins = int(data.get("wins", 0))
+        self.pct = float(data.get("pct", 0.0))
+        self.value = float(data.get("value", 0.0))
+
+    def text(self):
+        if not self.n:
+            return "Nessuna operazione simulata"
+        return (f"{self.n} operazioni ({self.wins} WIN / {self.n - self.wins} LOSS) - "
+                f"P&L {self.pct:+.2f}% ({self.value:+.4f} USDT)")
+
+stats = {"riepilogo": Window(), "giorno": Window(), "settimana": Window()}
+pending_ops = []          # righe operazioni in attesa dell'append a blocchi
+loss_limit_hit = False    # limite perdita giornaliera già scattato oggi
+
+def load_stats():
+    global loss_limit_hit
+    if not SIM_STATS_PATH:
+        return
+    try:
+        with open(SIM_STATS_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for name, w in stats.items():
+            w.load(data.get(name) or {})
+        loss_limit_hit = bool(data.get("loss_limit_hit", False))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[WARN] Aggregati su disco illeggibili ({SIM_STATS_PATH}): {e}")
+
+def save_stats():
+    """Scrittura atomica degli aggregati (dopo ogni operazione e ogni riepilogo)."""
+    if not SIM_STATS_PATH:
+        return
+    try:
+        tmp = SIM_STATS_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**{n: w.to_dict() for n, w in stats.items()}, "loss_limit_hit": loss_limit_hit}, f)
+        os.replace(tmp, SIM_STATS_PATH)
+    except Exception as e:
+        print(f"[WARN] Salvataggio aggregati fallito: {e}")
+
+def flush_operations():
+    """Un solo append_rows per tutte le operazioni in attesa (in caso di errore restano in coda)."""
+    if not pending_ops:
+        return
+    try:
+        sheet_operations.append_rows(pending_ops, value_input_option="USER_ENTERED")
+        print(f"[OK] {len(pending_ops)} operazioni scritte sul foglio.")
+        pending_ops.clear()
+    except Exception as e:
+        print("[ERRORE] Scrittura operazioni:", e)
+
 def log_trade():
+    global TAKE_PROFIT1, TAKE_PROFIT2, loss_limit_hit
     price = get_price()
     outcome, profit_pct = simulate_trade(price)
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     profit_value = TRADE_SIZE * (profit_pct / 100)
-    sheet_operations.append_row([now, "SIMULAZIONE", price, STOP_LOSS, TAKE_PROFIT1, TAKE_PROFIT2, profit_value, outcome, profit_pct, "Operazione simulata"])
+    pending_ops.append([now, "SIMULAZIONE", price, STOP_LOSS, TAKE_PROFIT1, TAKE_PROFIT2, profit_value, outcome, profit_pct, "Operazione simulata"])
+    for w in stats.values():
+        w.add(outcome, profit_pct, profit_value)
     print(f"[OK] Operazione registrata: {outcome} {profit_pct}%")
+    if len(pending_ops) >= OPS_FLUSH_ROWS:
+        flush_operations()
+    if stats["giorno"].pct <= DAILY_LOSS_LIMIT and not loss_limit_hit:
+        loss_limit_hit = True
+        send_whatsapp(f"⚠️ Raggiunto limite perdita {DAILY_LOSS_LIMIT}%. Parametri adattati.")
+        TAKE_PROFIT1 *= 0.8
+        TAKE_PROFIT2 *= 0.8
+    save_stats()
     return profit_pct
 
-def update_summary():
-    now = datetime.now().strftime("%Y-%m-%d %H:%M")
-    sheet_summary.append_row([now, "Aggiornamento", "Report automatico inviato"])
+def _catch_up_note(missed):
+    return f" (recupero: {missed} slot persi)" if missed else ""
 
-def daily_report():
-    now = datetime.now().strftime("%Y-%m-%d")
-    sheet_summary.append_row([now, "Giornaliero", "Riepilogo giornaliero inviato"])
-    send_whatsapp(f"📅 Riepilogo Giornaliero {now}\nOperazioni simulate registrate.")
+def update_summary(slot, missed=0):
+    flush_operations()
+    sheet_summary.append_row([slot.strftime("%Y-%m-%d %H:%M"), "Aggiornamento",
+                              stats["riepilogo"].text() + _catch_up_note(missed)])
+    stats["riepilogo"].reset()
+    save_stats()
 
-def weekly_report():
-    now = datetime.now().strftime("%Y-%m-%d")
-    sheet_summary.append_row([now, "Settimanale", "Riepilogo settimanale inviato"])
-    send_whatsapp(f"📊 Riepilogo Settimanale {now}\nOperazioni simulate registrate.")
+def daily_report(slot, missed=0):
+    global loss_limit_hit
+    flush_operations()
+    day = (slot - timedelta(days=1)).strftime("%Y-%m-%d")   # alle 00:00 si chiude il giorno prima
+    text = stats["giorno"].text()
+    sheet_summary.append_row([day, "Giornaliero", text + _catch_up_note(missed)])
+    send_whatsapp(f"📅 Riepilogo Giornaliero {day}\n{text}")
+    stats["giorno"].reset()
+    loss_limit_hit = False
+    save_stats()
+
+def weekly_report(slot, missed=0):
+    flush_operations()
+    week = (slot - timedelta(days=7)).strftime("%Y-%m-%d")   # lunedì 00:00: si chiude la settimana prima
+    text = stats["settimana"].text()
+    sheet_summary.append_row([week, "Settimanale", text + _catch_up_note(missed)])
+    send_whatsapp(f"📊 Riepilogo Settimanale {week}\n{text}")
+    stats["settimana"].reset()
+    save_stats()
+
+def _stop(signum, frame):
+    raise SystemExit(0)
 
 # === AVVIO ===
-send_whatsapp(f"🚀 Bot ORO Simulatore Avanzato avviato\nSL: {STOP_LOSS}% TP1: {TAKE_PROFIT1}% TP2: {TAKE_PROFIT2}%\nPerdita massima giornaliera: {DAILY_LOSS_LIMIT}%")
+def main():
+    send_whatsapp(f"🚀 Bot ORO Simulatore Avanzato avviato\nSL: {STOP_LOSS}% TP1: {TAKE_PROFIT1}% TP2: {TAKE_PROFIT2}%\nPerdita massima giornaliera: {DAILY_LOSS_LIMIT}%")
+    signal.signal(signal.SIGTERM, _stop)   # Procfile: al riavvio del dyno scrive le operazioni in coda
 
-profit_today = 0
-while True:
-    profit_pct = log_trade()
-    profit_today += profit_pct
-    if profit_today <= DAILY_LOSS_LIMIT:
-        send_whatsapp(f"⚠️ Raggiunto limite perdita {DAILY_LOSS_LIMIT}%. Parametri adattati.")
-        TAKE_PROFIT1 *= 0.8
-        TAKE_PROFIT2 *= 0.8
-    hour = datetime.now().hour
-    minute = datetime.now().minute
-    if hour in [8,12,16,20] and minute == 0:
-        update_summary()
-    if hour == 0 and minute == 0:
-        daily_report()
-    if datetime.now().weekday() == 6 and hour == 0 and minute == 0:
-        weekly_report()
-    time.sleep(1800)  # ogni 30 minuti
+    load_stats()
+    sched = Scheduler()
+    sched.every("operazione", SIM_TRADE_SECONDS, log_trade, run_now=True)
+    sched.every("scrittura", OPS_FLUSH_SECONDS, flush_operations)
+    sched.cron("riepilogo", update_summary, hours=SUMMARY_HOURS)
+    sched.cron("giornaliero", daily_report, hours=[0])
+    sched.cron("settimanale", weekly_report, hours=[0], weekday=0)   # lunedì 00:00
+    try:
+        sched.run_forever()   # dorme fino al prossimo job, niente polling
+    finally:
+        flush_operations()
+
+if __name__ == "__main__":
+    main()
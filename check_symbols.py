@@ -1,19 +1,20 @@
 from binance.client import Client
 import os
 
+from exchange_filters import registry
+
 # Legge le chiavi dalle variabili di ambiente
 api_key = os.getenv("BINANCE_API_KEY")
 api_secret = os.getenv("BINANCE_API_SECRET")
 
-client = Client(api_key, api_secret)
-
-# Recupera tutti i simboli
-exchange_info = client.get_exchange_info()
-symbols = [s['symbol'] for s in exchange_info['symbols']]
+# Il registro filtri (exchange_filters) scarica exchangeInfo solo se la copia su disco è scaduta
+reg = registry()
+client = Client(api_key, api_secret) if reg.stale() else None
 
-# Filtra i simboli che possono indicare l'oro
-gold_symbols = [s for s in symbols if "GOLD" in s or "XAU" in s or "PAXG" in s]
+# Filtra i simboli che possono indicare l'oro (lookup sul registro, indicizzato per asset)
+gold_symbols = reg.search("GOLD", "XAU", "PAXG", client=client)
 
 print("Simboli trovati legati all'oro:")
 for sym in gold_symbols:
-    print(sym)
+    e = reg.symbols[sym]
+    print(f"{sym}  [{e['status']}]  step={e['step']} tick={e['tick']} minNotional={e['min_notional']}")
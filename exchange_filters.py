@@ -0,0 +1,203 @@
+# exchange_filters.py
+"""
+Registro locale dei filtri exchange Binance (LOT_SIZE, PRICE_FILTER, MIN_NOTIONAL/NOTIONAL) e dei
+metadati simbolo (stato, base/quote asset), condiviso da bot_oro, backtest_bot_oro e check_symbols.
+- Un solo get_exchange_info (pubblico, qualche MB) per TTL: il risultato compatto va su disco e le
+  letture successive sono lookup in memoria (per simbolo e per asset), anche tra processi diversi
+- Scaduto il TTL si riscarica; se il download fallisce si continua con la copia vecchia (avviso)
+  e non si riprova prima di EXCHANGE_FILTERS_RETRY secondi
+Variabili opzionali:
+  EXCHANGE_FILTERS_PATH   (default .exchange_filters.json)
+  EXCHANGE_FILTERS_TTL    (default 86400)  secondi di validità della copia su disco
+  EXCHANGE_FILTERS_RETRY  (default 300)    pausa tra tentativi di refresh falliti
+"""
+import os
+import json
+import time
+import bisect
+import threading
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+from typing import Dict, List, Optional
+
+EXCHANGE_FILTERS_PATH  = os.getenv("EXCHANGE_FILTERS_PATH", ".exchange_filters.json")
+EXCHANGE_FILTERS_TTL   = int(os.getenv("EXCHANGE_FILTERS_TTL", "86400"))
+EXCHANGE_FILTERS_RETRY = int(os.getenv("EXCHANGE_FILTERS_RETRY", "300"))
+
+
+# ------------------ Filtri di un simbolo ------------------
+class SymbolFilters:
+    """LOT_SIZE / PRICE_FILTER / (MIN_)NOTIONAL di un simbolo, con arrotondamenti e controlli."""
+
+    def __init__(self, step: Decimal, min_qty: Decimal, tick: Decimal, min_notional: Decimal):
+        self.step, self.min_qty, self.tick, self.min_notional = step, min_qty, tick, min_notional
+
+    @staticmethod
+    def compact(info: dict) -> dict:
+        """Voce di exchangeInfo/get_symbol_info -> dict compatto (stringhe) per il registro."""
+        f = {x["filterType"]: x for x in info.get("filters", [])}
+        lot = f.get("LOT_SIZE", {})
+        price = f.get("PRICE_FILTER", {})
+        notional = f.get("NOTIONAL") or f.get("MIN_NOTIONAL") or {}
+        return {
+            "status": info.get("status", ""),
+            "base": info.get("baseAsset", ""),
+            "quote": info.get("quoteAsset", ""),
+            "step": lot.get("stepSize", "0"),
+            "min_qty": lot.get("minQty", "0"),
+            "tick": price.get("tickSize", "0"),
+            "min_notional": notional.get("minNotional", "0"),
+        }
+
+    @classmethod
+    def from_entry(cls, e: dict) -> "SymbolFilters":
+        return cls(Decimal(e["step"]), Decimal(e["min_qty"]), Decimal(e["tick"]), Decimal(e["min_notional"]))
+
+    @classmethod
+    def from_symbol_info(cls, info: dict) -> "SymbolFilters":
+        if not info:
+            raise RuntimeError("get_symbol_info vuoto: simbolo inesistente?")
+        return cls.from_entry(cls.compact(info))
+
+    @staticmethod
+    def _to_step(x: Decimal, step: Decimal, rounding) -> Decimal:
+        if step <= 0:
+            return x
+        return (x / step).quantize(Decimal("1"), rounding=rounding) * step
+
+    def qty(self, q: Decimal) -> Decimal:
+        return self._to_step(q, self.step, ROUND_DOWN)
+
+    def price(self, p: Decimal, up: bool = False) -> Decimal:
+        return self._to_step(p, self.tick, ROUND_UP if up else ROUND_DOWN)
+
+    def check(self, qty: Decimal, price: Decimal):
+        if qty <= 0 or qty < self.min_qty:
+            raise RuntimeError(f"Quantità {qty} sotto minQty {self.min_qty}")
+        if qty * price < self.min_notional:
+            raise RuntimeError(f"Nozionale {qty * price} sotto minNotional {self.min_notional}")
+
+    def __repr__(self):
+        return (f"SymbolFilters(step={self.step}, min_qty={self.min_qty}, tick={self.tick}, "
+                f"min_notional={self.min_notional})")
+
+
+# ------------------ Registro ------------------
+def _public_client():
+    from binance.client import Client
+    return Client(api_key="", api_secret="")   # exchangeInfo è un endpoint pubblico
+
+
+class FilterRegistry:
+    def __init__(self, path: str = EXCHANGE_FILTERS_PATH, ttl: int = EXCHANGE_FILTERS_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.fetched_at = 0.0
+        self.symbols: Dict[str, dict] = {}
+        self.by_asset: Dict[str, List[str]] = {}
+        self.sorted_symbols: List[str] = []   # per la ricerca per prefisso (bisect)
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _index(self):
+        by_asset: Dict[str, List[str]] = {}
+        for sym, e in self.symbols.items():
+            for a in {e.get("base", ""), e.get("quote", "")}:
+                if a:
+                    by_asset.setdefault(a, []).append(sym)
+        self.by_asset = by_asset
+        self.sorted_symbols = sorted(self.symbols)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.fetched_at = float(data.get("fetched_at", 0))
+            self.symbols = data.get("symbols", {})
+            self._index()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[FILTERS] copia su disco illeggibile ({self.path}): {e}")
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.fetched_at, "symbols": self.symbols}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def stale(self) -> bool:
+        return time.time() - self.fetched_at >= self.ttl
+
+    def refresh(self, client=None):
+        """Scarica exchangeInfo una volta, lo compatta e lo salva."""
+        with self._lock:
+            self._last_attempt = time.time()
+            info = (client or _public_client()).get_exchange_info()
+            self.symbols = {s["symbol"]: SymbolFilters.compact(s) for s in info.get("symbols", [])}
+            self.fetched_at = time.time()
+            self._index()
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[FILTERS] salvataggio fallito ({self.path}): {e}")
+
+    def ensure(self, client=None):
+        """
+        Refresh se la copia è scaduta. client senza get_exchange_info (stand-in di replay/test):
+        nessun download, si usa quanto c'è su disco.
+        """
+        if not self.stale() or time.time() - self._last_attempt < EXCHANGE_FILTERS_RETRY:
+            return self
+        if client is not None and not hasattr(client, "get_exchange_info"):
+            return self
+        try:
+            self.refresh(client)
+        except Exception as e:
+            msg = "uso la copia scaduta" if self.symbols else "nessun filtro disponibile"
+            print(f"[FILTERS] refresh exchangeInfo fallito ({msg}): {e}")
+        return self
+
+    def entry(self, symbol: str, client=None) -> Optional[dict]:
+        return self.ensure(client).symbols.get(symbol.upper())
+
+    def get(self, symbol: str, client=None) -> Optional[SymbolFilters]:
+        e = self.entry(symbol, client)
+        return SymbolFilters.from_entry(e) if e else None
+
+    def with_prefix(self, prefix: str) -> List[str]:
+        """Simboli che iniziano con prefix (bisect sull'elenco ordinato, niente scansione)."""
+        names = self.sorted_symbols
+        i = bisect.bisect_left(names, prefix)
+        j = bisect.bisect_left(names, prefix + "\uffff")
+        return names[i:j]
+
+    def search(self, *needles: str, client=None, trading_only: bool = False, substring: bool = False) -> List[str]:
+        """
+        Simboli con uno dei frammenti come asset base/quote o come prefisso, dagli indici in memoria.
+        substring=True: in più una scansione di tutti i simboli per i frammenti in mezzo al nome (lenta).
+        """
+        self.ensure(client)
+        needles = [n.upper() for n in needles]
+        out = set()
+        for n in needles:
+            out.update(self.by_asset.get(n, []))
+            out.update(self.with_prefix(n))
+        if substring:
+            out.update(s for s in self.symbols if any(n in s for n in needles))
+        if trading_only:
+            out = {s for s in out if self.symbols[s].get("status") == "TRADING"}
+        return sorted(out)
+
+
+_REGISTRY = None
+
+def registry() -> FilterRegistry:
+    """Registro di processo (caricato da disco al primo uso)."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = FilterRegistry()
+    return _REGISTRY
+
+def get_filters(symbol: str, client=None) -> Optional[SymbolFilters]:
+    return registry().get(symbol, client)
@@ -0,0 +1,336 @@
+# kline_store.py
+"""
+Archivio locale delle candele 1m, scaricato e letto a pezzi, e ricampionamento a timeframe superiori
+- Le 1m di un simbolo stanno in un file .npz per mese UTC (ts, open, high, low, close, volume)
+  sotto KLINE_STORE_DIR/<SIMBOLO>/1m/; ranges.json tiene gli intervalli già scaricati
+- Download in streaming: pagine da 1000 candele (get_klines) scritte in un buffer mensile
+  preallocato, salvato a fine mese; ranges.json si aggiorna a ogni mese salvato, quindi un download
+  interrotto riparte da dove era arrivato. Si scarica solo quello che manca rispetto alla finestra.
+- Timeframe superiori (5m, 15m, 1h, 4h, 1d...) per riduzione a gruppi in numpy (reduceat):
+  primo open, max high, min low, ultimo close, somma volume; il gruppo iniziale incompleto si scarta.
+  Si ricampionano solo intervalli che dividono il giorno, così nessun gruppo scavalca due mesi e ogni
+  mese si ricampiona (e si memoizza su disco) da solo; gli altri (3d, 1w, 1M) iter_days li scarica
+  direttamente da Binance (iter_remote), senza archivio
+- iter_chunks() restituisce un mese alla volta: la memoria resta costante anche su anni di 1m;
+  load() concatena per chi vuole tutta la serie in memoria
+Variabili opzionali:
+  KLINE_STORE_DIR   (default .klines)
+  KLINE_CHUNK_BARS  (default 50000)  candele per blocco in iter_remote (lettura senza archivio)
+"""
+import os
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+KLINE_STORE_DIR = os.getenv("KLINE_STORE_DIR", ".klines")
+
+FIELDS = ("ts", "open", "high", "low", "close", "volume")
+MINUTE_MS = 60_000
+DAY_MS = 86_400_000
+PAGE_LIMIT = 1000
+CHUNK_BARS = int(os.getenv("KLINE_CHUNK_BARS", "50000"))
+_UNIT_MS = {"m": MINUTE_MS, "h": 60 * MINUTE_MS, "d": DAY_MS}
+
+Klines = Dict[str, np.ndarray]
+
+
+def cacheable(interval: str) -> bool:
+    """True se l'intervallo si ricava dall'archivio 1m (divide il giorno); 3d, 1w, 1M no."""
+    unit = _UNIT_MS.get(interval[-1])
+    return unit is not None and DAY_MS % (int(interval[:-1]) * unit) == 0
+
+
+def interval_ms(interval: str) -> int:
+    if not cacheable(interval):
+        raise ValueError(f"Intervallo {interval}: sono supportati solo intervalli che dividono il giorno")
+    return int(interval[:-1]) * _UNIT_MS[interval[-1]]
+
+
+def empty() -> Klines:
+    return {k: np.empty(0, dtype=np.int64 if k == "ts" else float) for k in FIELDS}
+
+
+def from_rows(rows) -> Klines:
+    """Righe get_klines ([open_time, open, high, low, close, volume, ...]) -> array."""
+    if not rows:
+        return empty()
+    a = np.array([r[:6] for r in rows], dtype=float)
+    out = {"ts": a[:, 0].astype(np.int64)}
+    for j, k in enumerate(FIELDS[1:], start=1):
+        out[k] = a[:, j]
+    return out
+
+
+def concat(*parts: Klines) -> Klines:
+    """Unione ordinata per ts, senza doppioni (a parità di ts vince la parte successiva)."""
+    parts = [p for p in parts if len(p["ts"])]
+    if not parts:
+        return empty()
+    merged = {k: np.concatenate([p[k] for p in parts]) for k in FIELDS}
+    # ultima occorrenza di ogni ts: unique sull'array rovesciato
+    _, first_rev = np.unique(merged["ts"][::-1], return_index=True)
+    keep = len(merged["ts"]) - 1 - first_rev
+    return {k: v[keep] for k, v in merged.items()}
+
+
+def window(k: Klines, start_ms: int, end_ms: Optional[int] = None) -> Klines:
+    lo = np.searchsorted(k["ts"], start_ms, side="left")
+    hi = len(k["ts"]) if end_ms is None else np.searchsorted(k["ts"], end_ms, side="right")
+    return {f: v[lo:hi] for f, v in k.items()}
+
+
+def resample(k: Klines, interval: str) -> Klines:
+    """1m -> interval (allineato all'epoch UTC come Binance); scarta il primo gruppo se incompleto."""
+    step = interval_ms(interval)
+    if step == MINUTE_MS or not len(k["ts"]):
+        return k
+    bucket = k["ts"] // step * step
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)] - 1
+    out = {
+        "ts": bucket[starts],
+        "open": k["open"][starts],
+        "high": np.maximum.reduceat(k["high"], starts),
+        "low": np.minimum.reduceat(k["low"], starts),
+        "close": k["close"][ends],
+        "volume": np.add.reduceat(k["volume"], starts),
+    }
+    if k["ts"][0] != bucket[0]:
+        out = {f: v[1:] for f, v in out.items()}
+    return out
+
+
+def to_dicts(k: Klines):
+    """Formato storico di load_klines: lista di dict per candela."""
+    return [{"ts": int(t), "open": float(o), "high": float(h), "low": float(l), "close": float(c),
+             "volume": float(v)}
+            for t, o, h, l, c, v in zip(*(k[f] for f in FIELDS))]
+
+
+# ------------------ Download a pagine ------------------
+def fetch_pages(client, symbol: str, interval: str, start_ms: int, end_ms: Optional[int] = None) -> Iterator[Klines]:
+    """Pagine di candele da Binance in [start_ms, end_ms], in ordine, PAGE_LIMIT alla volta."""
+    cur = start_ms
+    while end_ms is None or cur <= end_ms:
+        kw = {"endTime": end_ms} if end_ms is not None else {}
+        rows = client.get_klines(symbol=symbol, interval=interval, startTime=cur, limit=PAGE_LIMIT, **kw)
+        if not rows:
+            return
+        page = from_rows(rows)
+        yield page
+        if len(rows) < PAGE_LIMIT:
+            return
+        cur = int(page["ts"][-1]) + 1
+
+
+def iter_remote(symbol: str, interval: str, start_ms: int, end_ms: Optional[int] = None,
+                chunk_bars: int = CHUNK_BARS, client=None) -> Iterator[Klines]:
+    """
+    Candele direttamente da Binance (senza archivio) a blocchi di chunk_bars, copiate pagina per
+    pagina in array preallocati: in memoria c'è al più un blocco.
+    """
+    if client is None:
+        from binance.client import Client
+        client = Client(api_key="", api_secret="")   # endpoint pubblici
+    buf = {f: np.empty(chunk_bars, dtype=np.int64 if f == "ts" else float) for f in FIELDS}
+    n = 0
+    for page in fetch_pages(client, symbol, interval, start_ms, end_ms):
+        pos = 0
+        while pos < len(page["ts"]):
+            take = min(chunk_bars - n, len(page["ts"]) - pos)
+            for f in FIELDS:
+                buf[f][n:n + take] = page[f][pos:pos + take]
+            n += take
+            pos += take
+            if n == chunk_bars:
+                yield {f: v.copy() for f, v in buf.items()}
+                n = 0
+    if n:
+        yield {f: v[:n].copy() for f, v in buf.items()}
+
+
+# ------------------ Mesi UTC ------------------
+def month_start(ts_ms: int) -> int:
+    d = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+    return int(datetime(d.year, d.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+def next_month(ms: int) -> int:
+    d = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    y, m = (d.year + 1, 1) if d.month == 12 else (d.year, d.month + 1)
+    return int(datetime(y, m, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+def month_key(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+
+# ------------------ Intervalli scaricati ------------------
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out: List[Tuple[int, int]] = []
+    for a, b in sorted(ranges):
+        if out and a <= out[-1][1] + MINUTE_MS:
+            out[-1] = (out[-1][0], max(out[-1][1], b))
+        else:
+            out.append((a, b))
+    return out
+
+def missing_ranges(covered: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    out, cur = [], start
+    for a, b in covered:
+        if b < cur:
+            continue
+        if a > end:
+            break
+        if a > cur:
+            out.append((cur, a - MINUTE_MS))
+        cur = max(cur, b + MINUTE_MS)
+    if cur <= end:
+        out.append((cur, end))
+    return out
+
+
+class KlineStore:
+    def __init__(self, root: str = KLINE_STORE_DIR, client=None):
+        self.root = root
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from binance.client import Client
+            self._client = Client(api_key="", api_secret="")   # endpoint pubblici
+        return self._client
+
+    # --- file ---
+    def _dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, symbol.upper(), interval)
+
+    def _part_path(self, symbol: str, interval: str, month_ms: int) -> str:
+        return os.path.join(self._dir(symbol, interval), f"{month_key(month_ms)}.npz")
+
+    def _read(self, path: str):
+        try:
+            with np.load(path) as z:
+                return {f: z[f] for f in FIELDS}, (z["src"] if "src" in z.files else None)
+        except FileNotFoundError:
+            return None, None
+
+    def _write(self, path: str, k: Klines, src=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        extra = {"src": src} if src is not None else {}
+        np.savez(tmp, **k, **extra)
+        os.replace(tmp, path)
+
+    def _ranges_path(self, symbol: str) -> str:
+        return os.path.join(self._dir(symbol, "1m"), "ranges.json")
+
+    def covered(self, symbol: str) -> List[Tuple[int, int]]:
+        try:
+            with open(self._ranges_path(symbol), "r", encoding="utf-8") as f:
+                return [tuple(r) for r in json.load(f)]
+        except FileNotFoundError:
+            return []
+
+    def _mark_covered(self, symbol: str, a: int, b: int):
+        ranges = merge_ranges(self.covered(symbol) + [(a, b)])
+        path = self._ranges_path(symbol)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(ranges, f)
+        os.replace(path + ".tmp", path)
+
+    # --- download a pagine ---
+    def iter_pages(self, symbol: str, start_ms: int, end_ms: int) -> Iterator[Klines]:
+        return fetch_pages(self.client, symbol, "1m", start_ms, end_ms)
+
+    def _flush_month(self, symbol: str, month_ms: int, buf: Klines, n: int):
+        path = self._part_path(symbol, "1m", month_ms)
+        old, _ = self._read(path)
+        part = {f: v[:n].copy() for f, v in buf.items()}
+        self._write(path, concat(old, part) if old is not None else part)
+
+    def sync(self, symbol: str, start_ms: int, end_ms: Optional[int] = None):
+        """
+        Scarica le 1m mancanti in [start_ms, end_ms] (None = fino all'ultima candela chiusa).
+        Un mese alla volta in memoria; ogni mese salvato è subito segnato in ranges.json (ripresa).
+        """
+        last_closed = (int(time.time() * 1000) // MINUTE_MS - 1) * MINUTE_MS
+        end_ms = last_closed if end_ms is None else min(end_ms, last_closed)
+        for a, b in missing_ranges(self.covered(symbol), start_ms, end_ms):
+            month = month_start(a)
+            cap = (next_month(month) - month) // MINUTE_MS
+            buf = {f: np.empty(cap, dtype=np.int64 if f == "ts" else float) for f in FIELDS}
+            n, seg_start = 0, a
+            try:
+                for page in self.iter_pages(symbol, a, b):
+                    while len(page["ts"]):
+                        nm = next_month(month)
+                        take = int(np.searchsorted(page["ts"], nm))
+                        for f in FIELDS:
+                            buf[f][n:n + take] = page[f][:take]
+                        n += take
+                        if take == len(page["ts"]):
+                            break
+                        # la pagina entra nel mese successivo: salva il mese e riparti
+                        self._flush_month(symbol, month, buf, n)
+                        self._mark_covered(symbol, seg_start, nm - MINUTE_MS)
+                        page = {f: v[take:] for f, v in page.items()}
+                        month, seg_start, n = nm, nm, 0
+                        cap = (next_month(month) - month) // MINUTE_MS
+                        buf = {f: np.empty(cap, dtype=np.int64 if f == "ts" else float) for f in FIELDS}
+            except BaseException:
+                # interruzione (rete, Ctrl-C): salva le pagine già arrivate, il prossimo sync riparte da lì
+                if n:
+                    self._flush_month(symbol, month, buf, n)
+                    self._mark_covered(symbol, seg_start, int(buf["ts"][n - 1]))
+                raise
+            if n:
+                self._flush_month(symbol, month, buf, n)
+            self._mark_covered(symbol, seg_start, b)
+
+    # --- lettura ---
+    def _month_part(self, symbol: str, interval: str, month_ms: int) -> Klines:
+        raw, _ = self._read(self._part_path(symbol, "1m", month_ms))
+        if raw is None or interval == "1m":
+            return raw if raw is not None else empty()
+        path = self._part_path(symbol, interval, month_ms)
+        # firma del mese 1m: finché non cambia, il ricampionato su disco vale
+        src = np.array([raw["ts"][0], raw["ts"][-1], len(raw["ts"]), raw["close"][-1]], dtype=float)
+        out, cached_src = self._read(path)
+        if out is None or cached_src is None or not np.array_equal(cached_src, src):
+            out = resample(raw, interval)
+            self._write(path, out, src)
+        return out
+
+    def iter_chunks(self, symbol: str, interval: str, start_ms: int, end_ms: Optional[int] = None,
+                    sync: bool = True) -> Iterator[Klines]:
+        """Candele interval nella finestra, un mese UTC alla volta (sincronizza prima l'archivio)."""
+        step = interval_ms(interval)
+        start_ms = -(-start_ms // step) * step   # primo gruppo completo
+        if sync:
+            self.sync(symbol, start_ms, end_ms)
+        stop = end_ms if end_ms is not None else int(time.time() * 1000)
+        month = month_start(start_ms)
+        while month <= stop:
+            part = window(self._month_part(symbol, interval, month), start_ms, end_ms)
+            if len(part["ts"]):
+                yield part
+            month = next_month(month)
+
+    def load(self, symbol: str, interval: str, start_ms: int, end_ms: Optional[int] = None) -> Klines:
+        """Tutta la finestra in memoria (per serie corte; per gli storici lunghi usare iter_chunks)."""
+        parts = list(self.iter_chunks(symbol, interval, start_ms, end_ms))
+        return {f: np.concatenate([p[f] for p in parts]) for f in FIELDS} if parts else empty()
+
+
+def days_start(days: int) -> int:
+    return int(time.time() * 1000) - days * DAY_MS
+
+def iter_days(symbol: str, interval: str, days: int, store: Optional[KlineStore] = None) -> Iterator[Klines]:
+    """Ultimi `days` giorni dall'archivio; intervalli che non dividono il giorno direttamente da Binance."""
+    if not cacheable(interval):
+        return iter_remote(symbol, interval, days_start(days))
+    return (store or KlineStore()).iter_chunks(symbol, interval, days_start(days))
@@ -0,0 +1,126 @@
+# metrics.py
+"""
+Metriche del processo in formato testo Prometheus, servite da un piccolo HTTP server locale.
+- Nessuna dipendenza esterna (http.server in un thread daemon)
+- Attivo solo se METRICS_PORT > 0; METRICS_HOST default 127.0.0.1
+- GET /metrics  -> tutte le metriche;  GET /healthz -> "ok"
+Le funzioni set_gauge/inc costano un lock e un dict: si possono chiamare nel loop anche a server spento.
+"""
+import os
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+_LOCK = threading.Lock()
+_HELP: Dict[str, Tuple[str, str]] = {}                 # nome -> (tipo, help)
+_VALUES: Dict[Tuple[str, tuple], float] = {}           # (nome, labels) -> valore
+_FUNCS: Dict[str, Callable[[], float]] = {}            # gauge calcolati alla lettura
+_SERVER = None
+
+
+def _labels_key(labels: Optional[dict]) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+def describe(name: str, kind: str, help_text: str = ""):
+    with _LOCK:
+        _HELP.setdefault(name, (kind, help_text))
+
+def set_gauge(name: str, value: float, labels: Optional[dict] = None, help_text: str = ""):
+    with _LOCK:
+        _HELP.setdefault(name, ("gauge", help_text))
+        _VALUES[(name, _labels_key(labels))] = float(value)
+
+def inc(name: str, amount: float = 1.0, labels: Optional[dict] = None, help_text: str = ""):
+    key = (name, _labels_key(labels))
+    with _LOCK:
+        _HELP.setdefault(name, ("counter", help_text))
+        _VALUES[key] = _VALUES.get(key, 0.0) + amount
+
+def gauge_func(name: str, fn: Callable[[], float], help_text: str = ""):
+    """Gauge letto al momento dello scrape (es. secondi dall'ultimo prezzo valido)."""
+    with _LOCK:
+        _HELP[name] = ("gauge", help_text)
+        _FUNCS[name] = fn
+
+
+def _fmt(v: float) -> str:
+    if math.isnan(v):
+        return "NaN"
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v))
+
+def render() -> str:
+    with _LOCK:
+        values = dict(_VALUES)
+        funcs = dict(_FUNCS)
+        helps = dict(_HELP)
+    for name, fn in funcs.items():
+        try:
+            values[(name, ())] = float(fn())
+        except Exception:
+            values[(name, ())] = float("nan")
+
+    lines = []
+    for name in sorted({k[0] for k in values}):
+        kind, help_text = helps.get(name, ("untyped", ""))
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (n, labels), v in sorted(values.items()):
+            if n != name:
+                continue
+            lbl = ",".join(f'{k}="{v_}"' for k, v_ in labels)
+            lines.append(f"{name}{{{lbl}}} {_fmt(v)}" if lbl else f"{name} {_fmt(v)}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body = render().encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/healthz":
+            body, ctype = b"ok\n", "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # niente rumore su stdout ad ogni scrape
+
+
+def start_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Avvia il server in un thread daemon (idempotente). Ritorna None se port <= 0."""
+    global _SERVER
+    if port <= 0:
+        return None
+    if _SERVER is None:
+        _SERVER = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=_SERVER.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[METRICS] http://{host}:{port}/metrics")
+    return _SERVER
+
+
+def instrument_requests_session(session, name: str, help_text: str = ""):
+    """Conta ogni risposta HTTP della sessione requests (label status)."""
+    hooks = getattr(session, "hooks", None)
+    if hooks is None:
+        return False
+    describe(name, "counter", help_text)
+
+    def _on_response(resp, *args, **kwargs):
+        inc(name, labels={"status": str(getattr(resp, "status_code", "err"))})
+        return resp
+
+    hooks.setdefault("response", []).append(_on_response)
+    return True
@@ -0,0 +1,257 @@
+# notification_bus.py
+"""
+Bus unico delle notifiche: bot_oro.notify, runtime pipeline/async e gli helper Telegram/WhatsApp.
+- Backend pluggabili: telegram (notifier_telegram.TelegramNotifier), twilio (WhatsApp via Twilio),
+  meta (wa_meta.MetaWhatsApp), console (stdout). Un backend non configurato si disattiva da solo.
+- Finestra di coalescenza: i messaggi arrivati entro NOTIFY_DIGEST_SECONDS dal primo partono come UN
+  digest per canale (spezzato ai confini dei messaggi se supera il limite di lunghezza del canale)
+- priority=True salta la finestra: il messaggio parte subito e da solo
+- publish() non blocca: l'invio gira in un thread daemon; close() (anche via atexit) svuota il buffer
+Variabili opzionali:
+  NOTIFY_BACKENDS        (default "telegram,twilio")  canali attivi, in ordine; "meta" = WhatsApp Cloud API,
+                         "console" = stdout
+  NOTIFY_DIGEST_SECONDS  (default 5)   0 = nessuna coalescenza
+  NOTIFY_DIGEST_MAX      (default 20)  messaggi in finestra oltre i quali il digest parte subito
+"""
+import os
+import time
+import atexit
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import metrics
+
+NOTIFY_BACKENDS       = [b.strip().lower() for b in os.getenv("NOTIFY_BACKENDS", "telegram,twilio").split(",")
+                         if b.strip()]
+NOTIFY_DIGEST_SECONDS = float(os.getenv("NOTIFY_DIGEST_SECONDS", "5"))
+NOTIFY_DIGEST_MAX     = int(os.getenv("NOTIFY_DIGEST_MAX", "20"))
+
+
+# ------------------ Backend ------------------
+class Backend:
+    name = "base"
+    max_chars = 4096
+
+    def enabled(self) -> bool:
+        return True
+
+    def send(self, text: str):
+        raise NotImplementedError
+
+    def close(self, timeout: float):
+        """Arresto: attende gli invii ancora in corso nel backend (se asincrono)."""
+
+
+class TelegramBackend(Backend):
+    name = "telegram"
+    max_chars = 4096
+
+    def __init__(self, notifier=None):
+        if notifier is None:
+            from notifier_telegram import TelegramNotifier
+            notifier = TelegramNotifier()
+        self.notifier = notifier
+
+    def enabled(self) -> bool:
+        return self.notifier._can_send()
+
+    def send(self, text: str):
+        # testo semplice: i messaggi del bot contengono "&" e "<" che l'HTML di Telegram rifiuta
+        # (send accoda e ritorna subito: rate limit e 429 li gestisce il worker del notifier)
+        self.notifier.send(text, parse_mode=None)
+
+    def close(self, timeout: float):
+        self.notifier.flush(timeout)
+
+
+class TwilioBackend(Backend):
+    name = "twilio"
+    max_chars = 1600   # limite corpo messaggio WhatsApp su Twilio
+
+    def __init__(self):
+        self.sid = os.getenv("TWILIO_ACCOUNT_SID", "")
+        self.token = os.getenv("TWILIO_AUTH_TOKEN", "")
+        self.from_ = os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886")
+        self.to = os.getenv("TWILIO_TO", "")
+        self._client = None
+
+    def enabled(self) -> bool:
+        return bool(self.sid and self.token and self.to)
+
+    def send(self, text: str):
+        if self._client is None:
+            from twilio.rest import Client as TwilioClient
+            self._client = TwilioClient(self.sid, self.token)
+        self._client.messages.create(from_=self.from_, to=self.to, body=text)
+
+
+class MetaBackend(Backend):
+    name = "meta"
+    max_chars = 4096
+
+    def __init__(self):
+        self._wa = None
+        try:
+            from wa_meta import MetaWhatsApp
+            self._wa = MetaWhatsApp()
+        except ValueError:
+            pass   # WA_TOKEN / WA_PHONE_ID mancanti: canale spento
+
+    def enabled(self) -> bool:
+        return self._wa is not None and bool(self._wa.default_to)
+
+    def send(self, text: str):
+        self._wa.send_text(text)
+
+
+class ConsoleBackend(Backend):
+    name = "console"
+    max_chars = 100000
+
+    def send(self, text: str):
+        print(f"[NOTIFY] {text}")
+
+
+BACKENDS = {
+    "telegram": TelegramBackend,
+    "twilio": TwilioBackend,
+    "meta": MetaBackend,
+    "console": ConsoleBackend,
+}
+
+
+# ------------------ Digest ------------------
+def digest_parts(texts: List[str], max_chars: int) -> List[str]:
+    """Un messaggio resta com'è; più messaggi diventano un digest, spezzato ai confini dei messaggi."""
+    if len(texts) == 1:
+        return [texts[0][:max_chars]]
+    header = f"BOT ORO | {len(texts)} notifiche"
+    parts, cur = [], []
+    for t in texts:
+        t = t[:max_chars - len(header) - 16]
+        if cur and len("\n\n".join(cur + [t])) + len(header) + 16 > max_chars:
+            parts.append(cur)
+            cur = []
+        cur.append(t)
+    parts.append(cur)
+    if len(parts) == 1:
+        return [f"{header}\n\n" + "\n\n".join(parts[0])]
+    return [f"{header} ({i}/{len(parts)})\n\n" + "\n\n".join(p) for i, p in enumerate(parts, start=1)]
+
+
+# ------------------ Bus ------------------
+class NotificationBus:
+    def __init__(self, backends: Iterable[Backend],
+                 window_seconds: float = NOTIFY_DIGEST_SECONDS, max_batch: int = NOTIFY_DIGEST_MAX):
+        self.backends = [b for b in backends if b.enabled()]
+        self.window_seconds = window_seconds
+        self.max_batch = max(1, max_batch)
+        self._cv = threading.Condition()
+        self._pending: List[Tuple[str, Optional[tuple]]] = []   # (testo, canali) in finestra
+        self._urgent: List[Tuple[str, Optional[tuple]]] = []
+        self._window_end = 0.0
+        self._closed = False
+        self._thread = None
+
+    def channels(self) -> List[str]:
+        """Nomi dei canali attivi (configurati e presenti in NOTIFY_BACKENDS)."""
+        return [b.name for b in self.backends]
+
+    def publish(self, text: str, priority: bool = False, backends: Optional[Iterable[str]] = None):
+        """Accoda il messaggio. backends limita i canali (es. ["telegram"]); None = tutti."""
+        only = tuple(backends) if backends is not None else None
+        if only is not None and not any(b.name in only for b in self.backends):
+            metrics.inc("bot_notifications_dropped_total", help_text="Messaggi senza alcun canale attivo")
+            print(f"[NOTIFY] nessun canale attivo tra {', '.join(only)}: messaggio scartato")
+            return
+        with self._cv:
+            if priority or self.window_seconds <= 0:
+                self._urgent.append((text, only))
+            else:
+                if not self._pending:
+                    self._window_end = time.monotonic() + self.window_seconds
+                self._pending.append((text, only))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notify-bus", daemon=True)
+                self._thread.start()
+            self._set_pending_gauge()
+            self._cv.notify()
+
+    def _set_pending_gauge(self):
+        metrics.set_gauge("bot_pending_notifications", len(self._pending) + len(self._urgent),
+                          labels={"queue": "bus"}, help_text="Notifiche in attesa di invio")
+
+    def _next_batch(self):
+        """Sotto lock: prossimo gruppo da inviare, None se chiuso e vuoto."""
+        while True:
+            if self._urgent:
+                return [self._urgent.pop(0)]
+            if self._pending and (self._closed or len(self._pending) >= self.max_batch
+                                  or time.monotonic() >= self._window_end):
+                batch, self._pending = self._pending, []
+                return batch
+            if self._closed:
+                return None
+            self._cv.wait(max(0.0, self._window_end - time.monotonic()) if self._pending else None)
+
+    def _run(self):
+        while True:
+            with self._cv:
+                batch = self._next_batch()
+                self._set_pending_gauge()
+            if batch is None:
+                return
+            self.deliver(batch)
+
+    def deliver(self, batch):
+        if len(batch) > 1:
+            metrics.inc("bot_notifications_coalesced_total", len(batch),
+                        help_text="Messaggi confluiti in un digest")
+        for b in self.backends:
+            texts = [t for t, only in batch if only is None or b.name in only]
+            if not texts:
+                continue
+            for part in digest_parts(texts, b.max_chars):
+                try:
+                    b.send(part)
+                    metrics.inc("bot_notifications_total", labels={"backend": b.name, "status": "ok"},
+                                help_text="Invii per canale")
+                except Exception as e:
+                    metrics.inc("bot_notifications_total", labels={"backend": b.name, "status": "error"},
+                                help_text="Invii per canale")
+                    print(f"[NOTIFY/{b.name.upper()}] {e}")
+
+    def close(self, timeout: float = 15.0):
+        """Invia subito quanto è in finestra e attende la fine degli invii (max timeout secondi circa)."""
+        deadline = time.monotonic() + timeout
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+            t = self._thread
+        if t is not None:
+            t.join(timeout)
+        for b in self.backends:
+            b.close(max(0.0, deadline - time.monotonic()))
+
+
+_BUS = None
+_BUS_LOCK = threading.Lock()
+
+def build_backends(names=None) -> List[Backend]:
+    out = []
+    for name in (names if names is not None else NOTIFY_BACKENDS):
+        factory = BACKENDS.get(name)
+        if factory is None:
+            print(f"[NOTIFY] backend sconosciuto: {name}")
+            continue
+        out.append(factory())
+    return out
+
+def get_bus() -> NotificationBus:
+    """Bus di processo (creato al primo uso con NOTIFY_BACKENDS, chiuso all'uscita)."""
+    global _BUS
+    with _BUS_LOCK:
+        if _BUS is None:
+            _BUS = NotificationBus(build_backends())
+            atexit.register(_BUS.close)
+        return _BUS
@@ -2,62 +2,200 @@
 import os
 import time
 import json
+import queue
+import threading
 import requests
 from typing import Optional
 
+import metrics
+
+# Limiti Telegram: ~1 msg/s per chat (brevi burst tollerati), ~30 msg/s per bot in totale
+TELEGRAM_CHAT_RATE   = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST  = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_QUEUE_MAX   = int(os.getenv("TELEGRAM_QUEUE_MAX", "500"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+
+class TokenBucket:
+    """rate token al secondo, al massimo capacity accumulati. Da usare sotto lock del chiamante."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def wait_time(self, now: float) -> float:
+        """Secondi da attendere per avere un token (0 = disponibile ora)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block_until(self, until: float):
+        """Svuota il bucket fino a 'until' (429 retry_after)."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0) - max(0.0, until - self.ts) * self.rate
+
+
+# Condivisi tra tutte le istanze del processo: i limiti Telegram valgono per bot e per chat
+_BUCKETS_LOCK = threading.Lock()
+_GLOBAL_BUCKET = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+_CHAT_BUCKETS = {}
+
+
+def _chat_bucket(chat_id: str, rate: float) -> TokenBucket:
+    b = _CHAT_BUCKETS.get(chat_id)
+    if b is None:
+        b = _CHAT_BUCKETS[chat_id] = TokenBucket(rate, TELEGRAM_CHAT_BURST)
+    return b
+
+
 class TelegramNotifier:
     """
-    Invio notifiche Telegram con rate-limit di sicurezza.
+    Invio notifiche Telegram non bloccante.
+    send() accoda e ritorna subito; un thread daemon svuota la coda rispettando i token bucket
+    per chat e globale, e su 429 attende il retry_after indicato da Telegram.
     Se TELEGRAM_BOT_TOKEN o TELEGRAM_CHAT_ID non sono impostati, va in no-op (stampa a console).
     Variabili d'ambiente:
-      - TELEGRAM_BOT_TOKEN
+      - TELEGRAM_BOT_TOKEN (o TELEGRAM_TOKEN)
       - TELEGRAM_CHAT_ID
       - ALERTS_ENABLED=true/false  (default: true)
+      - TELEGRAM_CHAT_RATE / TELEGRAM_CHAT_BURST  (default 1 msg/s, burst 3)
+      - TELEGRAM_GLOBAL_RATE  (default 30 msg/s)
+      - TELEGRAM_QUEUE_MAX    (default 500; oltre, i nuovi messaggi vengono scartati)
+      - TELEGRAM_MAX_RETRIES  (default 3; errori di rete/5xx)
     """
 
     def __init__(self, min_interval_sec: int = 2):
-        self.token = os.getenv("TELEGRAM_BOT_TOKEN")
+        self.token = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN")
         self.chat_id = os.getenv("TELEGRAM_CHAT_ID")
         self.enabled = (os.getenv("ALERTS_ENABLED", "true").lower() == "true")
         self.min_interval = max(0, int(min_interval_sec))
-        self._last_sent_ts = 0.0
+        # min_interval_sec resta come tetto alla cadenza per chat
+        self.chat_rate = min(TELEGRAM_CHAT_RATE, 1.0 / self.min_interval) if self.min_interval else TELEGRAM_CHAT_RATE
+        self._q = queue.Queue(maxsize=TELEGRAM_QUEUE_MAX)
+        self._thread = None
+        self._lock = threading.Lock()
 
     def _can_send(self) -> bool:
         if not self.enabled:
             return False
         return bool(self.token and self.chat_id)
 
-    def send(self, text: str, disable_web_page_preview: bool = True) -> Optional[dict]:
+    def send(self, text: str, disable_web_page_preview: bool = True,
+             parse_mode: Optional[str] = "HTML") -> bool:
         """
-        Invia un messaggio. Se non configurato, stampa su console e ritorna None.
-        Applica un piccolo rate-limit (min_interval_sec) per evitare flood.
+        Accoda un messaggio e ritorna subito (True se accodato).
+        Se non configurato, stampa su console e ritorna False.
+        parse_mode=None invia testo semplice.
         """
         if not self._can_send():
             print(f"[NOTIFY/DRY] {text}")
-            return None
-
-        # rate-limit
-        now = time.time()
-        if now - self._last_sent_ts < self.min_interval:
-            time.sleep(self.min_interval - (now - self._last_sent_ts))
+            return False
 
-        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
         payload = {
             "chat_id": self.chat_id,
             "text": text,
             "disable_web_page_preview": disable_web_page_preview,
-            "parse_mode": "HTML",
         }
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
         try:
-            r = requests.post(url, json=payload, timeout=10)
-            r.raise_for_status()
-            self._last_sent_ts = time.time()
+            self._q.put_nowait(payload)
+        except queue.Full:
+            metrics.inc("bot_notifications_dropped_total", labels={"backend": "telegram"},
+                        help_text="Notifiche scartate per coda piena")
+            print(f"[NOTIFY/DROP] coda piena // testo='{text[:120]}'")
+            return False
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="telegram-notifier", daemon=True)
+                self._thread.start()
+        self._set_pending_gauge()
+        return True
+
+    def flush(self, timeout: float = 15.0) -> bool:
+        """Attende lo svuotamento della coda (arresto ordinato). False se scade il timeout."""
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._q.unfinished_tasks
+
+    def _set_pending_gauge(self):
+        metrics.set_gauge("bot_pending_notifications", self._q.unfinished_tasks, labels={"queue": "telegram"},
+                          help_text="Notifiche in attesa di invio")
+
+    # --- worker ---
+    def _acquire(self):
+        """Blocca il worker (mai il chiamante) finché chat e bucket globale hanno un token."""
+        while True:
+            with _BUCKETS_LOCK:
+                now = time.monotonic()
+                chat = _chat_bucket(self.chat_id, self.chat_rate)
+                wait = max(chat.wait_time(now), _GLOBAL_BUCKET.wait_time(now))
+                if wait <= 0:
+                    chat.take(now)
+                    _GLOBAL_BUCKET.take(now)
+                    return
+            time.sleep(wait)
+
+    def _post(self, payload: dict) -> Optional[dict]:
+        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
+        attempt = 0
+        while attempt <= TELEGRAM_MAX_RETRIES:
+            self._acquire()
+            try:
+                r = requests.post(url, json=payload, timeout=10)
+            except requests.RequestException as e:
+                attempt += 1
+                print(f"[NOTIFY/ERR] {e} (tentativo {attempt})")
+                time.sleep(min(30, 2 ** attempt))
+                continue
+            if r.status_code == 429:
+                try:
+                    retry_after = float(r.json().get("parameters", {}).get("retry_after", 0))
+                except ValueError:
+                    retry_after = 0.0
+                retry_after = retry_after or float(r.headers.get("Retry-After", 5))
+                metrics.inc("bot_telegram_429_total", help_text="Risposte 429 da Telegram")
+                print(f"[NOTIFY/429] retry_after={retry_after:g}s")
+                with _BUCKETS_LOCK:
+                    until = time.monotonic() + retry_after
+                    _chat_bucket(self.chat_id, self.chat_rate).block_until(until)
+                    _GLOBAL_BUCKET.block_until(until)
+                continue   # il 429 non conta come tentativo: riprova dopo l'attesa
+            if r.status_code >= 500:
+                attempt += 1
+                print(f"[NOTIFY/ERR] HTTP {r.status_code} (tentativo {attempt})")
+                time.sleep(min(30, 2 ** attempt))
+                continue
+            if r.status_code >= 400:
+                print(f"[NOTIFY/ERR] HTTP {r.status_code} {r.text[:200]}  // testo='{payload['text'][:120]}'")
+                return None
             resp = r.json()
             print(f"[NOTIFY/OK] {json.dumps(resp, ensure_ascii=False)}")
             return resp
-        except Exception as e:
-            print(f"[NOTIFY/ERR] {e}  // testo='{text[:120]}'")
-            return None
+        print(f"[NOTIFY/ERR] tentativi esauriti // testo='{payload['text'][:120]}'")
+        return None
+
+    def _worker(self):
+        while True:
+            payload = self._q.get()
+            try:
+                self._post(payload)
+            except Exception as e:
+                print(f"[NOTIFY/ERR] {e}  // testo='{payload['text'][:120]}'")
+            finally:
+                self._q.task_done()
+                self._set_pending_gauge()
 
     # Helper “semantici”
     def startup(self):
@@ -0,0 +1,257 @@
+# oco_execution.py
+"""
+Esecuzione reale dei trade con OCO su Binance spot (EXECUTION_MODE=oco in bot_oro).
+- Apertura: ordine a mercato BUY (quantità arrotondata ai filtri del simbolo), poi OCO SELL con
+  take-profit limit a TP (OCO_TP_LEVEL, default TP1) e stop-limit a SL
+- I fill arrivano dallo user-data stream (executionReport) e finiscono in una coda; il loop del bot
+  la svuota e aggiorna il foglio solo sui fill: nessun confronto prezzo/trigger a ogni giro
+- L'ID della lista OCO è scritto nella colonna Strategia ("OCO <orderListId>"): dopo un riavvio le
+  liste aperte si ricostruiscono dal foglio e catch_up() recupera i fill persi a stream fermo
+- Solo LONG: su spot uno short richiederebbe margine
+- FakeExchange: stand-in locale del client (replay e prove), gli OCO scattano quando cambia il prezzo
+Variabili opzionali:
+  OCO_TP_LEVEL      (default TP1)  livello di take-profit della gamba limit: TP1 | TP2
+  OCO_SL_LIMIT_BP   (default 10)   distanza in bp del prezzo limite dello stop sotto lo stopPrice
+"""
+import os
+import queue
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List
+
+from exchange_filters import SymbolFilters
+
+OCO_TP_LEVEL    = os.getenv("OCO_TP_LEVEL", "TP1").upper()
+OCO_SL_LIMIT_BP = Decimal(os.getenv("OCO_SL_LIMIT_BP", "10"))
+
+STRATEGY_PREFIX = "OCO "
+
+
+def fmt_plain(x: Decimal) -> str:
+    """Decimal senza notazione esponenziale (l'API Binance rifiuta '1E+1')."""
+    s = format(x.normalize(), "f")
+    return s if s != "-0" else "0"
+
+
+# ------------------ Esecutore ------------------
+class OcoExecutor:
+    def __init__(self, client, symbol: str, tp_pct: Dict[str, Decimal], sl_pct: Decimal, filters=None):
+        self.client = client
+        self.symbol = symbol
+        self.tp_pct = tp_pct[OCO_TP_LEVEL] if OCO_TP_LEVEL in tp_pct else tp_pct["TP1"]
+        self.tp_name = OCO_TP_LEVEL if OCO_TP_LEVEL in tp_pct else "TP1"
+        self.sl_pct = sl_pct
+        # filtri dal registro condiviso (exchange_filters), altrimenti chiesti al client
+        self.filters = filters or SymbolFilters.from_symbol_info(client.get_symbol_info(symbol))
+        self.fills: "queue.Queue[dict]" = queue.Queue()
+        self.lists: Dict[int, str] = {}       # orderListId -> trade_id (liste ancora vive)
+        self.stream_lost = False              # errore stream: la prossima riconciliazione fa catch_up
+        self._lock = threading.Lock()
+        self._twm = None
+
+    # --- apertura ---
+    def open_long(self, trade_id: str, qty: Decimal, ref_price: Decimal) -> dict:
+        """Market BUY + OCO SELL. Ritorna entry/qty effettivi, livelli e id lista."""
+        q = self.filters.qty(qty)
+        self.filters.check(q, ref_price)
+        buy = self.client.order_market_buy(symbol=self.symbol, quantity=fmt_plain(q),
+                                           newClientOrderId=f"{trade_id}-E"[:36])
+        filled = Decimal(buy["executedQty"])
+        entry = Decimal(buy["cummulativeQuoteQty"]) / filled if filled else ref_price
+        q = self.filters.qty(filled)
+
+        tp = self.filters.price(entry * (1 + self.tp_pct), up=True)
+        stop = self.filters.price(entry * (1 - self.sl_pct))
+        stop_limit = self.filters.price(stop * (1 - OCO_SL_LIMIT_BP / Decimal(10000)))
+        oco = self.client.order_oco_sell(symbol=self.symbol, quantity=fmt_plain(q), price=fmt_plain(tp),
+                                         stopPrice=fmt_plain(stop), stopLimitPrice=fmt_plain(stop_limit),
+                                         stopLimitTimeInForce="GTC", listClientOrderId=f"{trade_id}-O"[:36])
+        list_id = int(oco["orderListId"])
+        with self._lock:
+            self.lists[list_id] = trade_id
+        return {"entry": entry, "qty": q, "tp": tp, "stop": stop, "list_id": list_id,
+                "strategy": f"{STRATEGY_PREFIX}{list_id}"}
+
+    def manages(self, trade_id: str) -> bool:
+        with self._lock:
+            return trade_id in self.lists.values()
+
+    # --- fill ---
+    def _push_fill(self, list_id: int, order_type: str, qty: Decimal, quote: Decimal, ts: float):
+        with self._lock:
+            trade_id = self.lists.pop(list_id, None)   # una sola chiusura per lista (stream + catch-up)
+        if trade_id is None or qty <= 0:
+            return
+        hit = "SL" if "STOP" in order_type else self.tp_name
+        self.fills.put({"trade_id": trade_id, "list_id": list_id, "hit": hit,
+                        "price": quote / qty, "qty": qty, "ts": ts})
+
+    def on_user_event(self, msg: dict):
+        """Callback dello user-data stream (thread del websocket)."""
+        if msg.get("e") == "error":
+            self.stream_lost = True
+            print(f"[OCO] stream: {msg}")
+            return
+        if msg.get("e") != "executionReport" or msg.get("X") != "FILLED" or msg.get("S") != "SELL":
+            return
+        if msg.get("s") != self.symbol:
+            return
+        self._push_fill(int(msg.get("g", -1)), msg.get("o", ""), Decimal(msg["z"]), Decimal(msg["Z"]),
+                        msg.get("T", time.time() * 1000) / 1000.0)
+
+    def drain(self) -> List[dict]:
+        out = []
+        while True:
+            try:
+                out.append(self.fills.get_nowait())
+            except queue.Empty:
+                return out
+
+    def requeue(self, fills: List[dict]):
+        """Fill letti con drain() ma non scritti sul foglio (scrittura fallita): tornano in coda."""
+        for f in fills:
+            self.fills.put(f)
+
+    # --- stream / recupero ---
+    def start_stream(self):
+        if hasattr(self.client, "start_user_socket"):   # FakeExchange
+            self.client.start_user_socket(self.on_user_event)
+            return
+        from binance import ThreadedWebsocketManager
+        self._twm = ThreadedWebsocketManager(api_key=self.client.API_KEY, api_secret=self.client.API_SECRET)
+        self._twm.start()
+        self._twm.start_user_socket(callback=self.on_user_event)
+
+    def stop_stream(self):
+        if self._twm is not None:
+            self._twm.stop()
+            self._twm = None
+
+    def load_open(self, open_trades: Dict[str, str]):
+        """open_trades: trade_id -> cella Strategia delle righe APERTO (dopo un riavvio)."""
+        with self._lock:
+            for trade_id, strategy in open_trades.items():
+                if (strategy or "").startswith(STRATEGY_PREFIX):
+                    try:
+                        self.lists[int(strategy[len(STRATEGY_PREFIX):])] = trade_id
+                    except ValueError:
+                        continue
+
+    def catch_up(self):
+        """Fill avvenuti mentre lo stream era fermo: una get_order_list per lista ancora aperta."""
+        self.stream_lost = False
+        with self._lock:
+            pending = list(self.lists)
+        for list_id in pending:
+            try:
+                ol = self.client.get_order_list(orderListId=list_id)
+                if ol.get("listOrderStatus") != "ALL_DONE":
+                    continue
+                for o in ol.get("orders", []):
+                    od = self.client.get_order(symbol=self.symbol, orderId=o["orderId"])
+                    if od.get("status") == "FILLED":
+                        self._push_fill(list_id, od.get("type", ""), Decimal(od["executedQty"]),
+                                        Decimal(od["cummulativeQuoteQty"]), od.get("updateTime", 0) / 1000.0)
+            except Exception as e:
+                print(f"[OCO] catch_up lista {list_id}: {e}")
+
+
+# ------------------ Stand-in locale ------------------
+class FakeExchange:
+    """
+    Sottoinsieme di binance.Client per EXECUTION_MODE=oco senza rete: market al prezzo corrente,
+    OCO che scattano quando si assegna .price (limit >= prezzo -> TP, prezzo <= stop -> SL al limite stop).
+    Emette executionReport ai callback registrati con start_user_socket.
+    """
+
+    def __init__(self, symbol: str = "PAXGUSDT", price="0", step="0.0001", tick="0.01",
+                 min_qty="0.0001", min_notional="5"):
+        self.symbol = symbol
+        self._price = Decimal(str(price))
+        self._filters = [
+            {"filterType": "PRICE_FILTER", "tickSize": tick},
+            {"filterType": "LOT_SIZE", "stepSize": step, "minQty": min_qty},
+            {"filterType": "NOTIONAL", "minNotional": min_notional},
+        ]
+        self._next_id = 1
+        self.orders: Dict[int, dict] = {}
+        self.order_lists: Dict[int, dict] = {}
+        self._callbacks = []
+
+    def _id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _now_ms(self) -> int:
+        return int(time.time() * 1000)
+
+    # --- API ---
+    def get_symbol_info(self, symbol):
+        return {"symbol": symbol, "filters": list(self._filters)}
+
+    def get_symbol_ticker(self, symbol=None, **kwargs):
+        return {"symbol": symbol or self.symbol, "price": str(self._price)}
+
+    def order_market_buy(self, symbol, quantity, newClientOrderId=None, **kwargs):
+        q = Decimal(quantity)
+        oid = self._id()
+        o = {"orderId": oid, "clientOrderId": newClientOrderId, "symbol": symbol, "side": "BUY",
+             "type": "MARKET", "status": "FILLED", "executedQty": str(q),
+             "cummulativeQuoteQty": str(q * self._price), "updateTime": self._now_ms()}
+        self.orders[oid] = o
+        return dict(o)
+
+    def order_oco_sell(self, symbol, quantity, price, stopPrice, stopLimitPrice,
+                       stopLimitTimeInForce="GTC", listClientOrderId=None, **kwargs):
+        if not Decimal(price) > self._price > Decimal(stopPrice):
+            raise RuntimeError("OCO SELL: serve limit > prezzo corrente > stopPrice")
+        list_id = self._id()
+        legs = []
+        for typ, px, stop in (("LIMIT_MAKER", price, None), ("STOP_LOSS_LIMIT", stopLimitPrice, stopPrice)):
+            oid = self._id()
+            self.orders[oid] = {"orderId": oid, "symbol": symbol, "side": "SELL", "type": typ, "status": "NEW",
+                                "price": px, "stopPrice": stop, "origQty": quantity, "executedQty": "0",
+                                "cummulativeQuoteQty": "0", "orderListId": list_id, "updateTime": self._now_ms()}
+            legs.append({"orderId": oid, "symbol": symbol})
+        self.order_lists[list_id] = {"orderListId": list_id, "listClientOrderId": listClientOrderId,
+                                     "listOrderStatus": "EXECUTING", "orders": legs}
+        return {"orderListId": list_id, "listClientOrderId": listClientOrderId, "orders": legs}
+
+    def get_order_list(self, orderListId, **kwargs):
+        return dict(self.order_lists[orderListId])
+
+    def get_order(self, symbol, orderId, **kwargs):
+        return dict(self.orders[orderId])
+
+    def start_user_socket(self, callback):
+        self._callbacks.append(callback)
+
+    # --- mercato ---
+    @property
+    def price(self) -> Decimal:
+        return self._price
+
+    @price.setter
+    def price(self, p):
+        self._price = Decimal(str(p))
+        for ol in self.order_lists.values():
+            if ol["listOrderStatus"] != "EXECUTING":
+                continue
+            tp, sl = (self.orders[x["orderId"]] for x in ol["orders"])
+            if self._price >= Decimal(tp["price"]):
+                self._fill(ol, tp, other=sl)
+            elif self._price <= Decimal(sl["stopPrice"]):
+                self._fill(ol, sl, other=tp)
+
+    def _fill(self, ol, order, other):
+        q = Decimal(order["origQty"])
+        px = Decimal(order["price"])
+        order.update(status="FILLED", executedQty=str(q), cummulativeQuoteQty=str(q * px), updateTime=self._now_ms())
+        other.update(status="EXPIRED", updateTime=self._now_ms())
+        ol["listOrderStatus"] = "ALL_DONE"
+        event = {"e": "executionReport", "s": order["symbol"], "S": "SELL", "o": order["type"], "X": "FILLED",
+                 "i": order["orderId"], "g": ol["orderListId"], "z": str(q), "Z": str(q * px),
+                 "L": str(px), "T": order["updateTime"]}
+        for cb in self._callbacks:
+            cb(event)
@@ -0,0 +1,154 @@
+# perf_aggregates.py
+"""
+Aggregati di performance aggiornati a ogni chiusura (bot_oro.py, pipeline.py), senza rileggere la tab Trade.
+- Un secchio per giorno, settimana ISO e simbolo: trade, vincenti, P&L lordo, fee, P&L netto, max drawdown
+- add() è O(1): il drawdown si tiene con il picco del P&L netto cumulato del secchio
+- Stato su file JSON (scrittura atomica) a ogni chiusura: sopravvive ai riavvii
+- block_update() restituisce un solo range per la tab di riepilogo (blocco fisso A:I, righe vuote in coda),
+  dopo una chiusura e al cambio di giorno (Oggi/Ieri e le settimane scorrono anche senza chiusure)
+Variabili opzionali:
+  FEE_RATE          (default 0.001)   fee per lato sul nozionale (taker Binance 0.10%)
+  PERF_KEEP_DAYS    (default 35)      giorni conservati
+  PERF_KEEP_WEEKS   (default 12)      settimane conservate
+"""
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+FEE_RATE = float(os.getenv("FEE_RATE", "0.001"))
+PERF_KEEP_DAYS = int(os.getenv("PERF_KEEP_DAYS", "35"))
+PERF_KEEP_WEEKS = int(os.getenv("PERF_KEEP_WEEKS", "12"))
+
+FIELDS = ("trades", "wins", "pnl", "fees", "net", "peak", "max_dd")
+
+
+def day_key(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d")
+
+
+def week_key(dt: datetime) -> str:
+    y, w, _ = dt.isocalendar()
+    return f"{y}-W{w:02d}"
+
+
+def new_bucket() -> Dict[str, float]:
+    return dict.fromkeys(FIELDS, 0.0)
+
+
+def bucket_add(b: Dict[str, float], pnl: float, fees: float):
+    b["trades"] += 1
+    b["wins"] += pnl > 0
+    b["pnl"] += pnl
+    b["fees"] += fees
+    b["net"] += pnl - fees
+    b["peak"] = max(b["peak"], b["net"])
+    b["max_dd"] = max(b["max_dd"], b["peak"] - b["net"])
+
+
+class PerfAggregates:
+    HEADER = ["Periodo", "Chiave", "Trade", "Win %", "P&L", "Fee", "P&L netto", "Max DD", "Aggiornato"]
+
+    def __init__(self, path: str = "", fee_rate: float = FEE_RATE):
+        self.path = path
+        self.fee_rate = fee_rate
+        self.buckets: Dict[str, Dict[str, Dict[str, float]]] = {"day": {}, "week": {}, "symbol": {}}
+        self.updated = ""
+        self.dirty = False
+        self._rows_written = 0
+        self._rows_prev = 0       # righe del blocco prima dell'ultimo block_update (per block_failed)
+        self._day_written = ""    # giorno di "Oggi" nell'ultimo blocco scritto
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for kind in self.buckets:
+                    self.buckets[kind] = {k: {**new_bucket(), **v} for k, v in data.get(kind, {}).items()}
+                self.updated = data.get("updated", "")
+                self.dirty = True   # primo giro: il blocco si riscrive comunque
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[WARN] Aggregati su disco illeggibili ({path}): {e}")
+
+    def add(self, when: datetime, symbol: str, pnl: float, notional: float):
+        """Una chiusura: notional = ingresso + uscita (qty x prezzo), le fee sono fee_rate sul totale."""
+        fees = self.fee_rate * notional
+        with self._lock:
+            for kind, key in (("day", day_key(when)), ("week", week_key(when)), ("symbol", symbol)):
+                bucket_add(self.buckets[kind].setdefault(key, new_bucket()), pnl, fees)
+            self._prune(when)
+            self.updated = when.strftime("%Y-%m-%d %H:%M:%S")
+            self.dirty = True
+            self._save()
+
+    def _prune(self, when: datetime):
+        days, weeks = self.buckets["day"], self.buckets["week"]
+        oldest_day = day_key(when - timedelta(days=PERF_KEEP_DAYS))
+        for k in [k for k in days if k < oldest_day]:
+            del days[k]
+        for k in sorted(weeks)[:-PERF_KEEP_WEEKS]:
+            del weeks[k]
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({**self.buckets, "updated": self.updated}, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[WARN] Salvataggio aggregati fallito: {e}")
+
+    def get(self, kind: str, key: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.buckets[kind].get(key) or new_bucket())
+
+    @staticmethod
+    def row(label: str, key: str, b: Dict[str, float], updated: str = "") -> List:
+        n = int(b["trades"])
+        win = f"{100.0 * b['wins'] / n:.1f}" if n else ""
+        return [label, key, n, win, f"{b['pnl']:.2f}", f"{b['fees']:.2f}", f"{b['net']:.2f}",
+                f"{b['max_dd']:.2f}", updated]
+
+    def rows(self, now: datetime) -> List[List]:
+        """Oggi, ieri, settimana corrente e precedente, poi un rigo per simbolo."""
+        with self._lock:
+            def pick(kind, key):
+                return self.buckets[kind].get(key) or new_bucket()
+            out = [
+                self.row("Oggi", day_key(now), pick("day", day_key(now)), self.updated),
+                self.row("Ieri", day_key(now - timedelta(days=1)), pick("day", day_key(now - timedelta(days=1)))),
+                self.row("Settimana", week_key(now), pick("week", week_key(now))),
+                self.row("Settimana prec.", week_key(now - timedelta(weeks=1)), pick("week", week_key(now - timedelta(weeks=1)))),
+            ]
+            out += [self.row("Simbolo", s, b) for s, b in sorted(self.buckets["symbol"].items())]
+        return out
+
+    def block_update(self, title: str, now: datetime) -> Optional[dict]:
+        """
+        Range del blocco se ci sono chiusure nuove o è cambiato il giorno (poi pulito), altrimenti None.
+        Se la scrittura del batch fallisce il chiamante usa block_failed(): il blocco torna da riscrivere.
+        """
+        day = day_key(now)
+        with self._lock:
+            if not self.dirty and day == self._day_written:
+                return None
+            self.dirty = False
+            self._day_written = day
+        rows = self.rows(now)
+        pad = max(0, self._rows_written - len(rows))   # simboli spariti: righe vecchie svuotate
+        self._rows_prev, self._rows_written = self._rows_written, len(rows)
+        rows += [[""] * len(self.HEADER)] * pad
+        tab = title.replace("'", "''")
+        return {"range": f"'{tab}'!A1:I{len(rows) + 1}", "values": [self.HEADER] + rows}
+
+    def block_failed(self):
+        """L'ultimo blocco non è arrivato sul foglio: di nuovo da scrivere (righe da svuotare comprese)."""
+        with self._lock:
+            self.dirty = True
+            self._day_written = ""
+            self._rows_written = max(self._rows_written, self._rows_prev)
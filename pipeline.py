@@ -0,0 +1,395 @@
+# pipeline.py
+"""
+Runtime a pipeline per il bot live (RUNTIME=pipeline).
+Tre worker collegati da code limitate, al posto del giro seriale di main_loop:
+- ingest:     legge il prezzo (get_last_price) e lo pubblica; se l'evaluator è indietro vince l'ultimo tick
+- evaluation: possiede lo stato dei trade aperti e decide TP/SL/aperture a ogni tick, senza I/O Sheets;
+              emette mutazioni (open/close/log) sulla coda verso il writer (put bloccante = backpressure)
+- writer:     applica le mutazioni in batch, aggiorna ping/P&L live a cadenza fissa, scrive log e notifiche,
+              esegue riconciliazione/chiusure manuali/archiviazione e rimanda all'evaluator uno snapshot
+Arresto coordinato su SIGTERM/SIGINT: l'ingest si ferma, l'evaluator chiude il giro, il writer svuota la coda.
+Variabili opzionali:
+  PIPE_TICK_SECONDS    (default PRICE_MIN_INTERVAL)  intervallo letture prezzo
+  PIPE_FLUSH_SECONDS   (default 2)    cadenza massima dei batch verso Sheets
+  PIPE_PING_SECONDS    (default POLL_SECONDS)  cadenza aggiornamento ping/P&L live
+  PIPE_WRITE_QUEUE     (default 256)  capienza coda mutazioni
+"""
+import os
+import queue
+import signal
+import threading
+import time
+
+import bot_oro
+import metrics
+from bot_oro import fmt_dec, log
+
+PIPE_TICK_SECONDS  = float(os.getenv("PIPE_TICK_SECONDS", str(bot_oro.PRICE_MIN_INTERVAL)))
+PIPE_FLUSH_SECONDS = float(os.getenv("PIPE_FLUSH_SECONDS", "2"))
+PIPE_PING_SECONDS  = float(os.getenv("PIPE_PING_SECONDS", str(bot_oro.POLL_SECONDS)))
+PIPE_WRITE_QUEUE   = int(os.getenv("PIPE_WRITE_QUEUE", "256"))
+
+
+def put_latest(q: queue.Queue, item):
+    """Put non bloccante su coda limitata: se piena scarta l'elemento più vecchio."""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+# ------------------ Ingest ------------------
+class PriceIngest(threading.Thread):
+    def __init__(self, client, ticks: queue.Queue, mutations: queue.Queue, stop: threading.Event):
+        super().__init__(name="price-ingest", daemon=True)
+        self.client, self.ticks, self.mutations, self.stop = client, ticks, mutations, stop
+
+    def run(self):
+        while not self.stop.is_set():
+            if bot_oro._now() < bot_oro._BINANCE_BANNED_UNTIL:
+                ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bot_oro._BINANCE_BANNED_UNTIL))
+                try:
+                    self.mutations.put_nowait(("log", 0, "WARN",
+                                               f"Binance bannato fino a {ts}. Sleep {bot_oro.BANNED_FALLBACK_SLEEP}s"))
+                except queue.Full:
+                    print(f"[INGEST] Binance bannato fino a {ts}")
+                self.stop.wait(bot_oro.BANNED_FALLBACK_SLEEP)
+                continue
+            try:
+                lastp = bot_oro.get_last_price(self.client)
+                if lastp != 0:
+                    put_latest(self.ticks, (bot_oro._now(), lastp))
+            except Exception as e:
+                print(f"[INGEST] {e}")
+            self.stop.wait(PIPE_TICK_SECONDS)
+
+
+# ------------------ Evaluation ------------------
+class Evaluator(threading.Thread):
+    """
+    Stato: trade aperti {id: {side, entry, qty}}. Ogni mutazione ha un numero di sequenza;
+    gli snapshot del writer dicono fin dove le mutazioni sono state applicate, così le aperture/chiusure
+    non ancora scritte non vengono perse né ripetute al momento del merge.
+    """
+
+    def __init__(self, ticks, mutations, snapshots, marks, stop):
+        super().__init__(name="evaluation", daemon=True)
+        self.ticks, self.mutations, self.snapshots, self.marks, self.stop = ticks, mutations, snapshots, marks, stop
+        self.open = {}
+        self.seq = 0
+        self.pending_opens = {}    # id -> (seq, rec)
+        self.pending_closes = {}   # id -> seq
+        self.last_trade_ts = 0.0
+        self.last_entry_price = None
+        self.last_skip = None
+
+    def emit(self, kind, *payload):
+        self.seq += 1
+        item = (kind, self.seq) + payload
+        while not self.stop.is_set():
+            try:
+                self.mutations.put(item, timeout=0.5)   # backpressure: aspetta il writer
+                return self.seq
+            except queue.Full:
+                continue
+        # in arresto: il writer drena finché l'evaluator è vivo
+        self.mutations.put(item, timeout=30)
+        return self.seq
+
+    def new_trade_id(self):
+        """Stesso allocatore di ensure_min_open_trades (ID crescenti, niente collisioni nello stesso secondo)."""
+        return bot_oro.trade_ids().next(bot_oro.SYMBOL, "AUTO")
+
+    def merge_snapshot(self, snap):
+        applied, trades = snap["applied_seq"], snap["open"]
+        self.pending_opens = {k: v for k, v in self.pending_opens.items() if v[0] > applied}
+        self.pending_closes = {k: v for k, v in self.pending_closes.items() if v > applied}
+        merged = {tid: dict(side=t["side"], entry=t["entry"], qty=t["qty"])
+                  for tid, t in trades.items() if tid not in self.pending_closes}
+        for tid, (_, rec) in self.pending_opens.items():
+            merged.setdefault(tid, rec)
+        self.open = merged
+
+    def on_tick(self, ts, lastp):
+        # 1) TP/SL sugli aperti (una valutazione vettoriale per tutti)
+        items = list(self.open.items())
+        hits = bot_oro.check_hits([(t["side"], t["entry"], t["qty"]) for _, t in items], lastp)
+        for (tid, t), (hit, close_price, pnl_pct, pnl_val) in zip(items, hits):
+            if not hit:
+                continue
+            del self.open[tid]
+            self.pending_opens.pop(tid, None)
+            self.pending_closes[tid] = self.emit("close", tid, dict(
+                t, hit=hit, close_price=close_price, pnl_pct=pnl_pct, pnl_val=pnl_val))
+
+        # 2) Auto-apertura con gli stessi filtri di ensure_min_open_trades
+        if len(self.open) < bot_oro.MIN_OPEN_TRADES:
+            reason = (bot_oro.cooldown_skip_reason(ts, self.last_trade_ts)
+                      or bot_oro.entry_skip_reason(lastp, [t["entry"] for t in self.open.values()],
+                                                   self.last_entry_price))
+            if reason:
+                # un solo log per tipo di skip finché resta attivo (a ogni tick cambierebbero i numeri)
+                if reason[:20] != self.last_skip:
+                    self.emit("log", "DEBUG", reason)
+                self.last_skip = reason[:20]
+            else:
+                self.last_skip = None
+                tid = self.new_trade_id()
+                rec = dict(side=bot_oro.AUTO_TRADE_SIDE.upper(), entry=lastp, qty=bot_oro.DEFAULT_QTY)
+                self.open[tid] = rec
+                self.pending_opens[tid] = (self.emit("open", tid, rec), rec)
+                self.last_trade_ts, self.last_entry_price = ts, lastp
+
+        metrics.set_gauge("bot_open_trades", len(self.open), help_text="Trade aperti (stato evaluator)")
+        self.marks.publish(ts, lastp, dict(self.open))
+
+    def run(self):
+        while not (self.stop.is_set() and self.ticks.empty()):
+            try:
+                snap = self.snapshots.get_nowait()
+                self.merge_snapshot(snap)
+            except queue.Empty:
+                pass
+            try:
+                ts, lastp = self.ticks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            t0 = time.perf_counter()
+            try:
+                self.on_tick(ts, lastp)
+            except Exception as e:
+                self.emit("log", "ERROR", f"[PIPE] evaluation: {e}")
+            bot_oro.note_first_evaluation()
+            elapsed = time.perf_counter() - t0
+            metrics.set_gauge("bot_cycle_seconds", elapsed, help_text="Durata valutazione tick")
+            if lastp and bot_oro.should_log_heartbeat(lastp):
+                bot_oro.heartbeats().add(bot_oro.SYMBOL, lastp, elapsed)   # il writer lo porta nel batch
+
+
+class Marks:
+    """Ultimo prezzo + vista degli aperti pubblicati dall'evaluator (letti dal writer per i ping)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._val = None
+
+    def publish(self, ts, price, open_trades):
+        with self._lock:
+            self._val = (ts, price, open_trades)
+
+    def latest(self):
+        with self._lock:
+            return self._val
+
+
+# ------------------ Writer ------------------
+class SheetWriterWorker(threading.Thread):
+    def __init__(self, ws_trade, ws_log_base, mutations, snapshots, marks, stop):
+        super().__init__(name="sheet-writer", daemon=True)
+        self.ws_trade, self.ws_log_base = ws_trade, ws_log_base
+        self.mutations, self.snapshots, self.marks, self.stop = mutations, snapshots, marks, stop
+        self.H = bot_oro._H_CACHE
+        self.col_ping = bot_oro._COL_PING_CACHE
+        self.applied_seq = 0
+        self.index = bot_oro.trade_index(ws_trade)   # id -> riga, equity (condiviso con open_new_trade)
+        self.retry_updates = []    # celle di chiusura non ancora scritte
+        self.retry_notify = []     # notifiche di quelle chiusure: partono quando le celle sono scritte
+        self.upstream = None       # thread evaluator: il writer esce solo dopo di lui
+        self.last_ping = 0.0
+        self.last_reconcile = bot_oro._now()
+
+    @property
+    def ws_log(self):
+        return bot_oro.rotate_log_ws(self.ws_log_base)
+
+    # --- snapshot / indice righe ---
+    def publish_snapshot(self, rebuild=True):
+        if rebuild:
+            self.index.rebuild(self.ws_trade, self.H)
+        trades = {tid: dict(t) for tid, t in self.index.open.items()}
+        put_latest(self.snapshots, {"applied_seq": self.applied_seq, "open": trades})
+
+    def row_of(self, trade_id):
+        r = self.index.row_of(trade_id)
+        if r is None:
+            self.index.rebuild(self.ws_trade, self.H)   # trade aperto fuori dal writer: una rilettura
+            r = self.index.row_of(trade_id)
+        return r
+
+    # --- mutazioni ---
+    def apply(self, batch):
+        updates, logs, after_write = list(self.retry_updates), [], list(self.retry_notify)
+        self.retry_updates, self.retry_notify = [], []
+        for item in batch:
+            kind, seq = item[0], item[1]
+            if kind == "log":
+                logs.append([bot_oro.now_local_str(), item[2], item[3], "bot"])
+            elif kind == "open":
+                # append + log + notifica come nel runtime seriale
+                tid, rec = item[2], item[3]
+                try:
+                    bot_oro.open_new_trade(self.ws_trade, self.ws_log, trade_id=tid, side=rec["side"],
+                                           qty=rec["qty"], H=self.H, col_ping=self.col_ping,
+                                           entry_price=rec["entry"])
+                except Exception as e:
+                    logs.append([bot_oro.now_local_str(), "ERROR", f"Apertura trade automatico fallita ({tid}): {e}", "bot"])
+            elif kind == "close":
+                tid, c = item[2], item[3]
+                r = self.row_of(tid)
+                if r is None:
+                    logs.append([bot_oro.now_local_str(), "ERROR", f"[PIPE] riga non trovata per {tid}", "bot"])
+                else:
+                    eq_new = self.index.equity + c["pnl_val"]
+                    self.index.equity = eq_new
+                    updates += bot_oro.close_row_updates(self.H, r, c["hit"], c["close_price"],
+                                                         c["pnl_pct"], c["pnl_val"], eq_new)
+                    bot_oro.record_close(c["entry"], c["close_price"], c["qty"], c["pnl_val"])
+                    logs.append([bot_oro.now_local_str(), "INFO", bot_oro.close_log_text(
+                        c["hit"], r, tid, c["side"], c["entry"], c["close_price"],
+                        c["pnl_pct"], c["pnl_val"], eq_new), "bot"])
+                    after_write.append((bot_oro.close_message(
+                        c["hit"], tid, c["entry"], c["close_price"], c["pnl_pct"], c["pnl_val"], eq_new),
+                        c["hit"] == "SL"))
+                    self.index.remove(tid)
+            self.applied_seq = max(self.applied_seq, seq)
+
+        pings = self.ping_updates()
+        if updates or pings:
+            try:
+                if updates:
+                    bot_oro.checksum_before_write(self.ws_trade, self.H)
+                bot_oro.batch_update_many([(self.ws_trade, updates + pings)])   # journal se SPOOL_PATH
+                if updates:
+                    bot_oro.mark_sheet_written(self.ws_trade, self.H)   # chiusure: nuovo checksum di riferimento
+            except Exception as e:
+                # senza journal: le celle di chiusura vanno riscritte al prossimo giro, i ping no (saranno superati)
+                self.retry_updates, self.retry_notify = updates, after_write
+                if pings:
+                    bot_oro.status_blocks_failed()   # heartbeat/aggregati di nuovo da scrivere
+                logs.append([bot_oro.now_local_str(), "ERROR", f"[PIPE] batch Sheets fallito: {e}", "bot"])
+                after_write = []
+        if logs:
+            self.write_logs(logs)
+        for msg, priority in after_write:
+            bot_oro.notify(msg, priority=priority)
+
+    def ping_updates(self):
+        mark = self.marks.latest()
+        now = bot_oro._now()
+        if mark is None or now - self.last_ping < PIPE_PING_SECONDS:
+            return []
+        self.last_ping = now
+        _, lastp, open_trades = mark
+        nowloc = bot_oro.now_local_str()
+        out = [{"range": bot_oro.a1(2, self.col_ping),
+                "values": [[f"{nowloc} - {fmt_dec(lastp)}"]]}]
+        out += bot_oro.heartbeat_updates(self.ws_trade)
+        out += bot_oro.perf_updates(self.ws_trade)
+        for tid, t in open_trades.items():
+            r = self.index.row_of(tid)
+            if r is None:
+                continue
+            out.append({"range": bot_oro.a1(r, self.col_ping),
+                        "values": [[f"{nowloc} - {fmt_dec(lastp)}"]]})
+            out += bot_oro.live_row_updates(self.H, r, t["side"], t["entry"], lastp, t["qty"])
+        return out
+
+    def write_logs(self, rows):
+        ws = self.ws_log
+        try:
+            if not bot_oro.append_log_rows(ws, rows):
+                print(f"[LOG] {len(rows)} righe in coda nel journal")
+        except Exception as e:
+            for r in rows:
+                print(f"[LOG] {r[1]}: {r[2]} ({e})")
+
+    # --- manutenzione periodica ---
+    def maintenance(self):
+        now = bot_oro._now()
+        if now - self.last_reconcile < bot_oro.RECONCILE_MIN_SECONDS:
+            return
+        self.last_reconcile = now
+        ws_log = self.ws_log
+        try:
+            bot_oro.reconcile_if_changed(self.ws_trade, ws_log, self.H, bot_oro.SYMBOL)
+            if bot_oro.ARCHIVE_MIN_AGE_DAYS > 0 and now - bot_oro._LAST_ARCHIVE_TS >= bot_oro.ARCHIVE_EVERY_SECONDS:
+                bot_oro.archive_closed_trades(self.ws_trade, ws_log, self.H)
+                bot_oro._LAST_ARCHIVE_TS = now
+            self.publish_snapshot(rebuild=False)   # indice mantenuto dal writer / riallineato dalla riconciliazione
+        except Exception as e:
+            log(ws_log, "ERROR", f"[PIPE] manutenzione: {e}")
+
+    def run(self):
+        while True:
+            deadline = time.monotonic() + PIPE_FLUSH_SECONDS
+            batch = []
+            while time.monotonic() < deadline:
+                try:
+                    batch.append(self.mutations.get(timeout=max(0.05, deadline - time.monotonic())))
+                except queue.Empty:
+                    if self.stop.is_set():
+                        break
+            try:
+                self.apply(batch)
+                if not self.stop.is_set():
+                    self.maintenance()
+            except Exception as e:
+                print(f"[PIPE] writer: {e}")
+            upstream_done = self.upstream is None or not self.upstream.is_alive()
+            if self.stop.is_set() and upstream_done and self.mutations.empty():
+                if self.retry_updates:
+                    self.apply([])   # ultimo tentativo per le chiusure rimaste indietro
+                return
+
+
+# ------------------ Avvio ------------------
+def run_pipeline():
+    if bot_oro.EXECUTION_MODE == "oco":
+        raise RuntimeError("EXECUTION_MODE=oco è supportata solo dal runtime seriale (RUNTIME=serial)")
+    if metrics.start_server():
+        bot_oro.register_metrics()
+    ws_trade, ws_log_base = bot_oro.open_sheets()
+    client = bot_oro.binance_client()
+    bot_oro.bot_startup(ws_trade, ws_log_base, client)
+
+    stop = threading.Event()
+    ticks = queue.Queue(maxsize=8)
+    mutations = queue.Queue(maxsize=PIPE_WRITE_QUEUE)
+    snapshots = queue.Queue(maxsize=1)
+    marks = Marks()
+    metrics.gauge_func("bot_pending_sheet_writes", lambda: mutations.qsize() + bot_oro.pending_sheet_writes(),
+                       "Mutazioni foglio in attesa di scrittura (coda del writer + journal)")
+
+    writer = SheetWriterWorker(ws_trade, ws_log_base, mutations, snapshots, marks, stop)
+    writer.publish_snapshot()
+    evaluator = Evaluator(ticks, mutations, snapshots, marks, stop)
+    ingest = PriceIngest(client, ticks, mutations, stop)
+    writer.upstream = evaluator
+
+    def _stop(signum, frame):
+        print(f"[PIPE] segnale {signum}: arresto in corso…")
+        stop.set()
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    for t in (writer, evaluator, ingest):
+        t.start()
+    while not stop.is_set():
+        stop.wait(1.0)
+        if not all(t.is_alive() for t in (writer, evaluator, ingest)):
+            print("[PIPE] un worker è terminato: arresto")
+            stop.set()
+
+    ingest.join(timeout=PIPE_TICK_SECONDS + 5)
+    evaluator.join(timeout=10)
+    writer.join(timeout=60)
+    print("[PIPE] arrestato.")
+
+
+if __name__ == "__main__":
+    run_pipeline()
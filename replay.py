@@ -0,0 +1,440 @@
+# replay.py
+"""
+REPLAY del loop live (più veloce del tempo reale)
+- Esegue la vera logica di bot_oro (bot_startup + run_cycle: TP/SL, riconciliazione, auto-open
+  con griglia/distanza/cooldown) su una serie di prezzi registrata o storica.
+- Orologio virtuale al posto di time.time, fogli in memoria al posto di Google Sheets,
+  notifiche raccolte in lista: nessuna chiamata di rete, gira alla velocità della CPU.
+- Fonti prezzi:
+    --csv FILE               righe "ts,price" (ts in secondi o millisecondi epoch)
+    --ticks FILE [FILE ...]  file registrati dal bot live (tick_recorder, solo campioni "live")
+    --klines SYMBOL TF DAYS  candele Binance pubbliche (via backtest_bot_oro.load_klines)
+- Parametri del bot: stesse variabili d'ambiente di bot_oro, oppure --set NOME=VALORE
+  (es. --set GRID_STEP_BP=20 --set MIN_ENTRY_DISTANCE_BP=8).
+- --set EXECUTION_MODE=oco: ordini e OCO su oco_execution.FakeExchange (TP/SL eseguiti dall'exchange
+  simulato al cambio prezzo, fill via stream utente) invece dei trigger virtuali.
+"""
+
+import re
+import csv
+import sys
+import argparse
+from decimal import Decimal
+from typing import Iterable, List, Optional, Tuple
+
+import gspread
+
+import bot_oro
+
+DEFAULT_TRADE_HEADER = [
+    "Data/Ora", "ID Trade", "Lato", "Stato", "Prezzo ingresso", "Qty", "SL %", "TP1 %", "TP2 %",
+    "Prezzo chiusura", "Ultimo ping", "Delta", "P&L %", "P&L Valore", "Equity post-trade",
+    "Strategia", "Note",
+]
+DEFAULT_LOG_HEADER = ["Data/Ora", "Livello", "Messaggio", "Origine"]
+
+
+# ------------------ Orologio virtuale ------------------
+class VirtualClock:
+    def __init__(self, start: float = 0.0):
+        self.now = float(start)
+
+    def time(self) -> float:
+        return self.now
+
+    def set(self, ts: float):
+        self.now = max(self.now, float(ts))
+
+    def sleep(self, seconds: float):
+        self.now += max(0.0, float(seconds))
+
+
+# ------------------ Fogli in memoria (sottoinsieme API gspread usato dal bot) ------------------
+_A1_RE = re.compile(r"^([A-Z]*)(\d*)$")
+
+def col_to_idx(col: str) -> int:
+    n = 0
+    for ch in col:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def parse_a1(a1: str) -> Tuple[Optional[int], Optional[int]]:
+    """'K5' -> (5, 11); 'C' -> (None, 3); '2' -> (2, None)."""
+    m = _A1_RE.match(a1.strip().replace("$", ""))
+    if not m:
+        raise ValueError(f"A1 non valido: {a1}")
+    col, row = m.groups()
+    return (int(row) if row else None), (col_to_idx(col) if col else None)
+
+def split_range(rng: str) -> Tuple[Optional[str], str]:
+    """"'Log'!C2:C9" -> ("Log", "C2:C9"); "K5" -> (None, "K5")."""
+    if "!" not in rng:
+        return None, rng
+    title, cells = rng.rsplit("!", 1)
+    return title.strip("'"), cells
+
+
+class MemWorksheet:
+    def __init__(self, spreadsheet, title: str, sheet_id: int, header: Optional[List[str]] = None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows: List[List[str]] = [list(header)] if header else []
+
+    # --- letture ---
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    def get_all_values(self):
+        return [list(r) for r in self.rows]
+
+    def row_values(self, r: int):
+        row = list(self.rows[r - 1]) if r <= len(self.rows) else []
+        while row and row[-1] == "":
+            row.pop()
+        return row
+
+    def col_values(self, c: int):
+        out = [(row[c - 1] if len(row) >= c else "") for row in self.rows]
+        while out and out[-1] == "":
+            out.pop()
+        return out
+
+    def get_range(self, cells: str):
+        a, _, b = cells.partition(":")
+        r0, c0 = parse_a1(a)
+        r1, c1 = parse_a1(b) if b else (r0, c0)
+        r0 = r0 or 1; c0 = c0 or 1
+        r1 = min(r1 or len(self.rows), len(self.rows))
+        c1 = c1 or max((len(r) for r in self.rows), default=0)
+        out = []
+        for r in range(r0, r1 + 1):
+            row = self.rows[r - 1]
+            out.append([row[c - 1] if len(row) >= c else "" for c in range(c0, c1 + 1)])
+        while out and not any(out[-1]):
+            out.pop()
+        return out
+
+    # --- scritture ---
+    def _set(self, r: int, c: int, v):
+        while len(self.rows) < r:
+            self.rows.append([])
+        row = self.rows[r - 1]
+        if len(row) < c:
+            row.extend([""] * (c - len(row)))
+        row[c - 1] = "" if v is None else str(v)
+
+    def write_block(self, cells: str, values):
+        r0, c0 = parse_a1(cells.partition(":")[0])
+        for i, vals in enumerate(values):
+            for j, v in enumerate(vals):
+                self._set((r0 or 1) + i, (c0 or 1) + j, v)
+
+    def update_cell(self, r: int, c: int, v):
+        self._set(r, c, v)
+
+    def update(self, cells, values=None, value_input_option=None, **kwargs):
+        self.write_block(cells, values)
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        first = len(self.rows) + 1
+        for vals in values:
+            self.rows.append(["" if v is None else str(v) for v in vals])
+        last = len(self.rows)
+        width = max((len(v) for v in values), default=1)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{_idx_to_col(width)}{last}"}}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        return self.append_rows([values], value_input_option)
+
+    def delete_rows(self, start: int, end: int):
+        del self.rows[start - 1:end]
+
+
+def _idx_to_col(n: int) -> str:
+    s = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        s = chr(65 + rem) + s
+    return s
+
+
+class MemSpreadsheet:
+    def __init__(self, title: str = "REPLAY"):
+        self.title = title
+        self._sheets: List[MemWorksheet] = []
+
+    def add_worksheet(self, title: str, rows: int = 0, cols: int = 0, header=None):
+        ws = MemWorksheet(self, title, len(self._sheets), header)
+        self._sheets.append(ws)
+        return ws
+
+    def worksheet(self, title: str):
+        for ws in self._sheets:
+            if ws.title == title:
+                return ws
+        raise gspread.WorksheetNotFound(title)
+
+    def worksheets(self):
+        return list(self._sheets)
+
+    def del_worksheet(self, ws):
+        self._sheets.remove(ws)
+
+    def _target(self, rng: str):
+        title, cells = split_range(rng)
+        # come l'API reale: senza nome tab si scrive sul primo foglio
+        return (self.worksheet(title) if title else self._sheets[0]), cells
+
+    def values_get(self, rng: str, params=None):
+        ws, cells = self._target(rng)
+        return {"range": rng, "values": ws.get_range(cells)}
+
+    def values_batch_update(self, body):
+        for item in body.get("data", []):
+            ws, cells = self._target(item["range"])
+            ws.write_block(cells, item["values"])
+        return {"totalUpdatedCells": sum(len(i["values"]) for i in body.get("data", []))}
+
+    def values_append(self, rng: str, params=None, body=None):
+        ws, _ = self._target(rng)
+        return ws.append_rows(body["values"])
+
+    def batch_update(self, body):
+        for req in body.get("requests", []):
+            dd = req.get("deleteDimension")
+            if dd and dd["range"]["dimension"] == "ROWS":
+                ws = next(w for w in self._sheets if w.id == dd["range"]["sheetId"])
+                ws.delete_rows(dd["range"]["startIndex"] + 1, dd["range"]["endIndex"])
+        return {}
+
+
+# ------------------ Sorgente prezzo ------------------
+class ReplayPriceClient:
+    """Stand-in di binance.Client: get_symbol_ticker restituisce il prezzo corrente della serie."""
+
+    def __init__(self):
+        self.price = Decimal("0")
+
+    def get_symbol_ticker(self, symbol: str):
+        return {"symbol": symbol, "price": str(self.price)}
+
+
+# ------------------ Serie prezzi ------------------
+def load_price_csv(path: str) -> List[Tuple[float, Decimal]]:
+    out = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2:
+                continue
+            try:
+                ts = float(row[0]); px = Decimal(row[1].strip())
+            except Exception:
+                continue  # header o righe sporche
+            out.append((ts / 1000.0 if ts > 1e11 else ts, px))
+    return out
+
+def load_tick_files(paths: List[str]) -> List[Tuple[float, Decimal]]:
+    """File .ticks del recorder -> serie (ts, prezzo), solo letture Binance effettive."""
+    from tick_recorder import load_ticks, SOURCES
+    out = []
+    for p in sorted(paths):
+        arr = load_ticks(p)
+        arr = arr[arr["source"] == SOURCES["live"]]
+        out.extend((float(ts), Decimal(repr(float(px)))) for ts, px in zip(arr["ts"], arr["price"]))
+    return out
+
+def klines_to_ticks(candles, interval_sec: float, ohlc_path: bool = True) -> List[Tuple[float, Decimal]]:
+    """
+    Candele -> tick. Con ohlc_path ogni candela produce O, estremo vicino, estremo lontano, C
+    distribuiti nell'intervallo (low prima di high se la candela è rialzista), così TP/SL
+    intra-barra vengono toccati come nel live.
+    """
+    out = []
+    for c in candles:
+        t0 = c["ts"] / 1000.0
+        if not ohlc_path:
+            out.append((t0 + interval_sec, Decimal(str(c["close"]))))
+            continue
+        mid = (c["low"], c["high"]) if c["close"] >= c["open"] else (c["high"], c["low"])
+        path = (c["open"], mid[0], mid[1], c["close"])
+        for k, px in enumerate(path):
+            out.append((t0 + interval_sec * k / 4.0, Decimal(str(px))))
+    return out
+
+
+# ------------------ Driver ------------------
+_STATE_RESET = {
+    "_LAST_HEADER_SIG": None, "_LAST_HEARTBEAT_TS": 0, "_LAST_HEARTBEAT_PRICE": None,
+    "_LAST_RECONCILE_TS": 0, "_LAST_ARCHIVE_TS": 0, "_LAST_MISS_LOG_TS": 0,
+    "_H_CACHE": None, "_COL_PING_CACHE": None, "_LAST_TRADE_TS": {}, "_LAST_ENTRY_PRICE": {},
+    "_PRICE_CACHE": None, "_PRICE_CACHE_TS": 0.0, "_BINANCE_BANNED_UNTIL": 0.0,
+    "TICK_RECORD_DIR": "", "_TICK_REC": {}, "TRADE_ID_STATE": "", "_TRADE_IDS": None, "_TRADE_INDEX": {},
+    "HEARTBEAT_STATE": "", "_HEARTBEAT": None, "PERF_STATE": "", "_PERF": None, "_SUMMARY_WS": None,
+    "_OCO": None, "_GC": None, "_ARCHIVE_WS": {}, "SHEET_SHARDS": "", "_SHARDS": None, "_HOME_WS": None,
+    "SPOOL_PATH": "", "_SPOOL": None, "_LOG_ACTIVE": None, "_LOG_ACTIVE_KEY": None, "_LOG_PREV": None,
+    "_STATUS_WS": {}, "_CHECKSUM_ROW": {}, "_CHECKSUM_SEEN": {}, "_CHECKSUM_PENDING": set(), "_LAST_FULL_RECONCILE": {},
+}
+
+def run_replay(ticks: Iterable[Tuple[float, Decimal]],
+               step_seconds: Optional[float] = None,
+               overrides: Optional[dict] = None) -> dict:
+    """
+    Esegue bot_startup + run_cycle sulla serie.
+    - step_seconds=None: un giro per tick (l'orologio salta al ts del tick)
+    - step_seconds=N:    un giro ogni N secondi virtuali (come il live con POLL_SECONDS),
+                         il prezzo è l'ultimo tick con ts <= orologio
+    """
+    ticks = list(ticks)
+    if not ticks:
+        raise RuntimeError("Serie prezzi vuota.")
+
+    saved = {k: getattr(bot_oro, k) for k in list(_STATE_RESET) + ["_CLOCK", "_NOTIFY_SINK", "binance_client"]}
+    saved.update({k: getattr(bot_oro, k) for k in (overrides or {})})
+    saved["_LOG_LAST_ROW"] = dict(bot_oro._LOG_LAST_ROW)
+
+    clock = VirtualClock(ticks[0][0])
+    if (overrides or {}).get("EXECUTION_MODE", bot_oro.EXECUTION_MODE) == "oco":
+        from oco_execution import FakeExchange
+        client = FakeExchange(bot_oro.SYMBOL)
+    else:
+        client = ReplayPriceClient()
+    notifications: List[str] = []
+
+    sh = MemSpreadsheet()
+    ws_trade = sh.add_worksheet(bot_oro.SHEET_TAB_TRADE, header=DEFAULT_TRADE_HEADER)
+    ws_log = sh.add_worksheet(bot_oro.SHEET_TAB_LOG, header=DEFAULT_LOG_HEADER)
+
+    try:
+        for k, v in _STATE_RESET.items():
+            setattr(bot_oro, k, v.copy() if isinstance(v, (dict, set)) else v)
+        bot_oro._LOG_LAST_ROW.clear()
+        for k, v in (overrides or {}).items():
+            setattr(bot_oro, k, v)
+        bot_oro._CLOCK = clock.time
+        bot_oro._NOTIFY_SINK = notifications.append
+        bot_oro.binance_client = lambda: client
+
+        client.price = ticks[0][1]
+        bot_oro.bot_startup(ws_trade, ws_log, client)
+
+        cycles = 0
+        if step_seconds is None:
+            for ts, px in ticks:
+                clock.set(ts)
+                client.price = px
+                bot_oro.run_cycle(ws_trade, ws_log, client)
+                cycles += 1
+        else:
+            i, end = 0, ticks[-1][0]
+            while clock.now <= end:
+                while i + 1 < len(ticks) and ticks[i + 1][0] <= clock.now:
+                    i += 1
+                client.price = ticks[i][1]
+                wait = bot_oro.run_cycle(ws_trade, ws_log, client)
+                clock.sleep(max(step_seconds, wait))
+                cycles += 1
+    finally:
+        for k, v in saved.items():
+            if k == "_LOG_LAST_ROW":
+                bot_oro._LOG_LAST_ROW.clear(); bot_oro._LOG_LAST_ROW.update(v)
+            else:
+                setattr(bot_oro, k, v)
+
+    return {
+        "summary": summarize(ws_trade, cycles, len(notifications)),
+        "trade_rows": ws_trade.get_all_values(),
+        "log_rows": ws_log.get_all_values(),
+        "notifications": notifications,
+    }
+
+
+def summarize(ws_trade, cycles: int, n_notifications: int) -> dict:
+    H = bot_oro.build_header_map(ws_trade.row_values(1))
+    def cell(row, key):
+        i = H.get(key)
+        return (row[i - 1] if i and len(row) >= i else "").strip()
+
+    rows = [r for r in ws_trade.get_all_values()[1:] if cell(r, "prezzo ingresso")]
+
+    closed = [r for r in rows if cell(r, "stato").upper() == "CHIUSO"]
+    by_reason = {}
+    pnl = Decimal("0")
+    wins = 0
+    for r in closed:
+        reason = cell(r, "note") or "?"
+        by_reason[reason] = by_reason.get(reason, 0) + 1
+        raw = cell(r, "p&l valore")
+        v = bot_oro.d(raw) * (-1 if raw.startswith("-") else 1)  # d() scarta il segno
+        pnl += v
+        wins += 1 if v >= 0 else 0
+    equity = bot_oro.last_equity(ws_trade, H["equity post-trade"])
+    return {
+        "Cicli": cycles,
+        "Trade aperti": len(rows),
+        "Trade chiusi": len(closed),
+        "Ancora aperti": len(rows) - len(closed),
+        "Chiusure per motivo": by_reason,
+        "Win rate %": round(wins / len(closed) * 100, 2) if closed else 0.0,
+        "PNL chiuso": bot_oro.fmt_dec(pnl, "0.01"),
+        "Equity finale": bot_oro.fmt_dec(equity, "0.01"),
+        "Notifiche": n_notifications,
+    }
+
+
+# ------------------ Main ------------------
+def _parse_override(s: str):
+    name, _, raw = s.partition("=")
+    name = name.strip()
+    if not hasattr(bot_oro, name):
+        raise SystemExit(f"Parametro sconosciuto: {name}")
+    cur = getattr(bot_oro, name)
+    if isinstance(cur, bool):
+        return name, raw.strip() in ("1", "true", "True")
+    if isinstance(cur, Decimal):
+        return name, Decimal(raw)
+    if isinstance(cur, int):
+        return name, int(raw)
+    return name, raw
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay del loop live di bot_oro su una serie di prezzi.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--csv", help="file ts,price")
+    src.add_argument("--ticks", nargs="+", metavar="FILE")
+    src.add_argument("--klines", nargs=3, metavar=("SYMBOL", "TF", "DAYS"))
+    ap.add_argument("--step", type=float, default=None,
+                    help="secondi virtuali tra i giri (default: un giro per tick)")
+    ap.add_argument("--close-only", action="store_true", help="con --klines usa solo il close")
+    ap.add_argument("--set", action="append", default=[], metavar="NOME=VALORE")
+    ap.add_argument("--out", help="salva la tab Trade finale in CSV")
+    args = ap.parse_args(argv)
+
+    if args.csv:
+        ticks = load_price_csv(args.csv)
+    elif args.ticks:
+        ticks = load_tick_files(args.ticks)
+    else:
+        from backtest_bot_oro import load_klines
+        symbol, tf, days = args.klines
+        candles = load_klines(symbol, tf, int(days))
+        unit = {"m": 60, "h": 3600, "d": 86400}[tf[-1]]
+        ticks = klines_to_ticks(candles, int(tf[:-1]) * unit, ohlc_path=not args.close_only)
+
+    overrides = dict(_parse_override(s) for s in args.set)
+    print(f"[INFO] Replay su {len(ticks)} tick…")
+    res = run_replay(ticks, step_seconds=args.step, overrides=overrides)
+
+    print("\n=== Replay ===")
+    for k, v in res["summary"].items():
+        print(f"- {k}: {v}")
+
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            csv.writer(f).writerows(res["trade_rows"])
+        print(f"[OK] Tab Trade salvata in {args.out}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
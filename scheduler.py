@@ -0,0 +1,167 @@
+# scheduler.py
+"""
+Scheduler a heap di timer per i worker che girano a lungo (bot_oro_test.py)
+- every(): ogni N secondi; cron(): orari fissi (ore/minuto, opzionale giorno della settimana), ora locale
+- Un solo heapq (prossima esecuzione, seq, job): run_pending() esegue i job scaduti in ordine,
+  sleep_until_next() dorme esattamente fino al prossimo, senza polling
+- Recupero degli slot persi: se il processo era fermo (o un job ha sforato) gli slot cron saltati
+  si eseguono una volta sola al risveglio (catch_up="once", con il numero di slot persi) oppure
+  uno per slot (catch_up="all"). L'ultima esecuzione per job è salvata su file: il recupero vale
+  anche dopo un riavvio
+Variabili opzionali:
+  SCHEDULER_STATE   (default .scheduler.json)   vuoto = nessuna persistenza
+"""
+import os
+import json
+import time
+import heapq
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+
+SCHEDULER_STATE = os.getenv("SCHEDULER_STATE", ".scheduler.json")
+
+
+class Job:
+    def __init__(self, name: str, fn: Callable, interval: Optional[float] = None,
+                 hours: Sequence[int] = (), minute: int = 0, weekday: Optional[int] = None,
+                 catch_up: str = "once"):
+        self.name, self.fn = name, fn
+        self.interval = interval
+        self.hours, self.minute, self.weekday = sorted(hours), minute, weekday
+        self.catch_up = catch_up
+        self.last_run: Optional[datetime] = None
+
+    def next_slot(self, after: datetime) -> datetime:
+        """Primo slot strettamente dopo `after`."""
+        if self.interval is not None:
+            return after + timedelta(seconds=self.interval)
+        day = after.replace(hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(8):
+            if self.weekday is None or day.weekday() == self.weekday:
+                for h in self.hours:
+                    slot = day.replace(hour=h, minute=self.minute)
+                    if slot > after:
+                        return slot
+            day += timedelta(days=1)
+        raise ValueError(f"Job {self.name}: nessuno slot (ore {self.hours}, giorno {self.weekday})")
+
+    def missed_slots(self, since: datetime, now: datetime) -> List[datetime]:
+        out, t = [], since
+        while True:
+            t = self.next_slot(t)
+            if t > now:
+                return out
+            out.append(t)
+
+
+class Scheduler:
+    def __init__(self, state_path: str = SCHEDULER_STATE, clock: Callable[[], datetime] = datetime.now,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List = []
+        self._seq = 0
+        self.state_path = state_path
+        self.clock, self.sleep = clock, sleep
+        self._saved = self._load()
+
+    # --- stato su disco ---
+    def _load(self) -> Dict[str, str]:
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"[WARN] Stato scheduler illeggibile ({self.state_path}): {e}")
+            return {}
+
+    def _save(self):
+        if not self.state_path:
+            return
+        data = {n: j.last_run.isoformat() for n, j in self.jobs.items() if j.last_run is not None}
+        try:
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.state_path)
+        except Exception as e:
+            print(f"[WARN] Salvataggio stato scheduler fallito: {e}")
+
+    # --- registrazione ---
+    def _push(self, when: datetime, job: Job):
+        self._seq += 1
+        heapq.heappush(self._heap, (when, self._seq, job))
+
+    def _add(self, job: Job, run_now: bool = False) -> Job:
+        now = self.clock()
+        self.jobs[job.name] = job
+        saved = self._saved.get(job.name)
+        if saved:
+            job.last_run = datetime.fromisoformat(saved)
+        if run_now:
+            when = now
+        elif job.last_run is not None:
+            # dall'ultima esecuzione salvata: se lo slot è già passato (processo fermo) il job è subito dovuto
+            when = job.next_slot(job.last_run)
+        else:
+            when = job.next_slot(now)
+        self._push(when, job)
+        return job
+
+    def every(self, name: str, seconds: float, fn: Callable, run_now: bool = False) -> Job:
+        return self._add(Job(name, fn, interval=seconds), run_now=run_now)
+
+    def cron(self, name: str, fn: Callable, hours: Sequence[int], minute: int = 0,
+             weekday: Optional[int] = None, catch_up: str = "once") -> Job:
+        return self._add(Job(name, fn, hours=hours, minute=minute, weekday=weekday, catch_up=catch_up))
+
+    # --- esecuzione ---
+    def next_due(self) -> Optional[datetime]:
+        return self._heap[0][0] if self._heap else None
+
+    def run_pending(self) -> int:
+        """Esegue i job scaduti; ritorna quante esecuzioni ha fatto."""
+        ran = 0
+        while self._heap and self._heap[0][0] <= self.clock():
+            when, _, job = heapq.heappop(self._heap)
+            now = self.clock()
+            if job.interval is not None:
+                runs = [(when, 0)]
+            else:
+                since = job.last_run or (when - timedelta(microseconds=1))
+                slots = job.missed_slots(since, now) or [when]
+                if job.catch_up == "all":
+                    runs = [(s, 0) for s in slots]
+                else:
+                    runs = [(slots[-1], len(slots) - 1)]
+            for slot, missed in runs:
+                try:
+                    if job.interval is None:
+                        job.fn(slot=slot, missed=missed)
+                    else:
+                        job.fn()
+                except Exception as e:
+                    print(f"[ERRORE] Job {job.name}: {e}")
+                job.last_run = slot if job.interval is None else self.clock()
+                ran += 1
+            self._save()
+            # se nel frattempo è passato un altro slot, il job torna subito in testa (recupero al giro dopo)
+            self._push(job.next_slot(job.last_run), job)
+        return ran
+
+    def sleep_until_next(self, max_seconds: Optional[float] = None):
+        due = self.next_due()
+        if due is None:
+            return
+        wait = (due - self.clock()).total_seconds()
+        if max_seconds is not None:
+            wait = min(wait, max_seconds)
+        if wait > 0:
+            self.sleep(wait)
+
+    def run_forever(self):
+        while True:
+            self.run_pending()
+            self.sleep_until_next()
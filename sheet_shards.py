@@ -0,0 +1,134 @@
+# sheet_shards.py
+"""
+Sharding dei fogli Google su più file (e più service account) per superare le quote per file/progetto.
+- Configurazione in SHEET_SHARDS (JSON), una voce per file:
+    [{"name": "a", "spreadsheet_id": "...", "credentials": "GOOGLE_CREDENTIALS_A",
+      "roles": ["trade", "log"], "symbols": ["PAXGUSDT"]},
+     {"name": "b", "spreadsheet_id": "...", "roles": ["trade"]},
+     {"name": "arch", "spreadsheet_id": "...", "credentials": "GOOGLE_CREDENTIALS_B", "roles": ["archive"]}]
+  credentials = nome della variabile d'ambiente con il JSON del service account (default GOOGLE_CREDENTIALS);
+  roles default ["trade"]
+- Instradamento: tab Trade per simbolo (symbols espliciti, altrimenti hash stabile del simbolo sugli shard
+  "trade" senza symbols), Log sul primo shard "log" (altrimenti quello del simbolo principale), archivio
+  per mese (hash del mese sugli shard "archive"; nessuno = archivio come prima)
+- ShardPool: un client autorizzato per credenziale e un solo Spreadsheet aperto per file, condivisi tra i thread;
+  parallel() esegue le scritture dei diversi file in contemporanea
+- Per crescere basta aggiungere file alla lista: gli shard con symbols espliciti non si spostano
+Variabili opzionali:
+  SHEET_SHARDS          (default vuoto)   vuoto = un solo file (SPREADSHEET_ID)
+  SHEET_SHARD_WORKERS   (default 4)       thread per le scritture in parallelo
+"""
+import os
+import json
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+SHEET_SHARDS = os.getenv("SHEET_SHARDS", "")
+SHEET_SHARD_WORKERS = int(os.getenv("SHEET_SHARD_WORKERS", "4"))
+
+
+class Shard:
+    def __init__(self, name: str, spreadsheet_id: str, credentials: str = "GOOGLE_CREDENTIALS",
+                 roles=("trade",), symbols=()):
+        if not spreadsheet_id:
+            raise ValueError(f"Shard '{name}': spreadsheet_id mancante")
+        self.name = name
+        self.spreadsheet_id = spreadsheet_id
+        self.credentials = credentials
+        self.roles = tuple(r.lower() for r in roles)
+        self.symbols = tuple(s.upper() for s in symbols)
+
+    def __repr__(self):
+        return f"Shard({self.name}, roles={','.join(self.roles)})"
+
+
+def _stable_pick(items: List[Shard], key: str) -> Shard:
+    # crc32 e non hash(): lo stesso simbolo/mese finisce sempre sullo stesso file, anche tra processi
+    return items[zlib.crc32(key.encode("utf-8")) % len(items)]
+
+
+class ShardRouter:
+    def __init__(self, shards: List[Shard]):
+        if not shards:
+            raise ValueError("SHEET_SHARDS: nessuno shard configurato")
+        self.shards = shards
+        self._trade = [s for s in shards if "trade" in s.roles]
+        if not self._trade:
+            raise ValueError("SHEET_SHARDS: serve almeno uno shard con ruolo 'trade'")
+        self._hashed = [s for s in self._trade if not s.symbols] or self._trade
+        self._archive = [s for s in shards if "archive" in s.roles]
+
+    @classmethod
+    def from_config(cls, text: str) -> "ShardRouter":
+        data = json.loads(text)
+        return cls([Shard(str(d.get("name") or i), d.get("spreadsheet_id", ""),
+                          d.get("credentials") or "GOOGLE_CREDENTIALS",
+                          d.get("roles") or ("trade",), d.get("symbols") or ())
+                    for i, d in enumerate(data)])
+
+    def trade_shard(self, symbol: str) -> Shard:
+        symbol = symbol.upper()
+        for s in self._trade:
+            if symbol in s.symbols:
+                return s
+        return _stable_pick(self._hashed, symbol)
+
+    def log_shard(self, main_symbol: str) -> Shard:
+        return next((s for s in self.shards if "log" in s.roles), None) or self.trade_shard(main_symbol)
+
+    def archive_shard(self, month: str) -> Optional[Shard]:
+        """month 'YYYY-MM'; None se non ci sono shard di archivio."""
+        return _stable_pick(self._archive, month) if self._archive else None
+
+
+class ShardPool:
+    """Client gspread per credenziale e Spreadsheet per file, creati al primo uso."""
+
+    def __init__(self, router: ShardRouter, authorize: Callable[[str], object]):
+        self.router = router
+        self.authorize = authorize   # JSON del service account -> client gspread
+        self._clients: Dict[str, object] = {}
+        self._sheets: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def client(self, shard: Shard):
+        with self._lock:
+            gc = self._clients.get(shard.credentials)
+            if gc is None:
+                creds = os.getenv(shard.credentials)
+                if not creds:
+                    raise RuntimeError(f"Shard '{shard.name}': variabile {shard.credentials} mancante")
+                gc = self._clients[shard.credentials] = self.authorize(creds)
+            return gc
+
+    def spreadsheet(self, shard: Shard):
+        with self._lock:
+            sh = self._sheets.get(shard.spreadsheet_id)
+        if sh is None:
+            sh = self.client(shard).open_by_key(shard.spreadsheet_id)
+            with self._lock:
+                sh = self._sheets.setdefault(shard.spreadsheet_id, sh)
+        return sh
+
+    def parallel(self, calls: List[Callable]) -> List:
+        """Esegue le chiamate (una per file) in parallelo; se una fallisce la prima eccezione risale dopo le altre."""
+        if len(calls) <= 1:
+            return [c() for c in calls]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(1, SHEET_SHARD_WORKERS),
+                                                    thread_name_prefix="sheet-shard")
+        futures = [self._executor.submit(c) for c in calls]
+        results, error = [], None
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                results.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return results
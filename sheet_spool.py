@@ -0,0 +1,261 @@
+# sheet_spool.py
+"""
+Spool locale delle scritture Google Sheets: nessuna scrittura persa se Sheets non risponde.
+- Journal append-only JSONL: ogni mutazione (values_batch_update o append di righe) è scritta su disco
+  PRIMA della chiamata di rete, poi marcata come fatta ({"done": [...]}) quando Sheets conferma
+- Dopo un errore le mutazioni restano in coda e si rimandano, nello stesso ordine e per file, alla prossima
+  scrittura verso lo stesso file (o con replay()); anche dopo un riavvio, rileggendo il journal
+- In replay i batch in coda si fondono in una sola chiamata (per range vince l'ultimo valore); gli append
+  della stessa tab in un solo values_append
+- Idempotenza: i batch scrivono celle assolute (ripeterli è innocuo); gli append portano la chiave della
+  mutazione in una colonna in coda alla riga e, prima di rimandarli, si controlla che la chiave non ci sia già
+- Circuit breaker: dopo SPOOL_BREAKER_FAILURES errori di fila niente chiamate per SPOOL_BREAKER_SECONDS
+  (raddoppia a ogni nuovo errore, fino a SPOOL_BREAKER_MAX_SECONDS); le scritture intanto vanno solo nel journal
+- Errori 4xx (tranne 408/429) non si riprovano: la mutazione è scartata con un messaggio, la coda non si blocca
+Variabili opzionali:
+  SPOOL_PATH                (default ".sheet_spool.jsonl")  vuoto = niente journal, scritture dirette
+  SPOOL_FSYNC               (default 1)        fsync del journal a ogni mutazione (non sui record "done":
+                                               se si perdono, al riavvio la mutazione si rimanda, innocua)
+  SPOOL_REPLAY_BATCH        (default 200)      mutazioni fuse al massimo in una chiamata di replay
+  SPOOL_COMPACT_BYTES       (default 1000000)  oltre questa dimensione il journal si compatta
+  SPOOL_BREAKER_FAILURES    (default 3)
+  SPOOL_BREAKER_SECONDS     (default 30)
+  SPOOL_BREAKER_MAX_SECONDS (default 600)
+"""
+import os
+import json
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "1") == "1"
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "200"))
+SPOOL_COMPACT_BYTES = int(os.getenv("SPOOL_COMPACT_BYTES", "1000000"))
+SPOOL_BREAKER_FAILURES = int(os.getenv("SPOOL_BREAKER_FAILURES", "3"))
+SPOOL_BREAKER_SECONDS = float(os.getenv("SPOOL_BREAKER_SECONDS", "30"))
+SPOOL_BREAKER_MAX_SECONDS = float(os.getenv("SPOOL_BREAKER_MAX_SECONDS", "600"))
+
+APPEND_PARAMS = {"valueInputOption": "USER_ENTERED", "insertDataOption": "INSERT_ROWS"}
+
+
+class CircuitBreaker:
+    """Aperto dopo `threshold` errori di fila; dopo il cooldown passa una chiamata di prova (semi-aperto)."""
+
+    def __init__(self, threshold: int = SPOOL_BREAKER_FAILURES, cooldown: float = SPOOL_BREAKER_SECONDS,
+                 max_cooldown: float = SPOOL_BREAKER_MAX_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.threshold, self.base, self.max_cooldown = max(1, threshold), cooldown, max_cooldown
+        self.clock = clock
+        self.failures = 0
+        self.cooldown = cooldown
+        self.open_until = 0.0
+
+    def allow(self) -> bool:
+        return self.clock() >= self.open_until
+
+    def success(self):
+        self.failures = 0
+        self.cooldown = self.base
+        self.open_until = 0.0
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = self.clock() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+
+
+def retryable(e: Exception) -> bool:
+    """Rete, timeout, 5xx, 408/429: si riprova. Altri 4xx (range o richiesta non validi): no."""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (408, 429))
+
+
+def _merge_batches(entries: List[dict]) -> List[dict]:
+    # stesso range scritto più volte: resta l'ultimo valore, nella posizione dell'ultima scrittura
+    last = {}
+    for i, e in enumerate(entries):
+        for j, u in enumerate(e["data"]):
+            last[u["range"]] = (i, j, u)
+    return [u for _, _, u in sorted(last.values(), key=lambda x: (x[0], x[1]))]
+
+
+class SheetSpool:
+    def __init__(self, path: str, breaker: Optional[CircuitBreaker] = None):
+        self.path = path
+        self.breaker = breaker or CircuitBreaker()
+        self.pending: List[dict] = []
+        self._sheets: Dict[str, object] = {}        # chiave file -> Spreadsheet (per il replay)
+        self._attempted = set()                     # chiavi già tentate (append: controllo duplicati)
+        self._lock = threading.Lock()               # journal e coda
+        self._sheet_locks: Dict[str, threading.Lock] = {}
+        self._seq = 0
+        self._base_size = 0                         # dimensione del journal dopo l'ultima compattazione
+        self._prefix = f"{int(time.time() * 1000):x}"
+        self._load()
+
+    # --- journal ---
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        entries, done = {}, set()
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue   # riga troncata da un crash a metà scrittura
+            if "done" in rec:
+                done.update(rec["done"])
+            else:
+                entries[rec["k"]] = rec
+        self.pending = [e for k, e in entries.items() if k not in done]
+        self._attempted = {e["k"] for e in self.pending}   # esito ignoto: gli append vanno verificati
+        if self.pending:
+            print(f"[SPOOL] {len(self.pending)} scritture in coda dal journal ({self.path})")
+        self._rewrite()
+
+    def _write(self, recs: List[dict], sync: bool = True):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for rec in recs:
+                f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+            f.flush()
+            if sync and SPOOL_FSYNC:
+                os.fsync(f.fileno())
+
+    def _rewrite(self):
+        """Journal con le sole mutazioni in coda (scrittura atomica)."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in self.pending:
+                f.write(json.dumps(e, separators=(",", ":")) + "\n")
+            f.flush()
+            if SPOOL_FSYNC:
+                os.fsync(f.fileno())
+            self._base_size = f.tell()
+        os.replace(tmp, self.path)
+
+    def _add(self, sheet, rec: dict) -> dict:
+        key = self.sheet_key(sheet)
+        with self._lock:
+            self._seq += 1
+            rec = {"k": f"{self._prefix}-{self._seq}", "s": key, **rec}
+            self._sheets[key] = sheet
+            self._write([rec])
+            self.pending.append(rec)
+        return rec
+
+    def _done(self, keys: List[str]):
+        with self._lock:
+            gone = set(keys)
+            self.pending = [e for e in self.pending if e["k"] not in gone]
+            self._attempted -= gone
+            self._write([{"done": keys}], sync=False)
+            try:
+                # costo ammortizzato: si riscrive solo quando il journal è raddoppiato dall'ultima volta
+                if os.path.getsize(self.path) > max(SPOOL_COMPACT_BYTES, 2 * self._base_size):
+                    self._rewrite()
+            except OSError as e:
+                print(f"[SPOOL] compattazione journal fallita: {e}")
+
+    @staticmethod
+    def sheet_key(sheet) -> str:
+        return str(getattr(sheet, "id", None) or id(sheet))
+
+    # --- API ---
+    def has_pending(self, sheet=None) -> bool:
+        with self._lock:
+            if sheet is None:
+                return bool(self.pending)
+            key = self.sheet_key(sheet)
+            return any(e["s"] == key for e in self.pending)
+
+    def attach(self, sheet):
+        """File (Spreadsheet) a cui rimandare le mutazioni rimaste nel journal da un processo precedente."""
+        with self._lock:
+            self._sheets[self.sheet_key(sheet)] = sheet
+
+    def batch_update(self, sheet, data: List[dict]) -> Tuple[bool, object]:
+        """values_batch_update via journal: (scritto ora, risposta); (False, None) se resta in coda."""
+        rec = self._add(sheet, {"op": "batch", "data": data})
+        return self._drain(rec["s"], rec["k"])
+
+    def append_rows(self, sheet, title: str, rows: List[List]) -> Tuple[bool, object]:
+        """Append di righe nella tab `title`, con la chiave di idempotenza come ultima colonna."""
+        rec = self._add(sheet, {"op": "append", "tab": title, "rows": rows})
+        return self._drain(rec["s"], rec["k"])
+
+    def replay(self) -> bool:
+        """Rimanda tutto il rimandabile; True se la coda è vuota."""
+        with self._lock:
+            keys = list(dict.fromkeys(e["s"] for e in self.pending))
+        for key in keys:
+            self._drain(key)
+        return not self.has_pending()
+
+    # --- invio ---
+    def _drain(self, key: str, want: Optional[str] = None) -> Tuple[bool, object]:
+        """
+        Manda in ordine la coda del file `key` finché il breaker lo consente.
+        Ritorna (mutazione `want` scritta, risposta della chiamata che l'ha scritta).
+        """
+        with self._lock:
+            lock = self._sheet_locks.setdefault(key, threading.Lock())
+        written, resp_want = False, None
+        with lock:
+            while self.breaker.allow():
+                with self._lock:
+                    queue = [e for e in self.pending if e["s"] == key]
+                    sheet = self._sheets.get(key)
+                if not queue or sheet is None:
+                    break   # sheet None: file non ancora riaperto dopo un riavvio, si riprova quando torna in uso
+                # batch tra loro e append della stessa tab tra loro restano in ordine; i due tipi non si
+                # toccano (tab diverse), quindi si fondono anche scavalcando le mutazioni dell'altro tipo
+                head = queue[0]
+                group = [e for e in queue if e["op"] == head["op"] and e.get("tab") == head.get("tab")]
+                group = group[:SPOOL_REPLAY_BATCH]
+                keys = [e["k"] for e in group]
+                try:
+                    resp = self._send(sheet, group)
+                except Exception as ex:
+                    if retryable(ex):
+                        self.breaker.failure()
+                        self._attempted.update(keys)
+                        print(f"[SPOOL] scrittura in coda ({len(queue)} in attesa): {ex}")
+                        break
+                    print(f"[SPOOL] scrittura scartata (errore non recuperabile): {ex}")
+                    resp = None
+                self.breaker.success()
+                self._done(keys)
+                if want in keys:
+                    written, resp_want = True, resp
+        return written, resp_want
+
+    def _send(self, sheet, group: List[dict]):
+        if group[0]["op"] == "batch":
+            return sheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": _merge_batches(group)})
+        title = group[0]["tab"]
+        rng = f"'{title.replace(chr(39), chr(39) * 2)}'"
+        width = max(len(r) for e in group for r in e["rows"])
+        if any(e["k"] in self._attempted for e in group):
+            group = self._not_yet_appended(sheet, rng, group, width + 1)
+            if not group:
+                return None
+        rows = [list(r) + [""] * (width - len(r)) + [e["k"]] for e in group for r in e["rows"]]
+        return sheet.values_append(f"{rng}!A1", params=APPEND_PARAMS, body={"values": rows})
+
+    def _not_yet_appended(self, sheet, rng: str, group: List[dict], key_col: int) -> List[dict]:
+        """Un append fallito può essere arrivato lo stesso (timeout): fuori quelli con la chiave già nella tab."""
+        col = _col_letters(key_col)
+        got = sheet.values_get(f"{rng}!{col}:{col}").get("values") or []
+        present = {row[0] for row in got if row}
+        return [e for e in group if e["k"] not in present]
+
+
+def _col_letters(col: int) -> str:
+    s = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        s = chr(65 + rem) + s
+    return s
@@ -0,0 +1,128 @@
+# strategy_core.py
+"""
+Regole di uscita TP/SL in un solo posto, in numpy e a lotti: tutte le posizioni in una chiamata.
+Usato dal bot live (bot_oro.check_hits, pipeline) e dal backtest (backtest_bot_oro).
+- targets / pnl: livelli TP1/TP2/SL e P&L (stesse formule di bot_oro.compute_targets / pnl_values)
+- ladder: regola live. Scala TP2, poi TP1, poi SL con tolleranza in bp, chiusura totale al livello,
+  con il P&L della chiusura. Con un prezzo: esito per posizione. Con un percorso di prezzi: primo
+  trigger per posizione (il backtest valuta così una posizione su tutto un blocco di barre)
+- partial_exits: regola del backtest. TP1 chiude una frazione, poi SL o TP2 sul restante, al prezzo
+  della barra, con fee taker e quantità al passo LOT_SIZE
+Il live lavora in Decimal: ladder restituisce anche le posizioni "al filo" di un livello (entro
+NEAR_REL), che il chiamante ricontrolla in Decimal per avere esattamente l'esito di prima.
+"""
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+HIT_NONE, HIT_TP1, HIT_TP2, HIT_SL = 0, 1, 2, 3
+HIT_NAMES = {HIT_TP1: "TP1", HIT_TP2: "TP2", HIT_SL: "SL"}
+
+NEAR_REL = 1e-9   # ben sopra l'errore float su prezzi ~1e3-1e5, ben sotto un tick
+
+ArrayLike = Union[float, np.ndarray]
+
+
+def round_step(value: ArrayLike, step: float) -> ArrayLike:
+    """Per difetto al passo (piccolo margine: 0.3/0.1 in float fa 2.9999999999999996)."""
+    if step <= 0:
+        return value
+    return np.floor(np.asarray(value) / step + 1e-9) * step
+
+
+def targets(entry: np.ndarray, tp1_pct: float, tp2_pct: float, sl_pct: float):
+    """Livelli dall'entry (come compute_targets: TP sopra e SL sotto l'entry per entrambi i lati)."""
+    return entry * (1 + tp1_pct), entry * (1 + tp2_pct), entry * (1 - sl_pct)
+
+
+def pnl(is_long: np.ndarray, entry: np.ndarray, close: np.ndarray, qty: np.ndarray):
+    """(P&L %, P&L valore) per posizione; zero se qty, entry o close è 0 (o close NaN: nessuna chiusura)."""
+    ok = (qty != 0) & (entry != 0) & (close != 0) & ~np.isnan(close)
+    e = np.where(ok, entry, 1.0)
+    c = np.where(ok, close, 1.0)
+    pct = np.where(is_long, c / e - 1, e / c - 1) * 100
+    val = np.where(is_long, c - e, e - c) * qty
+    return np.where(ok, pct, 0.0), np.where(ok, val, 0.0)
+
+
+def _ladder_masks(is_long, t1, t2, sl, price, tol):
+    up, dn = 1 - tol, 1 + tol
+    hit2 = np.where(is_long, price >= t2 * up, price <= t2 * dn)
+    hit1 = np.where(is_long, price >= t1 * up, price <= t1 * dn)
+    hitsl = np.where(is_long, price <= sl * dn, price >= sl * up)
+    return hit2, hit1, hitsl
+
+
+def ladder(entry: np.ndarray, is_long: np.ndarray, price: ArrayLike,
+           tp1_pct: float, tp2_pct: float, sl_pct: float, tol_bp: float = 0.0,
+           qty: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Regola live su tutte le posizioni.
+    price scalare -> {"hit", "close", "near", "pnl_pct", "pnl_val"} per posizione (hit: HIT_*; close:
+    livello toccato; P&L della chiusura al livello con qty, 1 se None; 0 senza trigger).
+    price percorso (T,) -> in più "bar": primo indice del percorso con un trigger (-1 se nessuno).
+    """
+    entry = np.asarray(entry, dtype=float)
+    is_long = np.asarray(is_long, dtype=bool)
+    tol = tol_bp / 10000.0 if tol_bp > 0 else 0.0
+    t1, t2, sl = targets(entry, tp1_pct, tp2_pct, sl_pct)
+    levels = np.stack([np.zeros_like(entry), t1, t2, sl])   # indicizzato per HIT_*
+
+    p = np.asarray(price, dtype=float)
+    path = p.ndim == 1
+    if path and not len(p):   # percorso vuoto: nessun trigger
+        none = np.zeros(len(entry))
+        return {"bar": np.full(len(entry), -1), "hit": np.full(len(entry), HIT_NONE), "close": none + np.nan,
+                "pnl_pct": none, "pnl_val": none, "near": np.zeros(len(entry), dtype=bool)}
+    if path:   # posizioni x barre
+        hit2, hit1, hitsl = _ladder_masks(is_long[:, None], t1[:, None], t2[:, None], sl[:, None], p[None, :], tol)
+    else:
+        hit2, hit1, hitsl = _ladder_masks(is_long, t1, t2, sl, p, tol)
+    code = np.where(hit2, HIT_TP2, np.where(hit1, HIT_TP1, np.where(hitsl, HIT_SL, HIT_NONE)))
+
+    out = {}
+    if path:
+        anyhit = code != HIT_NONE
+        bar = np.where(anyhit.any(axis=1), anyhit.argmax(axis=1), -1)
+        code = np.where(bar >= 0, code[np.arange(len(entry)), np.maximum(bar, 0)], HIT_NONE)
+        p_at = np.where(bar >= 0, p[np.maximum(bar, 0)], np.nan)
+        out["bar"] = bar
+    else:
+        p_at = np.broadcast_to(p, entry.shape)
+    out["hit"] = code
+    out["close"] = np.where(code != HIT_NONE, levels[code, np.arange(len(entry))], np.nan)
+    q = np.ones_like(entry) if qty is None else np.asarray(qty, dtype=float)
+    out["pnl_pct"], out["pnl_val"] = pnl(is_long, entry, out["close"], q)
+    # al filo di una soglia: l'esito float potrebbe differire da quello in Decimal
+    thr = np.stack([t2 * (1 - tol), t2 * (1 + tol), t1 * (1 - tol), t1 * (1 + tol), sl * (1 - tol), sl * (1 + tol)])
+    out["near"] = (np.abs(p_at[None, :] - thr) <= NEAR_REL * thr).any(axis=0)
+    return out
+
+
+def partial_exits(entry: np.ndarray, tp1: np.ndarray, tp2: np.ndarray, sl: np.ndarray,
+                  took_tp1: np.ndarray, remaining: np.ndarray, price: float,
+                  tp1_partial: float, step: float, fee: float) -> Dict[str, np.ndarray]:
+    """
+    Regola del backtest (solo LONG) sulle posizioni aperte, a un prezzo di barra:
+    1) TP1 non ancora preso e price >= tp1: chiude tp1_partial del restante
+    2) poi SL (price <= sl) oppure TP2 (price >= tp2) sul restante
+    Ritorna maschere, quantità e PnL netti (fee taker su entrata+uscita) per ciascun passo.
+    """
+    tp1_q = np.where(~took_tp1 & (price >= tp1), round_step(remaining * tp1_partial, step), 0.0)
+    tp1_hit = tp1_q > 0
+    rem = remaining - tp1_q
+    final_q = round_step(rem, step)
+    sl_hit = (price <= sl) & (final_q > 0)
+    tp2_hit = ~sl_hit & (price >= tp2) & (final_q > 0)
+    final_hit = sl_hit | tp2_hit
+    final_q = np.where(final_hit, final_q, 0.0)
+
+    def net(q):
+        return q * (price - entry) - (entry + price) * q * fee
+
+    return {
+        "tp1_hit": tp1_hit, "tp1_qty": tp1_q, "tp1_pnl": net(tp1_q),
+        "sl_hit": sl_hit, "tp2_hit": tp2_hit, "final_qty": final_q, "final_pnl": net(final_q),
+        "remaining": np.where(final_hit, 0.0, rem),
+        "took_tp1": took_tp1 | tp1_hit,
+    }
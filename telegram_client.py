@@ -1,23 +1,24 @@
 import os
-import requests
 
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+from notification_bus import TelegramBackend, get_bus
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
 def send_telegram_message(text: str):
+    """Invio immediato sul solo canale Telegram, tramite il bus notifiche (diretto se il bus non ha Telegram)."""
     if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
         print("[TELEGRAM] Config mancante.")
         return
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": "HTML"}
-    try:
-        r = requests.post(url, data=payload)
-        if r.status_code == 200:
-            print(f"[TELEGRAM] Messaggio inviato: {text}")
-        else:
-            print(f"[TELEGRAM ERROR] {r.status_code} - {r.text}")
-    except Exception as e:
-        print(f"[TELEGRAM EXCEPTION] {e}")
+    bus = get_bus()
+    if "telegram" in bus.channels():
+        bus.publish(text, priority=True, backends=["telegram"])
+        return
+    # telegram configurato ma fuori da NOTIFY_BACKENDS: invio diretto invece di scartare il messaggio
+    print("[TELEGRAM] canale non attivo nel bus (NOTIFY_BACKENDS): invio diretto")
+    backend = TelegramBackend()
+    backend.send(text)
+    backend.close(15.0)
 
 if __name__ == "__main__":
     send_telegram_message("✅ Test Telegram dal Bot Oro")
@@ -0,0 +1,141 @@
+"""Rilevamento modifiche (bot_oro.sheet_changed): le scritture del bot non forzano la riconciliazione."""
+import re
+
+import pytest
+
+import bot_oro
+
+HEADER = ["Data/Ora", "ID Trade", "Lato", "Stato", "Prezzo ingresso", "Qty", "SL %", "TP1 %", "TP2 %",
+          "Prezzo chiusura", "P&L %", "P&L valore", "Equity post-trade", "Ultimo ping"]
+
+
+def _cell(a1):
+    m = re.match(r"([A-Z]+)(\d+)", a1)
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + ord(ch) - 64
+    return int(m.group(2)), col
+
+
+class FakeWorksheet:
+    def __init__(self, sh, title, rows):
+        self.spreadsheet, self.title, self.rows = sh, title, rows
+
+    def set(self, r, c, v):
+        while len(self.rows) < r:
+            self.rows.append([])
+        row = self.rows[r - 1]
+        row.extend([""] * (c - len(row)))
+        row[c - 1] = v
+
+    def col_values(self, c):
+        return [row[c - 1] if len(row) >= c else "" for row in self.rows]
+
+
+class FakeSpreadsheet:
+    """Tab in memoria; la cella checksum della tab di stato si calcola come la formula di checksum_formula."""
+
+    def __init__(self, H):
+        self.H = H
+        self.tabs = {}
+        self.trade = self.add("Trade", [list(HEADER)])
+        self.add(bot_oro.SHEET_TAB_STATUS, [["Tab Trade", "Checksum"]])
+
+    def add(self, title, rows):
+        ws = self.tabs[title] = FakeWorksheet(self, title, rows)
+        return ws
+
+    def worksheet(self, title):
+        return self.tabs[title]
+
+    def values_batch_update(self, body):
+        for u in body["data"]:
+            tab, rng = u["range"].split("!")
+            ws = self.tabs[tab.strip("'")]
+            r0, c0 = _cell(rng.split(":")[0])
+            for i, vals in enumerate(u["values"]):
+                for j, v in enumerate(vals):
+                    ws.set(r0 + i, c0 + j, v)
+
+    def checksum(self):
+        total = 0
+        for key in bot_oro.CHECKSUM_KEYS:
+            c = self.H.get(key)
+            if not c:
+                continue
+            for r, v in enumerate(self.trade.col_values(c)[1:], start=2):
+                v = str(v)
+                try:
+                    num = float(v)
+                except ValueError:
+                    num = 0
+                total += r * (len(v) + (ord(v[0]) if v else 0) + num)
+        return total
+
+    def values_get(self, rng, params=None):
+        return {"values": [[self.checksum()]]}
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    H = bot_oro.build_header_map(HEADER)
+    sh = FakeSpreadsheet(H)
+    monkeypatch.setattr(bot_oro, "CHANGE_DETECT", True)
+    monkeypatch.setattr(bot_oro, "RECONCILE_FORCE_SECONDS", 10 ** 12)
+    for name in ("_STATUS_WS", "_CHECKSUM_ROW", "_CHECKSUM_SEEN", "_LAST_FULL_RECONCILE", "_TRADE_INDEX"):
+        monkeypatch.setattr(bot_oro, name, {})
+    monkeypatch.setattr(bot_oro, "_CHECKSUM_PENDING", set())
+    monkeypatch.setattr(bot_oro, "_H_CACHE", H)
+    assert bot_oro.sheet_changed(sh.trade, H)   # primo controllo: riferimento
+    return sh, H
+
+
+def test_bot_write_does_not_trigger_pass(sheet):
+    sh, H = sheet
+    bot_oro.batch_update_ws(sh.trade, [{"range": "A2:F2",
+                                        "values": [["2024-01-01 10:00:00", "PAXG-1-A", "LONG", "APERTO", "2000", "1"]]}])
+    bot_oro.mark_sheet_written(sh.trade, H)
+    assert not bot_oro.sheet_changed(sh.trade, H)
+
+    bot_oro.batch_update_ws(sh.trade, [{"range": "D2", "values": [["CHIUSO"]]},
+                                       {"range": "J2", "values": [["2010"]]}])
+    bot_oro.mark_sheet_written(sh.trade, H)
+    assert not bot_oro.sheet_changed(sh.trade, H)
+
+
+def test_manual_edit_triggers_pass(sheet):
+    sh, H = sheet
+    bot_oro.batch_update_ws(sh.trade, [{"range": "A2:F2",
+                                        "values": [["2024-01-01 10:00:00", "PAXG-1-A", "LONG", "APERTO", "2000", "1"]]}])
+    bot_oro.mark_sheet_written(sh.trade, H)
+    assert not bot_oro.sheet_changed(sh.trade, H)
+
+    sh.trade.set(2, H["prezzo chiusura"], "1990")   # chiusura a mano
+    assert bot_oro.sheet_changed(sh.trade, H)
+    assert not bot_oro.sheet_changed(sh.trade, H)   # ripresa una volta sola
+
+
+def test_same_title_in_two_files_is_tracked_apart(sheet):
+    sh, H = sheet
+    other = FakeSpreadsheet(H)   # shard: stessa tab "Trade" in un altro file
+    assert bot_oro.sheet_changed(other.trade, H)
+    assert bot_oro.trade_index(other.trade) is not bot_oro.trade_index(sh.trade)
+
+    other.trade.set(2, H["prezzo chiusura"], "1990")
+    assert bot_oro.sheet_changed(other.trade, H)
+    assert not bot_oro.sheet_changed(sh.trade, H)
+
+
+def test_manual_edit_before_bot_write_is_not_absorbed(sheet):
+    sh, H = sheet
+    bot_oro.batch_update_ws(sh.trade, [{"range": "A2:F2",
+                                        "values": [["2024-01-01 10:00:00", "PAXG-1-A", "LONG", "APERTO", "2000", "1"]]}])
+    bot_oro.mark_sheet_written(sh.trade, H)
+
+    sh.trade.set(2, H["prezzo chiusura"], "1990")   # a mano, poi il bot scrive prima del controllo
+    bot_oro.checksum_before_write(sh.trade, H)
+    bot_oro.batch_update_ws(sh.trade, [{"range": "A3:F3",
+                                        "values": [["2024-01-01 11:00:00", "PAXG-2-A", "LONG", "APERTO", "2001", "1"]]}])
+    bot_oro.mark_sheet_written(sh.trade, H)
+    assert bot_oro.sheet_changed(sh.trade, H)
+    assert not bot_oro.sheet_changed(sh.trade, H)
@@ -0,0 +1,52 @@
+"""Chiusure TP/SL (bot_oro.update_open_rows_light): stato in memoria e notifiche solo a scrittura riuscita."""
+from decimal import Decimal
+
+import pytest
+
+import bot_oro
+
+HEADER = ["Data/Ora", "ID Trade", "Lato", "Stato", "Prezzo ingresso", "Qty", "SL %", "TP1 %", "TP2 %",
+          "Prezzo chiusura", "P&L %", "P&L valore", "Equity post-trade", "Ultimo ping"]
+
+
+class FakeWorksheet:
+    title = "Trade"
+    spreadsheet = None
+
+
+@pytest.fixture
+def env(monkeypatch):
+    H = bot_oro.build_header_map(HEADER)
+    idx = bot_oro.TradeIndex()
+    idx.open = {"PAXG-1-A": {"row": 2, "side": "LONG", "entry": Decimal("2000"), "qty": Decimal("1")}}
+    idx.rows = {"PAXG-1-A": 2}
+    idx.equity = Decimal("10000")
+    idx.valid = True
+    sent, closed = [], []
+    monkeypatch.setattr(bot_oro, "CHANGE_DETECT", False)
+    monkeypatch.setattr(bot_oro, "trade_index", lambda ws: idx)
+    monkeypatch.setattr(bot_oro, "heartbeat_updates", lambda ws: [])
+    monkeypatch.setattr(bot_oro, "perf_updates", lambda ws: [])
+    monkeypatch.setattr(bot_oro, "log", lambda *a, **k: None)
+    monkeypatch.setattr(bot_oro, "notify", lambda msg, priority=False: sent.append(msg))
+    monkeypatch.setattr(bot_oro, "record_close", lambda *a, **k: closed.append(a))
+    return H, idx, sent, closed
+
+
+def test_failed_write_leaves_trade_open(env, monkeypatch):
+    H, idx, sent, closed = env
+
+    def fail(groups):
+        raise ConnectionError("Sheets non raggiungibile")
+    monkeypatch.setattr(bot_oro, "batch_update_many", fail)
+    with pytest.raises(ConnectionError):
+        bot_oro.update_open_rows_light(FakeWorksheet(), None, None, H, H["ultimo ping"], lastp=Decimal("2100"))
+    assert "PAXG-1-A" in idx.open
+    assert idx.equity == Decimal("10000")
+    assert not sent and not closed
+
+    monkeypatch.setattr(bot_oro, "batch_update_many", lambda groups: [])
+    bot_oro.update_open_rows_light(FakeWorksheet(), None, None, H, H["ultimo ping"], lastp=Decimal("2100"))
+    assert "PAXG-1-A" not in idx.open
+    assert idx.equity > Decimal("10000")
+    assert len(sent) == 1 and len(closed) == 1
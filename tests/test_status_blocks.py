@@ -0,0 +1,27 @@
+"""Blocchi di stato (aggregati, heartbeat): dopo un batch fallito si riscrivono al batch successivo."""
+from datetime import datetime
+from decimal import Decimal
+
+import bot_oro
+from perf_aggregates import PerfAggregates
+
+NOW = datetime(2026, 3, 2, 10, 0)
+
+
+def test_perf_block_rewritten_after_failed_write():
+    p = PerfAggregates("")
+    p.add(NOW, "PAXGUSDT", 5.0, 4000.0)
+    assert p.block_update("Riepilogo", NOW) is not None
+    assert p.block_update("Riepilogo", NOW) is None
+    p.block_failed()
+    assert p.block_update("Riepilogo", NOW) is not None
+    assert p.block_update("Riepilogo", NOW) is None
+
+
+def test_heartbeat_block_rewritten_after_failed_write():
+    ring = bot_oro.HeartbeatRing(3)
+    ring.add("PAXGUSDT", Decimal("2000"), 0.5)
+    assert ring.block_update("Stato") is not None
+    assert ring.block_update("Stato") is None
+    ring.block_failed()
+    assert ring.block_update("Stato") is not None
@@ -0,0 +1,112 @@
+# tick_recorder.py
+"""
+Registratore dei prezzi visti dal bot live (get_last_price).
+- Formato binario append-only a record fissi di 17 byte, little-endian:
+    ts (float64, epoch secondi) | price (float64) | source (uint8, vedi SOURCES)
+- Un file per simbolo e giorno UTC: {dir}/{SYMBOL}-{YYYYMMDD}.ticks
+- Scrittura bufferizzata (nessun fsync): costo per campione nell'ordine del microsecondo.
+- Lettura via memory mapping come array numpy strutturato (load_ticks / load_ticks_range),
+  pronto per replay.py e per il backtest.
+"""
+import os
+import glob
+import struct
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+RECORD = struct.Struct("<ddB")
+RECORD_SIZE = RECORD.size  # 17
+
+# Origine del campione
+SOURCES = {
+    "live": 0,     # lettura Binance riuscita
+    "cache": 1,    # prezzo servito dalla cache (PRICE_MIN_INTERVAL)
+    "banned": 2,   # Binance in ban: ultimo prezzo noto
+    "error": 3,    # errore API: ultimo prezzo noto
+}
+
+
+def _day_key(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d")
+
+
+class TickRecorder:
+    def __init__(self, directory: str, symbol: str,
+                 flush_seconds: float = 5.0, buffer_bytes: int = 64 * 1024):
+        self.directory = directory
+        self.symbol = symbol
+        self.flush_seconds = flush_seconds
+        self.buffer_bytes = buffer_bytes
+        self._f = None
+        self._day = None
+        self._last_flush = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, day: str) -> str:
+        return os.path.join(self.directory, f"{self.symbol}-{day}.ticks")
+
+    def _roll(self, day: str):
+        if self._f is not None:
+            self._f.close()
+        path = self.path_for(day)
+        # riallinea se l'ultimo record è stato troncato da un crash
+        if os.path.exists(path):
+            extra = os.path.getsize(path) % RECORD_SIZE
+            if extra:
+                with open(path, "r+b") as f:
+                    f.truncate(os.path.getsize(path) - extra)
+        self._f = open(path, "ab", buffering=self.buffer_bytes)
+        self._day = day
+
+    def record(self, ts: float, price: float, source: int = 0):
+        day = _day_key(ts)
+        if day != self._day:
+            self._roll(day)
+        self._f.write(RECORD.pack(ts, price, source))
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_seconds:
+            self._f.flush()
+            self._last_flush = now
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            self._day = None
+
+
+# ------------------ Lettura ------------------
+def tick_dtype():
+    import numpy as np
+    return np.dtype([("ts", "<f8"), ("price", "<f8"), ("source", "u1")])
+
+def load_ticks(path: str):
+    """Array strutturato (ts, price, source) mappato in memoria, senza copia."""
+    import numpy as np
+    n = os.path.getsize(path) // RECORD_SIZE
+    if n == 0:
+        return np.zeros(0, dtype=tick_dtype())
+    return np.memmap(path, dtype=tick_dtype(), mode="r", shape=(n,))
+
+def tick_files(directory: str, symbol: str,
+               start_day: Optional[str] = None, end_day: Optional[str] = None) -> List[str]:
+    """File del simbolo ordinati per giorno; start_day/end_day in formato YYYYMMDD, inclusivi."""
+    out = []
+    for p in sorted(glob.glob(os.path.join(directory, f"{symbol}-*.ticks"))):
+        day = os.path.basename(p)[len(symbol) + 1:-len(".ticks")]
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+        out.append(p)
+    return out
+
+def load_ticks_range(directory: str, symbol: str,
+                     start_day: Optional[str] = None, end_day: Optional[str] = None,
+                     sources=None):
+    """Concatena più giorni; sources (es. [SOURCES["live"]]) filtra per origine."""
+    import numpy as np
+    parts = [load_ticks(p) for p in tick_files(directory, symbol, start_day, end_day)]
+    arr = np.concatenate(parts) if parts else np.zeros(0, dtype=tick_dtype())
+    if sources is not None:
+        arr = arr[np.isin(arr["source"], list(sources))]
+    return arr